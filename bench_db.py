@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+数据库读写争用基准测试
+在临时数据库上模拟记录写入器的批量写入，同时并发执行管理后台的记录列表查询，
+对比默认 SQLite 配置和调优配置（WAL + 独立读写引擎）下的写入吞吐、查询延迟和锁错误数
+
+用法: python bench_db.py [秒数] [读线程数] [每批记录数]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, desc
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, APIRecord, create_sqlite_engine, DB_READ_POOL_SIZE
+
+RESPONSE_BODY = "data: " + "x" * 2048  # 模拟一条中等大小的响应
+
+def make_profile(name: str, url: str, readers: int):
+    """返回 (写入会话工厂, 只读会话工厂)"""
+    if name == "default":
+        # 原来的配置：所有操作共用一个引擎，rollback 日志模式
+        default_engine = create_engine(url, connect_args={"check_same_thread": False})
+        factory = sessionmaker(autocommit=False, autoflush=False, bind=default_engine)
+        return factory, factory, [default_engine]
+    writer_engine = create_sqlite_engine(url, pool_size=1, max_overflow=0, pool_timeout=60)
+    reader_engine = create_sqlite_engine(url, query_only=True, pool_size=max(readers, DB_READ_POOL_SIZE), max_overflow=0)
+    return (
+        sessionmaker(autocommit=False, autoflush=False, bind=writer_engine),
+        sessionmaker(autocommit=False, autoflush=False, bind=reader_engine),
+        [writer_engine, reader_engine]
+    )
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+def run_profile(name: str, seconds: float, readers: int, batch_size: int):
+    path = os.path.join(tempfile.mkdtemp(prefix="redwolf_bench_"), "bench.db")
+    url = f"sqlite:///{path}"
+    writer_factory, reader_factory, engines = make_profile(name, url, readers)
+    Base.metadata.create_all(bind=engines[0])
+
+    stop = threading.Event()
+    stats = {"written": 0, "batches": 0, "write_errors": 0, "read_errors": 0}
+    write_latencies = []
+    read_latencies = []
+    lock = threading.Lock()
+
+    def writer():
+        while not stop.is_set():
+            db = writer_factory()
+            started = time.perf_counter()
+            try:
+                db.add_all([
+                    APIRecord(method="POST", path="/v1/messages", headers="{}", body="{}",
+                              response_status=200, response_body=RESPONSE_BODY, duration_ms=100,
+                              target_platform="bench", target_model="bench-model",
+                              input_tokens=100, output_tokens=200, total_tokens=300)
+                    for _ in range(batch_size)
+                ])
+                db.commit()
+                with lock:
+                    stats["written"] += batch_size
+                    stats["batches"] += 1
+                    write_latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    stats["write_errors"] += 1
+            finally:
+                db.close()
+
+    def reader():
+        while not stop.is_set():
+            db = reader_factory()
+            started = time.perf_counter()
+            try:
+                # 与 /_api/records 相同的查询
+                db.query(APIRecord).order_by(desc(APIRecord.timestamp)).limit(100).all()
+                with lock:
+                    read_latencies.append(time.perf_counter() - started)
+            except OperationalError:
+                with lock:
+                    stats["read_errors"] += 1
+            finally:
+                db.close()
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    for bench_engine in engines:
+        bench_engine.dispose()
+
+    print(f"📊 [{name}]")
+    print(f"   写入: {stats['written'] / seconds:.0f} 条/秒, {stats['batches']} 批, "
+          f"批次延迟 p50={percentile(write_latencies, 0.5) * 1000:.1f}ms "
+          f"p99={percentile(write_latencies, 0.99) * 1000:.1f}ms, 锁错误 {stats['write_errors']}")
+    print(f"   查询: {len(read_latencies) / seconds:.0f} 次/秒, "
+          f"延迟 p50={percentile(read_latencies, 0.5) * 1000:.1f}ms "
+          f"p95={percentile(read_latencies, 0.95) * 1000:.1f}ms "
+          f"p99={percentile(read_latencies, 0.99) * 1000:.1f}ms, 锁错误 {stats['read_errors']}")
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    print(f"🚀 数据库读写争用测试: {seconds:.0f} 秒, 1 个写线程 (每批 {batch_size} 条), {readers} 个读线程")
+    for profile in ("default", "tuned"):
+        run_profile(profile, seconds, readers, batch_size)
+    print("✅ 测试完成")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+JSON 后端端到端基准测试
+分别使用每个已安装的 JSON 后端（orjson / ujson / json），在临时目录的数据库上通过模拟的上游平台
+转发非流式和流式请求（包括请求解析、格式转换、SSE编码和记录写入），统计每个请求消耗的进程CPU时间
+
+用法: python bench_json.py [每种请求数] [历史消息数]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKENDS = ("orjson", "ujson", "json")
+TARGET_MODEL = "bench-model"
+USER_KEY = "lxs_bench_json"
+CHUNKS = 50  # 流式响应的数据块数
+
+def make_body(index: int, history: int, stream: bool) -> dict:
+    """模拟 Claude Code 的请求：系统提示、若干轮历史消息和工具定义"""
+    messages = []
+    for turn in range(history):
+        messages.append({"role": "user", "content": [{"type": "text", "text": f"第{turn}轮问题：请修改 handler.py 中的函数 " * 8}]})
+        messages.append({"role": "assistant", "content": [{"type": "text", "text": f"好的，修改如下 \"code\" {turn}\n" * 8}]})
+    messages.append({"role": "user", "content": f"请求 {index}"})
+    return {
+        "model": "claude-bench",
+        "stream": stream,
+        "max_tokens": 4096,
+        "system": [{"type": "text", "text": "You are a coding assistant. " * 50}],
+        "tools": [
+            {"name": f"Tool{i}", "description": "工具说明 " * 20,
+             "input_schema": {"type": "object", "properties": {"path": {"type": "string"}}, "required": ["path"]}}
+            for i in range(10)
+        ],
+        "messages": messages
+    }
+
+async def upstream(request):
+    import httpx
+    payload = json.loads(request.content)
+    if not payload.get("stream"):
+        return httpx.Response(200, json={
+            "id": "chatcmpl-bench", "object": "chat.completion", "model": TARGET_MODEL,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "完成了修改 \"ok\"\n" * 20}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": 100}
+        })
+
+    async def stream():
+        for i in range(CHUNKS):
+            event = {"id": "chatcmpl-bench", "choices": [{"delta": {"content": f"片段 {i} \"x\"\n"}, "finish_reason": None}]}
+            yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+        done = {"id": "chatcmpl-bench", "choices": [{"delta": {}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1000, "completion_tokens": CHUNKS}}
+        yield f"data: {json.dumps(done)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+    return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+
+def run_child(requests: int, history: int):
+    """在子进程中运行：JSON_BACKEND 已通过环境变量指定，数据库在临时目录"""
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(tempfile.mkdtemp(prefix="redwolf_bench_json_"))
+    import httpx
+    import fast_json
+    import main
+    from database import SessionLocal, PlatformConfig, RoutingConfig, UserKey
+    from platforms import PlatformType
+
+    logging.getLogger().setLevel(logging.WARNING)
+    db = SessionLocal()
+    try:
+        db.add(PlatformConfig(platform_type="openai_compatible", api_key="bench", base_url="http://upstream", enabled=True, timeout=60))
+        db.add(RoutingConfig(
+            config_name="bench", config_type="global_direct", is_active=True,
+            config_data=json.dumps({"model_priority_list": [f"openai_compatible:{TARGET_MODEL}"]})
+        ))
+        db.add(UserKey(key_name="bench", api_key=USER_KEY))
+        db.commit()
+    finally:
+        db.close()
+    main.config_data.update({"use_multi_platform": True, "current_work_mode": "global_direct"})
+
+    bodies = {stream: [json.dumps(make_body(i, history, stream)).encode() for i in range(requests)] for stream in (False, True)}
+
+    async def run():
+        service = main.multi_platform_service
+        db = SessionLocal()
+        try:
+            await service.start(db)
+        finally:
+            db.close()
+        service.platform_manager.get_platform(PlatformType.OPENAI_COMPATIBLE).client = httpx.AsyncClient(
+            transport=httpx.MockTransport(upstream)
+        )
+        main.record_writer.start()
+        results = {}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://proxy", timeout=120) as client:
+            headers = {"authorization": f"Bearer {USER_KEY}", "content-type": "application/json"}
+            # 预热：初始化平台客户端和分词器
+            for stream in (False, True):
+                await client.post("/v1/messages", content=bodies[stream][0], headers=headers)
+            await main.record_writer.flush()
+
+            for stream in (False, True):
+                cpu_started = time.process_time()
+                started = time.perf_counter()
+                for body in bodies[stream]:
+                    response = await client.post("/v1/messages", content=body, headers=headers)
+                    assert response.status_code == 200, f"HTTP {response.status_code}: {response.text[:200]}"
+                # 记录写入也计入每个请求的开销
+                await main.record_writer.flush()
+                results["stream" if stream else "non_stream"] = {
+                    "cpu_ms": (time.process_time() - cpu_started) * 1000 / len(bodies[stream]),
+                    "wall_ms": (time.perf_counter() - started) * 1000 / len(bodies[stream])
+                }
+        await main.record_writer.stop()
+        return results
+
+    results = asyncio.run(run())
+    results["backend"] = fast_json.BACKEND
+    results["request_bytes"] = len(bodies[True][0])
+    print(json.dumps(results))
+
+def installed(backend: str) -> bool:
+    if backend == "json":
+        return True
+    try:
+        __import__(backend)
+        return True
+    except ImportError:
+        return False
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_child(int(sys.argv[2]), int(sys.argv[3]))
+        sys.exit(0)
+
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    history = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"🚀 JSON 后端端到端测试: 非流式和流式各 {requests} 个请求, 每个请求 {history} 轮历史消息, 流式响应 {CHUNKS} 个数据块")
+    for backend in BACKENDS:
+        if not installed(backend):
+            print(f"⏭️ {backend} 未安装，跳过")
+            continue
+        # 每个后端在独立的进程中运行，fast_json 在导入时选择后端
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", str(requests), str(history)],
+            env={**os.environ, "JSON_BACKEND": backend}, capture_output=True, text=True
+        )
+        if output.returncode != 0:
+            print(f"❌ {backend} 测试失败:\n{output.stderr[-2000:]}")
+            sys.exit(1)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        print(f"📊 [{result['backend']}] 请求体 {result['request_bytes'] // 1024} KB: "
+              f"非流式 CPU {result['non_stream']['cpu_ms']:.2f}ms/请求 (耗时 {result['non_stream']['wall_ms']:.2f}ms), "
+              f"流式 CPU {result['stream']['cpu_ms']:.2f}ms/请求 (耗时 {result['stream']['wall_ms']:.2f}ms)")
+    print("✅ 测试完成")
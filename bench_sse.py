@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+SSE 事件编码基准测试
+按一次流式响应的事件顺序（message_start、content_block_start、ping、大量 text_delta、结束事件）编码，
+对比原来“构造字典 + json.dumps”的方式和 SSEEncoder 字节模板的每块耗时，并检查两者输出的字节完全相同
+
+用法: python bench_sse.py [每次响应的数据块数] [重复次数]
+"""
+
+import json
+import sys
+import time
+
+import fast_json
+from sse_encoder import SSEEncoder
+
+# 覆盖需要转义的字符：引号、反斜杠、换行、控制字符、中文、emoji 和 JSON 中不转义的 U+2028
+SAMPLE_TEXTS = (
+    "Hello", " world", "，这是中文", ' "quoted" ', "back\\slash", "line\nbreak\t",
+    "\x00\x1f\x7f", "emoji 🐺", "  ", "<use_tool>", "", "def f():\n    return 1\n",
+)
+
+class LegacySSE:
+    """原来 StreamingConverter 的事件编码：每个事件构造字典后 json.dumps 成字符串"""
+
+    def __init__(self):
+        self.event_id = 0
+
+    def _event(self, event_type: str, data: dict) -> str:
+        self.event_id += 1
+        return f"id:{self.event_id}\nevent:{event_type}\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n"
+
+    def message_start(self, message_id: str, model: str) -> str:
+        return self._event("message_start", {
+            "type": "message_start",
+            "message": {
+                "model": model, "role": "assistant", "id": message_id, "type": "message",
+                "content": [], "usage": {"input_tokens": 0, "output_tokens": 0}
+            }
+        })
+
+    def text_block_start(self) -> str:
+        return self._event("content_block_start", {"type": "content_block_start", "content_block": {"type": "text", "text": ""}, "index": 0})
+
+    def ping(self) -> str:
+        return self._event("ping", {"type": "ping"})
+
+    def text_delta(self, text: str) -> str:
+        return self._event("content_block_delta", {"delta": {"type": "text_delta", "text": text}, "type": "content_block_delta", "index": 0})
+
+    def content_block_stop(self) -> str:
+        return self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+
+    def message_delta(self, stop_reason: str, input_tokens: int, output_tokens: int) -> str:
+        return self._event("message_delta", {
+            "delta": {"stop_reason": stop_reason},
+            "type": "message_delta",
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens, "cache_read_input_tokens": 0}
+        })
+
+    def message_stop(self) -> str:
+        return self._event("message_stop", {"type": "message_stop"})
+
+def encode_legacy(texts):
+    encoder = LegacySSE()
+    out = [encoder.message_start("msg_bench", "claude-bench"), encoder.text_block_start(), encoder.ping()]
+    out += [encoder.text_delta(text) for text in texts]
+    out += [encoder.content_block_stop(), encoder.message_delta("end_turn", 100, len(texts)), encoder.message_stop()]
+    # 原来的输出是字符串，发送前由 StreamingResponse 编码为 UTF-8
+    return [event.encode("utf-8") for event in out]
+
+def encode_templates(texts):
+    encoder = SSEEncoder()
+    out = [encoder.message_start("msg_bench", "claude-bench"), encoder.text_block_start(), encoder.ping()]
+    out += [encoder.text_delta(text) for text in texts]
+    out += [encoder.content_block_stop(), encoder.message_delta("end_turn", 100, len(texts)), encoder.message_stop()]
+    return out
+
+def best_time(func, texts, repeat: int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(texts)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+if __name__ == "__main__":
+    chunks = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    texts = [SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)] + str(i) for i in range(chunks)]
+    print(f"🚀 SSE 编码测试: 每次响应 {chunks} 个数据块, 重复 {repeat} 次取最快, JSON 后端 {fast_json.BACKEND}")
+
+    legacy_seconds, legacy_out = best_time(encode_legacy, texts, repeat)
+    template_seconds, template_out = best_time(encode_templates, texts, repeat)
+    events = len(legacy_out)
+    print(f"📊 字典 + json.dumps: 每块 {legacy_seconds / events * 1e6:.2f}us")
+    print(f"📊 字节模板:         每块 {template_seconds / events * 1e6:.2f}us, 加速 {legacy_seconds / template_seconds:.1f}x")
+
+    if legacy_out != template_out:
+        mismatch = next(i for i, (a, b) in enumerate(zip(legacy_out, template_out)) if a != b)
+        print(f"❌ 第 {mismatch} 个事件输出不同:\n   {legacy_out[mismatch]!r}\n   {template_out[mismatch]!r}")
+        sys.exit(1)
+    print(f"✅ {events} 个事件输出字节完全相同")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+流式转发延迟基准测试
+在临时目录的数据库上预置大量记录，通过模拟的上游平台持续发起流式请求，
+对比空闲时、管理后台统计/记录查询持续运行时的首包耗时（TTFB）和数据块间隔，
+以及同样的统计查询直接在事件循环中执行时的情况，用于确认同步数据库查询不会阻塞事件循环、拖慢正在转发的流
+
+用法: python bench_streams.py [每阶段秒数] [并发流数] [查询并发数] [预置记录数]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# 数据库文件为当前目录下的 api_records.db，切换到临时目录，不影响正在使用的数据库
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+os.chdir(tempfile.mkdtemp(prefix="redwolf_bench_"))
+
+import httpx
+
+import main
+from database import SessionLocal, ReadSessionLocal, PlatformConfig, RoutingConfig, UserKey, APIRecord, KeyUsageLog
+from platforms import PlatformType
+
+TARGET_MODEL = "bench-model"
+USER_KEY = "lxs_bench_test"
+KEY_COUNT = 5
+CHUNKS = 20              # 每个响应的数据块数
+CHUNK_INTERVAL = 0.02    # 上游发送数据块的间隔（秒）
+
+# 管理后台中最重的几个查询
+LOAD_PATHS = (
+    "/_api/keys/statistics/overview",
+    "/_api/keys/1/statistics",
+    "/_api/records?limit=100",
+    "/_api/records?limit=100&status=error",
+    "/_api/models/from-db",
+    "/_api/keys",
+)
+
+# 对比用：在事件循环中直接执行的统计查询（改为线程池执行之前的方式）
+BLOCKING_QUERIES = (
+    lambda db: main.get_all_keys_statistics(start_date=None, end_date=None, session=None, db=db),
+    lambda db: main.get_key_statistics(1, start_date=None, end_date=None, session=None, db=db),
+)
+
+# 每个请求都会输出多行转发日志，测试时只显示警告和错误
+logging.getLogger().setLevel(logging.WARNING)
+
+def setup_database(record_count: int):
+    """添加平台、全局直连路由和用户KEY，并预置历史记录和KEY使用记录"""
+    db = SessionLocal()
+    try:
+        db.add(PlatformConfig(platform_type="openai_compatible", api_key="bench", base_url="http://upstream", enabled=True, timeout=60))
+        db.add(RoutingConfig(
+            config_name="bench", config_type="global_direct", is_active=True,
+            config_data=json.dumps({"model_priority_list": [f"openai_compatible:{TARGET_MODEL}"]})
+        ))
+        db.add_all([UserKey(key_name=f"bench-{i}", api_key=USER_KEY if i == 0 else f"lxs_bench_{i}") for i in range(KEY_COUNT)])
+        db.commit()
+
+        now = datetime.utcnow()
+        for start in range(0, record_count, 5000):
+            records = []
+            logs = []
+            for i in range(start, min(start + 5000, record_count)):
+                timestamp = now - timedelta(seconds=random.randint(0, 30 * 86400))
+                key_id = i % KEY_COUNT + 1
+                model = f"model-{i % 7}"
+                records.append({
+                    "id": i + 1, "method": "POST", "path": "/v1/messages", "headers": "{}",
+                    "body": '{"messages": []}', "response_status": 200 if i % 10 else 500,
+                    "response_body": "{}", "duration_ms": random.randint(100, 5000), "timestamp": timestamp,
+                    "target_platform": "openai_compatible", "target_model": model, "user_key_id": key_id,
+                    "input_tokens": 100, "output_tokens": 200, "total_tokens": 300
+                })
+                logs.append({
+                    "user_key_id": key_id, "api_record_id": i + 1, "model_name": model,
+                    "platform_type": "openai_compatible", "input_tokens": 100, "output_tokens": 200,
+                    "total_tokens": 300, "timestamp": timestamp
+                })
+            db.bulk_insert_mappings(APIRecord, records)
+            db.bulk_insert_mappings(KeyUsageLog, logs)
+            db.commit()
+    finally:
+        db.close()
+    main.config_data.update({"use_multi_platform": True, "current_work_mode": "global_direct"})
+
+async def upstream(request: httpx.Request) -> httpx.Response:
+    async def stream():
+        for i in range(CHUNKS):
+            await asyncio.sleep(CHUNK_INTERVAL)
+            event = {"id": "chatcmpl-bench", "choices": [{"delta": {"content": f"part{i} "}, "finish_reason": None}]}
+            yield f"data: {json.dumps(event)}\n\n".encode()
+        done = {"id": "chatcmpl-bench", "choices": [{"delta": {}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": CHUNKS}}
+        yield f"data: {json.dumps(done)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+    return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+
+async def stream_once(ttfbs: list, gaps: list):
+    """直接调用 ASGI 应用发起一次流式请求，记录客户端收到每个数据块的时间"""
+    body = json.dumps({"model": "bench", "stream": True, "messages": [{"role": "user", "content": "hi"}]}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/v1/messages", "raw_path": b"/v1/messages", "root_path": "",
+        "query_string": b"", "client": ("127.0.0.1", 0), "server": ("proxy", 80),
+        "headers": [(b"content-type", b"application/json"), (b"authorization", f"Bearer {USER_KEY}".encode())],
+    }
+    request_sent = False
+    chunk_times = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # 客户端不会断开，等待响应结束后被取消
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunk_times.append(time.perf_counter())
+
+    started = time.perf_counter()
+    await main.app(scope, receive, send)
+    if chunk_times:
+        ttfbs.append(chunk_times[0] - started)
+        gaps.extend(b - a for a, b in zip(chunk_times, chunk_times[1:]))
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+async def run_phase(name: str, seconds: float, streams: int, loaders: int, admin: httpx.AsyncClient, blocking: bool = False):
+    stop = asyncio.Event()
+    ttfbs: list = []
+    gaps: list = []
+    query_latencies: list = []
+
+    async def streamer():
+        while not stop.is_set():
+            await stream_once(ttfbs, gaps)
+
+    async def loader():
+        while not stop.is_set():
+            started = time.perf_counter()
+            if blocking:
+                db = ReadSessionLocal()
+                try:
+                    random.choice(BLOCKING_QUERIES)(db)
+                finally:
+                    db.close()
+                await asyncio.sleep(0)
+            else:
+                response = await admin.get(random.choice(LOAD_PATHS))
+                assert response.status_code == 200, f"{response.url}: HTTP {response.status_code}"
+            query_latencies.append(time.perf_counter() - started)
+
+    tasks = [asyncio.create_task(streamer()) for _ in range(streams)]
+    tasks += [asyncio.create_task(loader()) for _ in range(loaders)]
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    print(f"📊 [{name}]")
+    print(f"   流式请求: {len(ttfbs)} 个, 首包耗时 p50={percentile(ttfbs, 0.5) * 1000:.1f}ms "
+          f"p99={percentile(ttfbs, 0.99) * 1000:.1f}ms max={max(ttfbs, default=0) * 1000:.1f}ms")
+    print(f"   数据块间隔 (上游 {CHUNK_INTERVAL * 1000:.0f}ms): p50={percentile(gaps, 0.5) * 1000:.1f}ms "
+          f"p99={percentile(gaps, 0.99) * 1000:.1f}ms max={max(gaps, default=0) * 1000:.1f}ms")
+    if loaders:
+        print(f"   统计查询: {len(query_latencies) / seconds:.1f} 次/秒, "
+              f"延迟 p50={percentile(query_latencies, 0.5) * 1000:.1f}ms p99={percentile(query_latencies, 0.99) * 1000:.1f}ms")
+
+async def run(seconds: float, streams: int, loaders: int):
+    service = main.multi_platform_service
+    db = SessionLocal()
+    try:
+        await service.start(db)
+    finally:
+        db.close()
+    service.platform_manager.get_platform(PlatformType.OPENAI_COMPATIBLE).client = httpx.AsyncClient(
+        transport=httpx.MockTransport(upstream)
+    )
+    main.record_writer.start()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://proxy", timeout=120) as admin:
+        response = await admin.post("/_api/login", json={"username": "admin", "password": "admin"})
+        assert response.status_code == 200, f"登录失败: {response.text}"
+        # 预热：首批请求会初始化平台客户端和分词器，不计入结果
+        await asyncio.gather(*[stream_once([], []) for _ in range(streams)])
+        await run_phase("空闲", seconds, streams, 0, admin)
+        await run_phase("统计查询负载", seconds, streams, loaders, admin)
+        await run_phase("统计查询负载（对比：在事件循环中执行）", seconds, streams, loaders, admin, blocking=True)
+    await main.record_writer.stop()
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    loaders = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    record_count = int(sys.argv[4]) if len(sys.argv) > 4 else 100000
+    print(f"🚀 流式转发延迟测试: 每阶段 {seconds:.0f} 秒, {streams} 个并发流, {loaders} 个并发统计查询, 预置 {record_count} 条记录, CPU {os.cpu_count()} 核")
+    setup_database(record_count)
+    asyncio.run(run(seconds, streams, loaders))
+    print("✅ 测试完成")
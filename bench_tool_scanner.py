@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+工具调用解析基准测试
+把包含大参数 <use_tool> 工具调用的模型输出按小块流式输入，对比原来的“缓冲区累积 + 正则搜索”方式
+和 ToolUseScanner 增量扫描的耗时，并检查两者解析出的工具调用相同
+
+用法: python bench_tool_scanner.py [每块字符数] [单项最长秒数]
+"""
+
+import json
+import re
+import sys
+import time
+
+from format_converter import ToolUseScanner
+
+PAYLOAD_SIZES = (50 * 1024, 200 * 1024, 1024 * 1024, 2 * 1024 * 1024)  # 工具参数大小（字节）
+
+class LegacyToolBuffer:
+    """原来 StreamingConverter 的工具调用处理：每块追加到缓冲区，再在整个缓冲区中查找结束标签和正则匹配"""
+
+    def __init__(self):
+        self.tool_use_buffer = ""
+        self.in_tool_use = False
+        self.tools = []
+
+    def feed(self, text: str) -> str:
+        self.tool_use_buffer += text
+        remaining_text = ""
+
+        if "<use_tool>" in self.tool_use_buffer and not self.in_tool_use:
+            self.in_tool_use = True
+            tool_start = self.tool_use_buffer.find("<use_tool>")
+            if tool_start > 0:
+                remaining_text = self.tool_use_buffer[:tool_start]
+                self.tool_use_buffer = self.tool_use_buffer[tool_start:]
+
+        if self.in_tool_use and "</use_tool>" in self.tool_use_buffer:
+            match = re.search(r'<use_tool>(.*?)</use_tool>', self.tool_use_buffer, re.DOTALL)
+            if match:
+                self.tools.append(self._parse(match.group(1)))
+                self.tool_use_buffer = self.tool_use_buffer[match.end():]
+                self.in_tool_use = False
+        elif not self.in_tool_use:
+            remaining_text = text
+            self.tool_use_buffer = ""
+
+        return remaining_text
+
+    @staticmethod
+    def _parse(tool_content: str):
+        tool_name = re.search(r'<tool_name>(.*?)</tool_name>', tool_content, re.DOTALL).group(1).strip()
+        params_str = re.search(r'<parameters>(.*?)</parameters>', tool_content, re.DOTALL).group(1).strip()
+        return {"name": tool_name, "input": json.loads(params_str)}
+
+def make_output(size: int) -> str:
+    """生成一段模型输出：说明文字 + 参数约为 size 字节的 Write 工具调用 + 结尾文字"""
+    content = ("def handler(request):\n    return {'ok': True}  # 示例代码 <tag>\n" * (size // 60 + 1))[:size]
+    params = json.dumps({"file_path": "/tmp/example.py", "content": content}, ensure_ascii=False)
+    return (
+        "我来创建这个文件。\n\n"
+        f"<use_tool>\n<tool_name>Write</tool_name>\n<parameters>{params}</parameters>\n</use_tool>"
+        "\n\n文件已创建。"
+    )
+
+def split_chunks(text: str, chunk_size: int):
+    """按固定大小切块；原方式无法识别被拆开的开始标签，开始标签单独作为一块"""
+    head, tail = text.split("<use_tool>", 1)
+    return (
+        [head[i:i + chunk_size] for i in range(0, len(head), chunk_size)]
+        + ["<use_tool>"]
+        + [tail[i:i + chunk_size] for i in range(0, len(tail), chunk_size)]
+    )
+
+def run_legacy(chunks):
+    buffer = LegacyToolBuffer()
+    for chunk in chunks:
+        buffer.feed(chunk)
+    return buffer.tools
+
+def run_scanner(chunks):
+    scanner = ToolUseScanner()
+    tools = []
+    for chunk in chunks:
+        tools.extend(value for kind, value in scanner.feed(chunk) if kind == "tool")
+    tools.extend(value for kind, value in scanner.finish() if kind == "tool")
+    return tools
+
+def timed(func, chunks):
+    started = time.perf_counter()
+    result = func(chunks)
+    return time.perf_counter() - started, result
+
+if __name__ == "__main__":
+    chunk_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    print(f"🚀 工具调用解析测试: 每块 {chunk_size} 个字符")
+
+    failed = False
+    legacy_estimate = 0.0  # 原方式处理当前大小的预计耗时
+    for index, size in enumerate(PAYLOAD_SIZES):
+        output = make_output(size)
+        chunks = split_chunks(output, chunk_size)
+        scanner_seconds, scanner_tools = timed(run_scanner, chunks)
+        growth = (PAYLOAD_SIZES[index + 1] / size) ** 2 if index + 1 < len(PAYLOAD_SIZES) else 0
+
+        # 原来的方式每块都要扫描整个缓冲区，耗时随大小平方增长，预计超过单项最长时间时跳过
+        if legacy_estimate > budget:
+            print(f"📊 参数 {size // 1024:>5} KB ({len(chunks)} 块): 扫描器 {scanner_seconds * 1000:8.1f}ms, "
+                  f"原方式预计 {legacy_estimate:.0f} 秒，跳过")
+            legacy_estimate *= growth
+            continue
+        legacy_seconds, legacy_tools = timed(run_legacy, chunks)
+        legacy_estimate = legacy_seconds * growth
+
+        same = scanner_tools == legacy_tools and len(scanner_tools) == 1
+        failed = failed or not same
+        print(f"📊 参数 {size // 1024:>5} KB ({len(chunks)} 块): 扫描器 {scanner_seconds * 1000:8.1f}ms, "
+              f"原方式 {legacy_seconds * 1000:9.1f}ms, 加速 {legacy_seconds / scanner_seconds:6.1f}x, "
+              f"结果{'一致' if same else '不一致'}")
+
+    if failed:
+        print("❌ 扫描器和原方式解析出的工具调用不一致")
+        sys.exit(1)
+    print("✅ 测试完成")
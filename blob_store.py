@@ -0,0 +1,185 @@
+"""
+记录大字段存储模块
+APIRecord 的请求体、响应体、请求头等大字段按内容哈希存入 record_blobs 表：
+- 相同内容（例如每次请求都带的系统提示词和请求头）只保存一份
+- 只追加写入：记录只能整体清空，内容不单独删除，因此不维护引用计数，清空记录时一起删除
+- 内容压缩后保存，默认 zlib，安装了 zstandard 时可选 zstd
+- 记录中只保留字段到哈希的映射（blob_refs），查看详情时再取回并解压
+"""
+
+import hashlib
+import logging
+import os
+import zlib
+from typing import Any, Dict, Iterable, List, Optional
+
+import fast_json
+from database import RecordBlob
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BLOB_STORE_ENABLED = os.getenv('BLOB_STORE_ENABLED', 'true').lower() == 'true'
+BLOB_MIN_BYTES = int(os.getenv('BLOB_MIN_BYTES', '512'))              # 小于该长度的字段仍保存在记录中
+BLOB_CODEC = os.getenv('BLOB_CODEC', 'zlib').lower()
+BLOB_COMPRESS_LEVEL = int(os.getenv('BLOB_COMPRESS_LEVEL', '6'))
+
+BLOB_CODECS = ("zlib", "zstd", "none")
+
+# 移到 record_blobs 表的 APIRecord 字段
+BLOB_FIELDS = (
+    "headers", "body", "response_body", "processed_prompt",
+    "processed_headers", "model_raw_headers", "model_raw_response"
+)
+
+# SQLite 单条语句的参数数量有限，IN 查询分批执行
+IN_QUERY_CHUNK = 500
+
+if BLOB_CODEC not in BLOB_CODECS:
+    logger.warning(f"⚠️ [BlobStore] 未知的压缩方式 {BLOB_CODEC}，使用 zlib")
+    BLOB_CODEC = "zlib"
+elif BLOB_CODEC == "zstd" and zstandard is None:
+    logger.warning("⚠️ [BlobStore] 未安装 zstandard，使用 zlib")
+    BLOB_CODEC = "zlib"
+
+def compress(data: bytes, codec: str, level: int = BLOB_COMPRESS_LEVEL) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return data
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("内容使用 zstd 压缩，但未安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+class BlobStore:
+    """内容寻址的大字段存储，在记录写入的同一个事务中使用"""
+
+    def __init__(
+        self,
+        enabled: bool = BLOB_STORE_ENABLED,
+        min_bytes: int = BLOB_MIN_BYTES,
+        codec: str = BLOB_CODEC,
+        level: int = BLOB_COMPRESS_LEVEL
+    ):
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self.codec = codec
+        self.level = level
+
+        # 统计计数
+        self.fields_stored = 0   # 移到 blob 表的字段数
+        self.blobs_created = 0   # 新保存的内容数
+        self.blobs_reused = 0    # 与已有内容相同、直接引用的字段数
+        self.bytes_in = 0        # 移出字段的原始字节数
+        self.bytes_stored = 0    # 新保存内容压缩后的字节数
+
+    def externalize(self, db, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """把一批记录中的大字段移到 record_blobs 表，返回替换后的记录字段（不修改传入的字典）"""
+        if not self.enabled:
+            return records
+
+        pending: Dict[str, List[Any]] = {}  # 内容哈希 -> [原始字节, 本批引用数]
+        result = []
+        for fields in records:
+            stored = dict(fields)
+            refs: Dict[str, str] = {}
+            for name in BLOB_FIELDS:
+                value = fields.get(name)
+                if not isinstance(value, str) or len(value) < self.min_bytes:
+                    continue
+                raw = value.encode("utf-8", errors="replace")
+                digest = hashlib.sha256(raw).hexdigest()
+                if digest in pending:
+                    pending[digest][1] += 1
+                else:
+                    pending[digest] = [raw, 1]
+                refs[name] = digest
+                stored[name] = None
+                self.fields_stored += 1
+                self.bytes_in += len(raw)
+            if refs:
+                stored["blob_refs"] = fast_json.dumps(refs)
+            result.append(stored)
+
+        if pending:
+            self._store(db, pending)
+        return result
+
+    def _store(self, db, pending: Dict[str, List[Any]]):
+        """新内容压缩后插入，已有的内容直接引用"""
+        digests = list(pending)
+        existing = set()
+        for i in range(0, len(digests), IN_QUERY_CHUNK):
+            chunk = digests[i:i + IN_QUERY_CHUNK]
+            existing.update(digest for (digest,) in db.query(RecordBlob.hash).filter(RecordBlob.hash.in_(chunk)))
+
+        for digest, (raw, refs) in pending.items():
+            if digest in existing:
+                self.blobs_reused += refs
+                continue
+            data = compress(raw, self.codec, self.level)
+            db.add(RecordBlob(
+                hash=digest,
+                codec=self.codec,
+                data=data,
+                size_bytes=len(raw),
+                stored_bytes=len(data)
+            ))
+            self.blobs_created += 1
+            self.blobs_reused += refs - 1
+            self.bytes_stored += len(data)
+
+    def load_fields(self, db, record, names: Iterable[str] = BLOB_FIELDS) -> Dict[str, Optional[str]]:
+        """读取记录的大字段，移到 blob 表的字段按哈希取回并解压"""
+        values = {name: getattr(record, name) for name in names}
+        refs = fast_json.loads(record.blob_refs) if record.blob_refs else {}
+        refs = {name: digest for name, digest in refs.items() if name in values}
+        if not refs:
+            return values
+
+        blobs = {
+            blob.hash: blob
+            for blob in db.query(RecordBlob).filter(RecordBlob.hash.in_(set(refs.values()))).all()
+        }
+        for name, digest in refs.items():
+            blob = blobs.get(digest)
+            if blob is None:
+                logger.warning(f"⚠️ [BlobStore] 记录 {record.id} 的字段 {name} 内容不存在: {digest}")
+                continue
+            try:
+                values[name] = decompress(blob.data, blob.codec).decode("utf-8", errors="replace")
+            except Exception as e:
+                logger.error(f"❌ [BlobStore] 记录 {record.id} 的字段 {name} 解压失败: {e}")
+        return values
+
+    @staticmethod
+    def clear(db):
+        """删除所有内容（清空记录时调用）"""
+        db.query(RecordBlob).delete()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "codec": self.codec,
+            "min_bytes": self.min_bytes,
+            "fields_stored": self.fields_stored,
+            "blobs_created": self.blobs_created,
+            "blobs_reused": self.blobs_reused,
+            "bytes_in": self.bytes_in,
+            "bytes_stored": self.bytes_stored,
+            "ratio": round(self.bytes_stored / self.bytes_in, 4) if self.bytes_in else 0
+        }
+
+# 全局大字段存储实例
+blob_store = BlobStore()
@@ -0,0 +1,162 @@
+"""
+流式响应捕获模块
+流式转发时保留响应副本用于记录，按配置的模式限制每个流占用的内存：
+- head_tail（默认）: 只保留开头和结尾各N KB，中间部分丢弃
+- full: 完整保留，超过阈值后写入临时文件；交给记录的内容仍有上限，超过时截掉中间部分
+- metadata: 只记录大小和块数，不保留内容
+"""
+
+import logging
+import os
+import tempfile
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_MODE = os.getenv('CAPTURE_MODE', 'head_tail')
+CAPTURE_HEAD_KB = int(os.getenv('CAPTURE_HEAD_KB', '64'))     # head_tail 模式保留的开头大小
+CAPTURE_TAIL_KB = int(os.getenv('CAPTURE_TAIL_KB', '64'))     # head_tail 模式保留的结尾大小
+CAPTURE_SPILL_KB = int(os.getenv('CAPTURE_SPILL_KB', '1024'))  # full 模式超过该大小后写入临时文件
+CAPTURE_MAX_KB = int(os.getenv('CAPTURE_MAX_KB', '4096'))      # full 模式交给记录的最大大小，超过时截掉中间部分
+
+CAPTURE_MODES = ("full", "head_tail", "metadata")
+
+if CAPTURE_MODE not in CAPTURE_MODES:
+    logger.warning(f"⚠️ [Capture] 未知的捕获模式 {CAPTURE_MODE}，使用 head_tail")
+    CAPTURE_MODE = "head_tail"
+
+class CaptureBuffer:
+    """单个流的响应捕获缓冲区，内存占用有固定上限"""
+
+    __slots__ = (
+        "mode", "head_bytes", "tail_bytes", "spill_bytes", "max_bytes", "separator",
+        "total_bytes", "chunks", "_head", "_tail", "_file"
+    )
+
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        head_kb: int = CAPTURE_HEAD_KB,
+        tail_kb: int = CAPTURE_TAIL_KB,
+        spill_kb: int = CAPTURE_SPILL_KB,
+        max_kb: int = CAPTURE_MAX_KB,
+        separator: str = ""
+    ):
+        self.mode = mode if mode in CAPTURE_MODES else CAPTURE_MODE
+        self.head_bytes = head_kb * 1024
+        self.tail_bytes = tail_kb * 1024
+        self.spill_bytes = spill_kb * 1024
+        self.max_bytes = max_kb * 1024
+        self.separator = separator.encode("utf-8")  # 块之间的分隔符
+        self.total_bytes = 0
+        self.chunks = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._file = None
+
+    def append(self, data: Union[str, bytes]):
+        """追加一块数据"""
+        if not data:
+            return
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if self.chunks and self.separator:
+            data = self.separator + data
+        self.chunks += 1
+        self.total_bytes += len(data)
+
+        if self.mode == "full":
+            if self._file is None:
+                # 小于阈值时在内存中，超过后自动转存到临时文件
+                self._file = tempfile.SpooledTemporaryFile(max_size=self.spill_bytes)
+            self._file.write(data)
+        elif self.mode == "head_tail":
+            room = self.head_bytes - len(self._head)
+            if room > 0:
+                self._head += data[:room]
+                data = data[room:]
+            if data:
+                self._tail += data
+                # 结尾缓冲区超过两倍大小时才裁剪，避免每块都移动数据
+                if len(self._tail) > 2 * self.tail_bytes:
+                    del self._tail[:len(self._tail) - self.tail_bytes]
+
+    def _trim_tail(self):
+        if len(self._tail) > self.tail_bytes:
+            del self._tail[:len(self._tail) - self.tail_bytes]
+
+    @property
+    def omitted_bytes(self) -> int:
+        """被丢弃的字节数"""
+        if self.mode == "full":
+            return max(0, self.total_bytes - self.max_bytes)
+        if self.mode == "metadata":
+            return self.total_bytes
+        self._trim_tail()
+        return self.total_bytes - len(self._head) - len(self._tail)
+
+    @property
+    def spilled(self) -> bool:
+        """是否已转存到临时文件"""
+        return self.mode == "full" and self.total_bytes > self.spill_bytes
+
+    def _read_full(self):
+        """full 模式：从缓冲文件读取开头和结尾，合计不超过 max_bytes"""
+        if self._file is None:
+            return b"", b""
+        omitted = self.omitted_bytes
+        self._file.seek(0)
+        if not omitted:
+            head, tail = self._file.read(), b""
+        else:
+            head = self._file.read(self.max_bytes // 2)
+            self._file.seek(len(head) + omitted)
+            tail = self._file.read()
+        self._file.seek(0, os.SEEK_END)
+        return head, tail
+
+    def getvalue(self) -> str:
+        """返回捕获的内容，截断处插入说明"""
+        if self.mode == "metadata":
+            return ""
+        omitted = self.omitted_bytes  # head_tail 模式会先裁剪结尾缓冲区
+        if self.mode == "full":
+            head, tail = self._read_full()
+        else:
+            head, tail = bytes(self._head), bytes(self._tail)
+
+        if not omitted:
+            return (head + tail).decode("utf-8", errors="replace")
+        # 截断位置可能落在多字节字符中间，丢弃不完整的字符
+        head = head.decode("utf-8", errors="ignore")
+        tail = tail.decode("utf-8", errors="ignore")
+        return f"{head}\n\n... [已截断 {omitted} 字节] ...\n\n{tail}"
+
+    def info(self) -> Dict[str, Any]:
+        """捕获信息：模式、总大小、是否截断以及截断的字节范围"""
+        omitted = self.omitted_bytes
+        info: Dict[str, Any] = {
+            "mode": self.mode,
+            "total_bytes": self.total_bytes,
+            "chunks": self.chunks,
+            "truncated": omitted > 0
+        }
+        if omitted:
+            if self.mode == "head_tail":
+                start = len(self._head)
+            elif self.mode == "full":
+                start = self.max_bytes // 2
+            else:
+                start = 0
+            info["omitted_range"] = [start, start + omitted]
+        if self.spilled:
+            info["spilled"] = True
+        return info
+
+    def close(self):
+        """释放临时文件和缓冲区"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._head = bytearray()
+        self._tail = bytearray()
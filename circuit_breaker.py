@@ -0,0 +1,323 @@
+"""
+Claude Code 服务器熔断器
+按服务器维护 closed/open/half_open 状态：错误率或慢请求比例过高时熔断，
+熔断的服务器在转发时直接跳过，由后台探测恢复
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from database import SessionLocal, ClaudeCodeServer, run_db
+
+logger = logging.getLogger(__name__)
+
+# 熔断配置
+BREAKER_WINDOW_SIZE = int(os.getenv('BREAKER_WINDOW_SIZE', '20'))            # 统计最近多少次请求
+BREAKER_MIN_REQUESTS = int(os.getenv('BREAKER_MIN_REQUESTS', '5'))           # 窗口内至少多少次请求才判断
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))           # 错误率阈值
+BREAKER_SLOW_CALL_MS = int(os.getenv('BREAKER_SLOW_CALL_MS', '30000'))       # 首包超过该耗时视为慢请求
+BREAKER_SLOW_CALL_RATE = float(os.getenv('BREAKER_SLOW_CALL_RATE', '0.8'))   # 慢请求比例阈值
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '30'))        # 熔断后多久进入半开状态
+BREAKER_PROBE_INTERVAL = float(os.getenv('BREAKER_PROBE_INTERVAL', '10'))    # 后台探测间隔（秒）
+BREAKER_PROBE_TIMEOUT = float(os.getenv('BREAKER_PROBE_TIMEOUT', '5'))       # 探测请求超时（秒）
+# 探测请求：默认向实际转发的 /v1/messages 发送一个最小请求（max_tokens=1），也可以配置为服务器的健康检查路径（GET）
+BREAKER_PROBE_PATH = os.getenv('BREAKER_PROBE_PATH', '/v1/messages')
+BREAKER_PROBE_METHOD = os.getenv('BREAKER_PROBE_METHOD', 'POST').upper()
+BREAKER_PROBE_MODEL = os.getenv('BREAKER_PROBE_MODEL', 'claude-3-5-haiku-latest')
+SERVER_CACHE_TTL = float(os.getenv('SERVER_CACHE_TTL', '5'))                 # 服务器列表缓存时间（秒）
+
+# 计入熔断失败的状态码（5xx之外）：认证失败、权限不足、限流
+BREAKER_FAILURE_STATUS = [401, 403, 429]
+
+class BreakerState(Enum):
+    """熔断状态"""
+    CLOSED = "closed"        # 正常转发
+    OPEN = "open"            # 熔断，直接跳过
+    HALF_OPEN = "half_open"  # 试探恢复，只放行一个请求
+
+@dataclass
+class ServerInfo:
+    """缓存的服务器配置（与数据库会话解耦）"""
+    id: int
+    name: str
+    url: str
+    api_key: Optional[str]
+    timeout: int
+    priority: int
+
+class CircuitBreaker:
+    """单个服务器的熔断器"""
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = BREAKER_WINDOW_SIZE,
+        min_requests: int = BREAKER_MIN_REQUESTS,
+        error_rate: float = BREAKER_ERROR_RATE,
+        slow_call_ms: int = BREAKER_SLOW_CALL_MS,
+        slow_call_rate: float = BREAKER_SLOW_CALL_RATE,
+        open_seconds: float = BREAKER_OPEN_SECONDS
+    ):
+        self.name = name
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+
+        self.state = BreakerState.CLOSED
+        # 最近请求结果: (是否成功, 首包耗时ms)
+        self.outcomes: Deque[Tuple[bool, float]] = deque(maxlen=window_size)
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.last_error: Optional[str] = None
+        self.last_change = time.time()
+        self.open_count = 0
+
+    def allow_request(self) -> bool:
+        """判断是否可以向该服务器转发请求"""
+        if self.state == BreakerState.CLOSED:
+            return True
+        if self.state == BreakerState.OPEN:
+            if time.time() - self.opened_at < self.open_seconds:
+                return False
+            self._transition(BreakerState.HALF_OPEN)
+        # 半开状态只放行一个试探请求
+        if self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def is_available(self) -> bool:
+        """判断是否可以放行请求（不占用半开状态的试探名额）"""
+        if self.state == BreakerState.CLOSED:
+            return True
+        if self.state == BreakerState.OPEN:
+            return time.time() - self.opened_at >= self.open_seconds
+        return not self.trial_in_flight
+
+    def ready_for_probe(self) -> bool:
+        """熔断时间已过，可以进行后台探测"""
+        if self.state == BreakerState.OPEN and time.time() - self.opened_at >= self.open_seconds:
+            self._transition(BreakerState.HALF_OPEN)
+        return self.state == BreakerState.HALF_OPEN and not self.trial_in_flight
+
+    def record_success(self, latency_ms: float):
+        """记录一次成功请求及其首包耗时"""
+        slow = latency_ms >= self.slow_call_ms
+        if self.state == BreakerState.HALF_OPEN:
+            self.trial_in_flight = False
+            if slow:
+                self._open(f"试探请求过慢: {int(latency_ms)}ms")
+            else:
+                self._transition(BreakerState.CLOSED)
+            return
+        self.outcomes.append((True, latency_ms))
+        self._evaluate()
+
+    def record_failure(self, error: str):
+        """记录一次失败请求"""
+        self.last_error = error
+        if self.state == BreakerState.HALF_OPEN:
+            self.trial_in_flight = False
+            self._open(f"试探请求失败: {error}")
+            return
+        if self.state == BreakerState.OPEN:
+            return
+        self.outcomes.append((False, 0.0))
+        self._evaluate()
+
+    def release_trial(self, reason: str):
+        """试探请求没有结果（客户端断开或任务取消）时释放试探名额，按失败处理"""
+        if self.state == BreakerState.HALF_OPEN and self.trial_in_flight:
+            self.record_failure(reason)
+
+    def _evaluate(self):
+        """根据窗口内的错误率和慢请求比例判断是否熔断"""
+        total = len(self.outcomes)
+        if total < self.min_requests:
+            return
+        failures = sum(1 for ok, _ in self.outcomes if not ok)
+        slow_calls = sum(1 for ok, latency in self.outcomes if ok and latency >= self.slow_call_ms)
+        if failures / total >= self.error_rate:
+            self._open(f"错误率 {failures}/{total}")
+        elif slow_calls / total >= self.slow_call_rate:
+            self._open(f"慢请求 {slow_calls}/{total}")
+
+    def _open(self, reason: str):
+        self.opened_at = time.time()
+        self.open_count += 1
+        self.last_error = reason
+        self._transition(BreakerState.OPEN)
+        logger.warning(f"🔴 [CircuitBreaker] 服务器 {self.name} 熔断: {reason}，{int(self.open_seconds)}秒后探测恢复")
+
+    def _transition(self, state: BreakerState):
+        if self.state == state:
+            return
+        self.state = state
+        self.last_change = time.time()
+        if state == BreakerState.CLOSED:
+            self.outcomes.clear()
+            self.trial_in_flight = False
+            logger.info(f"🟢 [CircuitBreaker] 服务器 {self.name} 已恢复")
+        elif state == BreakerState.HALF_OPEN:
+            self.trial_in_flight = False
+            logger.info(f"🟡 [CircuitBreaker] 服务器 {self.name} 进入半开状态")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回熔断器状态（用于管理接口展示）"""
+        total = len(self.outcomes)
+        failures = sum(1 for ok, _ in self.outcomes if not ok)
+        latencies = sorted(latency for ok, latency in self.outcomes if ok)
+        return {
+            "state": self.state.value,
+            "window_requests": total,
+            "error_rate": round(failures / total, 4) if total else 0,
+            "p95_first_chunk_ms": int(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]) if latencies else None,
+            "open_count": self.open_count,
+            "last_error": self.last_error,
+            "last_change": self.last_change,
+            "retry_in_seconds": max(0, int(self.opened_at + self.open_seconds - time.time())) if self.state == BreakerState.OPEN else 0
+        }
+
+class ServerHealthManager:
+    """Claude Code 服务器健康管理：缓存服务器列表、维护各服务器熔断器并在后台探测恢复"""
+
+    def __init__(self, cache_ttl: float = SERVER_CACHE_TTL, probe_interval: float = BREAKER_PROBE_INTERVAL, probe_timeout: float = BREAKER_PROBE_TIMEOUT):
+        self.cache_ttl = cache_ttl
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.breakers: Dict[int, CircuitBreaker] = {}
+        self._servers: Optional[List[ServerInfo]] = None
+        self._loaded_at = 0.0
+        self._probe_task: Optional[asyncio.Task] = None
+        self._probe_client: Optional[httpx.AsyncClient] = None
+
+    def get_breaker(self, server: ServerInfo) -> CircuitBreaker:
+        breaker = self.breakers.get(server.id)
+        if breaker is None:
+            breaker = CircuitBreaker(server.name)
+            self.breakers[server.id] = breaker
+        breaker.name = server.name
+        return breaker
+
+    async def get_servers(self) -> List[ServerInfo]:
+        """获取启用的服务器（按优先级排序），在缓存时间内不重复查询数据库"""
+        if self._servers is None or time.time() - self._loaded_at > self.cache_ttl:
+            self._servers = await run_db(self._load_servers)
+            self._loaded_at = time.time()
+            # 清理已删除服务器的熔断器
+            server_ids = {server.id for server in self._servers}
+            for server_id in list(self.breakers):
+                if server_id not in server_ids:
+                    del self.breakers[server_id]
+        return self._servers
+
+    def invalidate(self):
+        """服务器配置变更后清除缓存"""
+        self._servers = None
+
+    @staticmethod
+    def _load_servers() -> List[ServerInfo]:
+        db = SessionLocal()
+        try:
+            servers = db.query(ClaudeCodeServer).filter(
+                ClaudeCodeServer.enabled == True
+            ).order_by(ClaudeCodeServer.priority, ClaudeCodeServer.id).all()
+            return [
+                ServerInfo(
+                    id=server.id,
+                    name=server.name,
+                    url=server.url,
+                    api_key=server.api_key,
+                    timeout=server.timeout,
+                    priority=server.priority
+                )
+                for server in servers
+            ]
+        finally:
+            db.close()
+
+    def get_state(self, server_id: int) -> Dict[str, Any]:
+        """获取服务器熔断状态，没有请求记录的服务器视为正常"""
+        breaker = self.breakers.get(server_id)
+        if breaker is None:
+            return {"state": BreakerState.CLOSED.value, "window_requests": 0}
+        return breaker.snapshot()
+
+    async def start(self):
+        """启动后台探测任务"""
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_client = httpx.AsyncClient(timeout=self.probe_timeout)
+            self._probe_task = asyncio.get_running_loop().create_task(self._probe_loop())
+
+    async def stop(self):
+        """停止后台探测任务"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+        if self._probe_client is not None:
+            await self._probe_client.aclose()
+            self._probe_client = None
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            try:
+                await self.probe_open_servers()
+            except Exception as e:
+                logger.error(f"❌ [CircuitBreaker] 后台探测失败: {e}")
+
+    async def probe_open_servers(self):
+        """对熔断时间已过的服务器发起探测，探测成功即恢复"""
+        if not self.breakers:
+            return
+        servers = await self.get_servers()
+        probes = []
+        for server in servers:
+            breaker = self.breakers.get(server.id)
+            if breaker and breaker.ready_for_probe():
+                breaker.trial_in_flight = True
+                probes.append(self._probe(server, breaker))
+        if probes:
+            await asyncio.gather(*probes)
+
+    async def _probe(self, server: ServerInfo, breaker: CircuitBreaker):
+        """带服务器的 API Key 请求实际转发的接口，只有 2xx 计为成功（404 等意外的 4xx 也说明服务器不可用）"""
+        headers = {"anthropic-version": "2023-06-01"}
+        if server.api_key:
+            headers["authorization"] = f"Bearer {server.api_key}"
+        body = None
+        if BREAKER_PROBE_METHOD == "POST":
+            body = {
+                "model": BREAKER_PROBE_MODEL,
+                "max_tokens": 1,
+                "messages": [{"role": "user", "content": "ping"}]
+            }
+        url = f"{server.url.rstrip('/')}{BREAKER_PROBE_PATH}"
+        start = time.time()
+        try:
+            response = await self._probe_client.request(BREAKER_PROBE_METHOD, url, headers=headers, json=body)
+            if 200 <= response.status_code < 300:
+                breaker.record_success((time.time() - start) * 1000)
+            else:
+                breaker.record_failure(f"探测返回 HTTP {response.status_code}")
+        except Exception as e:
+            breaker.record_failure(f"探测失败: {e}")
+        finally:
+            breaker.release_trial("探测被取消")
+
+# 全局实例
+server_health = ServerHealthManager()
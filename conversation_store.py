@@ -0,0 +1,316 @@
+"""
+会话增量存储模块
+Agent 会话每一轮都会重新发送完整的历史消息，记录N的请求体基本等于记录N-1的请求体加上一两条新消息。
+写入记录时按前缀消息的哈希找到同一会话（同一个用户KEY、同一个路径）的上一轮记录，只保存：
+- 与上一轮不同的消息（通常是新追加的消息）
+- 与上一轮不同的顶层字段（system、tools 等不变时不再保存）
+读取时沿父记录链还原完整的请求体；链长度达到上限时保存一次完整请求体，限制还原的开销
+还原时按记录的序列化格式重新生成请求体，只有能逐字节还原原始请求体时才保存增量，否则保存完整请求体
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+import fast_json
+from blob_store import blob_store
+from database import APIRecord
+
+logger = logging.getLogger(__name__)
+
+BODY_DELTA_ENABLED = os.getenv('BODY_DELTA_ENABLED', 'true').lower() == 'true'
+BODY_DELTA_MAX_CHAIN = int(os.getenv('BODY_DELTA_MAX_CHAIN', '32'))    # 连续增量记录数上限，超过后保存完整请求体
+BODY_DELTA_LOOKBACK = int(os.getenv('BODY_DELTA_LOOKBACK', '16'))      # 查找上一轮时最多回退的消息数
+BODY_DELTA_CACHE_SIZE = int(os.getenv('BODY_DELTA_CACHE_SIZE', '256'))  # 内存中保留的最近会话轮次数
+
+@dataclass
+class ConversationTurn:
+    """一条记录的会话信息，用于和下一轮比较"""
+    messages_hash: str                                                 # 全部消息（去掉 cache_control）的哈希
+    depth: int = 0                                                     # 距离最近一条完整请求体记录的距离
+    field_hashes: Dict[str, bytes] = field(default_factory=dict)      # messages 以外的顶层字段哈希
+    message_hashes: List[bytes] = field(default_factory=list)         # 每条消息的哈希
+    record_id: Optional[int] = None
+    delta_meta: Optional[Dict[str, Any]] = None                        # 只保存增量时的父记录信息
+    parent: Optional["ConversationTurn"] = None                        # 父记录在同一批中、还没有ID时使用
+
+# 请求体的序列化格式（固定使用标准库，与 JSON 后端无关），还原后与原始请求体逐字节相同
+BODY_FORMATS = {
+    "compact": lambda body: json.dumps(body, ensure_ascii=False, separators=(",", ":")),  # JSON.stringify（Claude Code 等 JS 客户端）
+    "default": lambda body: json.dumps(body),                                              # Python json.dumps 默认格式
+    "spaced": lambda body: json.dumps(body, ensure_ascii=False),                           # Python json.dumps，不转义非ASCII
+}
+
+def detect_body_format(body: Dict[str, Any], body_text: str) -> Optional[str]:
+    """返回能逐字节还原原始请求体的序列化格式，都不能时返回None"""
+    for name, serialize in BODY_FORMATS.items():
+        if serialize(body) == body_text:
+            return name
+    return None
+
+def _digest(value: Any) -> bytes:
+    return hashlib.sha256(fast_json.canonical_bytes(value)).digest()[:16]
+
+def _strip_cache_control(message: Any) -> Any:
+    """去掉消息和内容块上的 cache_control（客户端每轮都会把它移到最新的消息上）"""
+    if not isinstance(message, dict):
+        return message
+    stripped = {k: v for k, v in message.items() if k != "cache_control"}
+    content = stripped.get("content")
+    if isinstance(content, list):
+        stripped["content"] = [
+            {k: v for k, v in block.items() if k != "cache_control"} if isinstance(block, dict) else block
+            for block in content
+        ]
+    return stripped
+
+def conversation_scope(user_key_id: Optional[int], path: Optional[str]) -> bytes:
+    """会话范围：只在同一个用户KEY、同一个路径的记录之间查找上一轮"""
+    return f"{user_key_id}|{path}".encode("utf-8")
+
+def hash_messages(messages: List[Any], scope: bytes = b"") -> Tuple[List[str], List[bytes]]:
+    """返回 (每个前缀的哈希, 每条消息的哈希)，前缀哈希（包含会话范围）用于查找上一轮，消息哈希用于找出不同的消息"""
+    prefix_hashes: List[str] = []
+    message_hashes: List[bytes] = []
+    chain = hashlib.sha256(scope)
+    for message in messages:
+        message_hashes.append(_digest(message))
+        chain.update(_digest(_strip_cache_control(message)))
+        prefix_hashes.append(chain.hexdigest())
+    return prefix_hashes, message_hashes
+
+class ConversationStore:
+    """在记录写入的同一个事务中，把请求体替换为相对上一轮的增量"""
+
+    def __init__(
+        self,
+        enabled: bool = BODY_DELTA_ENABLED,
+        max_chain: int = BODY_DELTA_MAX_CHAIN,
+        lookback: int = BODY_DELTA_LOOKBACK,
+        cache_size: int = BODY_DELTA_CACHE_SIZE
+    ):
+        self.enabled = enabled
+        self.max_chain = max_chain
+        self.lookback = lookback
+        self.cache_size = cache_size
+        self._turns: "OrderedDict[str, ConversationTurn]" = OrderedDict()
+
+        # 统计计数
+        self.full_bodies = 0     # 保存完整请求体的会话记录数
+        self.delta_bodies = 0    # 只保存增量的记录数
+        self.bytes_in = 0        # 原始请求体字节数
+        self.bytes_stored = 0    # 实际保存的请求体字节数
+
+    def encode(self, db, records: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Optional[ConversationTurn]]]:
+        """返回替换后的记录字段（不修改传入的字典）以及每条记录的会话信息，flush 后调用 link，提交后调用 remember"""
+        if not self.enabled:
+            return records, [None] * len(records)
+        result = []
+        turns = []
+        batch_turns: Dict[str, ConversationTurn] = {}  # 同一批中前面的记录也可以作为上一轮
+        for fields in records:
+            stored, turn = self._encode_one(db, fields, batch_turns)
+            result.append(stored)
+            turns.append(turn)
+            if turn is not None:
+                batch_turns[turn.messages_hash] = turn
+        return result, turns
+
+    def _encode_one(self, db, fields: Dict[str, Any], batch_turns: Dict[str, ConversationTurn]) -> Tuple[Dict[str, Any], Optional[ConversationTurn]]:
+        body_text = fields.get("body")
+        if not isinstance(body_text, str) or not body_text.startswith("{"):
+            return fields, None
+        try:
+            body = fast_json.loads(body_text)
+        except (fast_json.JSONDecodeError, UnicodeDecodeError):
+            return fields, None
+        messages = body.get("messages") if isinstance(body, dict) else None
+        if not isinstance(messages, list) or not messages:
+            return fields, None
+
+        user_key_id = fields.get("user_key_id")
+        path = fields.get("path")
+        prefix_hashes, message_hashes = hash_messages(messages, conversation_scope(user_key_id, path))
+        turn = ConversationTurn(
+            messages_hash=prefix_hashes[-1],
+            field_hashes={key: _digest(value) for key, value in body.items() if key != "messages"},
+            message_hashes=message_hashes
+        )
+        stored = dict(fields)
+        stored["messages_hash"] = turn.messages_hash
+        self.bytes_in += len(body_text)
+
+        parent = self._find_parent(db, prefix_hashes, batch_turns, user_key_id, path)
+        body_format = detect_body_format(body, body_text) if parent is not None else None
+        if parent is None or parent.depth + 1 > self.max_chain or body_format is None:
+            self.full_bodies += 1
+            self.bytes_stored += len(body_text)
+            return stored, turn
+
+        # 从第一条与上一轮不同的消息开始保存
+        base = 0
+        for parent_hash, message_hash in zip(parent.message_hashes, message_hashes):
+            if parent_hash != message_hash:
+                break
+            base += 1
+        delta = {}
+        for key, value in body.items():
+            if key == "messages":
+                delta[key] = messages[base:]
+            elif parent.field_hashes.get(key) != turn.field_hashes[key]:
+                delta[key] = value
+
+        turn.depth = parent.depth + 1
+        turn.delta_meta = {
+            "parent": parent.record_id,
+            "base": base,
+            "depth": turn.depth,
+            "keys": list(body),
+            "format": body_format
+        }
+        if parent.record_id is None:
+            turn.parent = parent
+        stored["body"] = fast_json.dumps(delta, ensure_ascii=False)
+        stored["body_delta"] = fast_json.dumps(turn.delta_meta)
+        self.delta_bodies += 1
+        self.bytes_stored += len(stored["body"])
+        return stored, turn
+
+    def _find_parent(
+        self,
+        db,
+        prefix_hashes: List[str],
+        batch_turns: Dict[str, ConversationTurn],
+        user_key_id: Optional[int],
+        path: Optional[str]
+    ) -> Optional[ConversationTurn]:
+        """按前缀哈希查找最长匹配的上一轮：先查本批和内存，再查数据库（前缀哈希已包含用户KEY和路径）"""
+        start = max(0, len(prefix_hashes) - self.lookback - 1)
+        candidates = prefix_hashes[start:]
+        for messages_hash in reversed(candidates):
+            if messages_hash in batch_turns:
+                return batch_turns[messages_hash]
+            turn = self._turns.get(messages_hash)
+            if turn is not None:
+                self._turns.move_to_end(messages_hash)
+                return turn
+
+        rows = db.query(func.max(APIRecord.id), APIRecord.messages_hash).filter(
+            APIRecord.messages_hash.in_(candidates),
+            APIRecord.user_key_id == user_key_id,
+            APIRecord.path == path
+        ).group_by(APIRecord.messages_hash).all()
+        if not rows:
+            return None
+        lengths = {messages_hash: i for i, messages_hash in enumerate(candidates)}
+        record_id, _ = max(rows, key=lambda row: lengths[row[1]])
+        return self._load_turn(db, record_id)
+
+    def _load_turn(self, db, record_id: int) -> Optional[ConversationTurn]:
+        """从数据库还原一条记录的会话信息（重启后内存中没有时使用）"""
+        record = db.query(APIRecord).filter(APIRecord.id == record_id).first()
+        if record is None:
+            return None
+        body = self._restore(db, record)
+        if not isinstance(body, dict) or not isinstance(body.get("messages"), list):
+            return None
+        prefix_hashes, message_hashes = hash_messages(body["messages"], conversation_scope(record.user_key_id, record.path))
+        meta = fast_json.loads(record.body_delta) if record.body_delta else {}
+        return ConversationTurn(
+            messages_hash=prefix_hashes[-1] if prefix_hashes else "",
+            depth=meta.get("depth", 0),
+            field_hashes={key: _digest(value) for key, value in body.items() if key != "messages"},
+            message_hashes=message_hashes,
+            record_id=record.id
+        )
+
+    def link(self, turns: List[Optional[ConversationTurn]], api_records: List[Any]):
+        """flush 获得记录ID后，补上父记录在同一批中的增量记录的父记录ID"""
+        for turn, api_record in zip(turns, api_records):
+            if turn is not None:
+                turn.record_id = api_record.id
+        for turn, api_record in zip(turns, api_records):
+            if turn is None or turn.parent is None:
+                continue
+            turn.delta_meta["parent"] = turn.parent.record_id
+            turn.parent = None
+            api_record.body_delta = fast_json.dumps(turn.delta_meta)
+
+    def remember(self, turns: List[Optional[ConversationTurn]]):
+        """事务提交后记住本批记录，下一轮可以直接在内存中找到"""
+        for turn in turns:
+            if turn is None:
+                continue
+            self._turns[turn.messages_hash] = turn
+            self._turns.move_to_end(turn.messages_hash)
+        while len(self._turns) > self.cache_size:
+            self._turns.popitem(last=False)
+
+    def restore_body(self, db, record, body: Optional[str]) -> Optional[str]:
+        """还原完整请求体，body 为记录中（已从 blob 表取回）的请求体；按记录的序列化格式还原为原始请求体"""
+        if not record.body_delta:
+            return body
+        full = self._restore(db, record, body)
+        if full is None:
+            return body
+        serialize = BODY_FORMATS.get(fast_json.loads(record.body_delta).get("format"))
+        if serialize is None:
+            # 没有记录格式的旧增量记录，内容相同但格式可能与原始请求体不同
+            return fast_json.dumps(full, ensure_ascii=False)
+        return serialize(full)
+
+    def _restore(self, db, record, body: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """沿父记录链找到完整请求体，再依次应用每一轮的增量"""
+        if body is None:
+            body = blob_store.load_fields(db, record, ("body",))["body"]
+        chain: List[Tuple[str, Dict[str, Any]]] = []
+        visited = {record.id}
+        while record.body_delta:
+            meta = fast_json.loads(record.body_delta)
+            chain.append((body, meta))
+            parent = db.query(APIRecord).filter(APIRecord.id == meta["parent"]).first()
+            if parent is None or parent.id in visited:
+                logger.warning(f"⚠️ [Conversation] 记录 {record.id} 的父记录 {meta['parent']} 不存在，无法还原请求体")
+                return None
+            record = parent
+            visited.add(record.id)
+            body = blob_store.load_fields(db, record, ("body",))["body"]
+
+        try:
+            full = fast_json.loads(body) if body else None
+            for delta_text, meta in reversed(chain):
+                delta = fast_json.loads(delta_text)
+                messages = full["messages"][:meta["base"]] + delta.get("messages", [])
+                full = {
+                    key: messages if key == "messages" else delta.get(key, full.get(key))
+                    for key in meta["keys"]
+                }
+        except (fast_json.JSONDecodeError, KeyError, TypeError) as e:
+            logger.error(f"❌ [Conversation] 还原请求体失败: {e}")
+            return None
+        return full
+
+    def clear(self):
+        """清空内存中的会话信息（清空记录时调用）"""
+        self._turns.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "max_chain": self.max_chain,
+            "cached_turns": len(self._turns),
+            "full_bodies": self.full_bodies,
+            "delta_bodies": self.delta_bodies,
+            "bytes_in": self.bytes_in,
+            "bytes_stored": self.bytes_stored,
+            "ratio": round(self.bytes_stored / self.bytes_in, 4) if self.bytes_in else 0
+        }
+
+# 全局会话增量存储实例
+conversation_store = ConversationStore()
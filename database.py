@@ -1,15 +1,87 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, create_engine
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, LargeBinary, Index, create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
 import json
 import hashlib
+import os
 import secrets
 
 DATABASE_URL = "sqlite:///./api_records.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# SQLite 存储配置：WAL 模式下读写互不阻塞，记录写入和管理后台查询不再争用同一把锁
+SQLITE_WAL = os.getenv('SQLITE_WAL', 'true').lower() == 'true'
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL').upper()      # WAL 模式下 NORMAL 足够安全
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))   # 等待锁的时间
+SQLITE_CACHE_MB = int(os.getenv('SQLITE_CACHE_MB', '64'))                   # 每个连接的页缓存
+SQLITE_MMAP_MB = int(os.getenv('SQLITE_MMAP_MB', '256'))                    # 内存映射读取的大小，0表示关闭
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))                # 只读连接数
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+if SQLITE_SYNCHRONOUS not in SYNCHRONOUS_MODES:
+    SQLITE_SYNCHRONOUS = "NORMAL"
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record, query_only: bool = False):
+    """每个新连接建立时设置 SQLite 参数"""
+    cursor = dbapi_connection.cursor()
+    try:
+        if SQLITE_WAL:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_MB * 1024}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+def create_sqlite_engine(url: str = DATABASE_URL, query_only: bool = False, **kwargs):
+    """创建带 SQLite 参数的引擎，query_only 为 True 时连接只读"""
+    sqlite_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        **kwargs
+    )
+    event.listen(sqlite_engine, "connect", partial(_apply_sqlite_pragmas, query_only=query_only))
+    return sqlite_engine
+
+# 通用引擎：请求处理中的读操作使用
+engine = create_sqlite_engine()
+
+# 写入引擎：只有一个连接，所有写操作（记录写入、配置、KEY、登录会话等）排队使用，避免多个写事务互相等待锁
+writer_engine = create_sqlite_engine(pool_size=1, max_overflow=0, pool_timeout=60)
+WriterSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=writer_engine)
+
+class WriteRoutingSession(Session):
+    """
+    读操作使用通用引擎，写操作（flush 和 INSERT/UPDATE/DELETE 语句）使用写入引擎的单个连接
+    写入的连接在 commit/rollback 后归还；同一事务中写入后再查询看不到未提交的修改（会话关闭了 autoflush）
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            return writer_engine
+        if isinstance(clause, TextClause) and not clause.text.lstrip().upper().startswith(("SELECT", "WITH")):
+            return writer_engine
+        return engine
+
+SessionLocal = sessionmaker(class_=WriteRoutingSession, autocommit=False, autoflush=False)
+
+# 只读引擎：管理后台的记录列表、详情和统计查询使用，WAL 模式下不会被写入阻塞
+reader_engine = create_sqlite_engine(query_only=True, pool_size=DB_READ_POOL_SIZE, max_overflow=0)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=reader_engine)
+
+# 数据库访问线程池：异步代码中的同步查询放到这里执行，避免阻塞事件循环
+# 线程数不超过连接池容量（默认5+10），避免线程都在等待连接
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '8'))
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
 
 Base = declarative_base()
 
@@ -43,6 +115,24 @@ class APIRecord(Base):
     input_tokens = Column(Integer, default=0)    # 输入token数量
     output_tokens = Column(Integer, default=0)   # 输出token数量
     total_tokens = Column(Integer, default=0)    # 总token数量
+    cached_tokens = Column(Integer, default=0)   # 命中上游提示词缓存的输入token数量
+    cache_hit = Column(Boolean, default=False)   # 是否由本地响应缓存直接返回
+    # 响应捕获信息字段
+    capture_info = Column(Text)                  # 各响应字段的捕获模式、大小和截断位置(JSON)
+    # 大字段存储位置
+    blob_refs = Column(Text)                     # 移到 record_blobs 表的字段及其内容哈希(JSON)
+    # 会话增量存储字段
+    messages_hash = Column(String, index=True)   # 全部消息的哈希，用于下一轮查找上一轮记录
+    body_delta = Column(Text)                    # 请求体只保存增量时，父记录ID、相同消息数和字段顺序(JSON)
+
+    # 记录列表的筛选条件 + 时间倒序分页（SQLite 索引隐含 rowid，即 id）
+    __table_args__ = (
+        Index("ix_api_records_platform_time", "target_platform", "timestamp"),
+        Index("ix_api_records_model_time", "target_model", "timestamp"),
+        Index("ix_api_records_status_time", "response_status", "timestamp"),
+        Index("ix_api_records_key_time", "user_key_id", "timestamp"),
+        Index("ix_api_records_scene_time", "routing_scene", "timestamp"),
+    )
 
 class PlatformConfig(Base):
     """平台配置表"""
@@ -154,6 +244,7 @@ class UserKey(Base):
     used_tokens = Column(Integer, default=0)  # 已使用的 token 数量
     expires_at = Column(DateTime)  # 到期时间
     is_active = Column(Boolean, default=True)  # 是否激活
+    response_cache_enabled = Column(Boolean, default=True)  # 是否允许使用响应缓存
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -171,9 +262,62 @@ class KeyUsageLog(Base):
     total_tokens = Column(Integer, default=0)  # 总 token 数量
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
+class ResponseCacheEntry(Base):
+    """响应缓存持久化表"""
+    __tablename__ = "response_cache_entries"
+    
+    cache_key = Column(String, primary_key=True)  # 规范化请求的哈希
+    response_body = Column(Text)  # 转换后返回给客户端的响应
+    model_raw_response = Column(Text)  # 大模型原始响应
+    size_bytes = Column(Integer, default=0)  # 缓存占用字节数
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)  # 过期时间
+
+class RecordBlob(Base):
+    """记录大字段的内容寻址存储表，相同内容只保存一份，只在清空记录时删除"""
+    __tablename__ = "record_blobs"
+    
+    hash = Column(String, primary_key=True)  # 原始内容的 sha256
+    codec = Column(String, default="zlib")  # 压缩方式: zlib, zstd, none
+    data = Column(LargeBinary)  # 压缩后的内容
+    size_bytes = Column(Integer, default=0)  # 原始字节数
+    stored_bytes = Column(Integer, default=0)  # 压缩后字节数
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 # 创建所有表
 Base.metadata.create_all(bind=engine)
 
+# 已有数据库中缺少的新增字段（create_all 不会修改已存在的表）
+COLUMNS_TO_ENSURE = {
+    "api_records": {
+        "capture_info": "TEXT",
+        "cached_tokens": "INTEGER DEFAULT 0",
+        "cache_hit": "BOOLEAN DEFAULT 0",
+        "blob_refs": "TEXT",
+        "messages_hash": "VARCHAR",
+        "body_delta": "TEXT",
+    },
+    "user_keys": {
+        "response_cache_enabled": "BOOLEAN DEFAULT 1",
+    },
+}
+
+def ensure_columns():
+    """为已有数据库补充新增的字段和索引"""
+    with engine.begin() as conn:
+        for table, columns in COLUMNS_TO_ENSURE.items():
+            existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                    print(f"✅ 数据库字段已添加: {table}.{column}")
+        # 已有的表不会由 create_all 补充索引
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+ensure_columns()
+
 # 初始化默认管理员密码
 def init_default_admin():
     """初始化默认管理员密码"""
@@ -230,4 +374,17 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def get_read_db():
+    """只读会话，用于管理后台的查询接口"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def run_db(fn, *args, **kwargs):
+    """在数据库线程池中执行同步数据库操作，例如 await run_db(query.all)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(fn, *args, **kwargs))
\ No newline at end of file
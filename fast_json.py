@@ -0,0 +1,114 @@
+"""
+JSON编解码门面
+优先使用 orjson，其次 ujson，都未安装时回退到标准库 json；
+可通过环境变量 JSON_BACKEND（orjson/ujson/json）强制指定
+默认不转义非ASCII字符（等同 ensure_ascii=False），解析失败统一抛出 json.JSONDecodeError
+兼容性：各后端 dumps/dumps_bytes 的输出解析后相同，但格式不同（orjson 没有 ", " 和 ": " 中的空格，
+浮点数写法也可能不同），只适合发送和展示；需要计算哈希并持久化的内容（如会话前缀哈希、响应缓存键）
+使用 canonical_bytes，输出不随后端变化
+"""
+
+import json
+import logging
+import os
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+JSONDecodeError = json.JSONDecodeError
+
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto').lower()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+def _select_backend() -> str:
+    available = {"orjson": orjson is not None, "ujson": ujson is not None, "json": True}
+    if JSON_BACKEND in available:
+        if available[JSON_BACKEND]:
+            return JSON_BACKEND
+        logger.warning(f"⚠️ [JSON] 指定的JSON后端 {JSON_BACKEND} 未安装，自动选择")
+    elif JSON_BACKEND != "auto":
+        logger.warning(f"⚠️ [JSON] 未知的JSON后端 {JSON_BACKEND}，自动选择")
+    for name in ("orjson", "ujson"):
+        if available[name]:
+            return name
+    return "json"
+
+BACKEND = _select_backend()
+
+def canonical_bytes(obj: Any) -> bytes:
+    """规范化序列化（键排序、紧凑格式、不转义非ASCII），固定使用标准库，用于计算哈希"""
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8", errors="replace")
+
+if BACKEND == "orjson":
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def loads(data: Any) -> Any:
+        """解析JSON（str或bytes）"""
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson 比标准库严格（如 NaN、超大整数），交给标准库判断
+            return json.loads(data)
+
+    def dumps_bytes(obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> bytes:
+        """序列化为UTF-8字节"""
+        if indent is None or indent == 2:
+            try:
+                option = _ORJSON_OPTIONS | orjson.OPT_INDENT_2 if indent else _ORJSON_OPTIONS
+                if sort_keys:
+                    option |= orjson.OPT_SORT_KEYS
+                return orjson.dumps(obj, option=option)
+            except TypeError:
+                pass  # orjson 不支持的类型交给标准库处理
+        return json.dumps(obj, ensure_ascii=False, indent=indent, sort_keys=sort_keys).encode("utf-8", errors="replace")
+
+    def dumps(obj: Any, ensure_ascii: bool = False, indent: Optional[int] = None) -> str:
+        """序列化为字符串"""
+        if ensure_ascii:
+            return json.dumps(obj, ensure_ascii=True, indent=indent)
+        return dumps_bytes(obj, indent).decode("utf-8")
+
+elif BACKEND == "ujson":
+    def loads(data: Any) -> Any:
+        """解析JSON（str或bytes）"""
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return json.loads(data)
+
+    def dumps(obj: Any, ensure_ascii: bool = False, indent: Optional[int] = None) -> str:
+        """序列化为字符串"""
+        try:
+            return ujson.dumps(obj, ensure_ascii=ensure_ascii, indent=indent or 0, escape_forward_slashes=False)
+        except (TypeError, OverflowError):
+            return json.dumps(obj, ensure_ascii=ensure_ascii, indent=indent)
+
+    def dumps_bytes(obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> bytes:
+        """序列化为UTF-8字节"""
+        try:
+            return ujson.dumps(obj, ensure_ascii=False, indent=indent or 0, escape_forward_slashes=False,
+                               sort_keys=sort_keys).encode("utf-8", errors="replace")
+        except (TypeError, OverflowError):
+            return json.dumps(obj, ensure_ascii=False, indent=indent, sort_keys=sort_keys).encode("utf-8", errors="replace")
+
+else:
+    def loads(data: Any) -> Any:
+        """解析JSON（str或bytes）"""
+        return json.loads(data)
+
+    def dumps(obj: Any, ensure_ascii: bool = False, indent: Optional[int] = None) -> str:
+        """序列化为字符串"""
+        return json.dumps(obj, ensure_ascii=ensure_ascii, indent=indent)
+
+    def dumps_bytes(obj: Any, indent: Optional[int] = None, sort_keys: bool = False) -> bytes:
+        """序列化为UTF-8字节"""
+        return json.dumps(obj, ensure_ascii=False, indent=indent, sort_keys=sort_keys).encode("utf-8", errors="replace")
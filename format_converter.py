@@ -3,21 +3,18 @@ Claude格式与OpenAI格式的转换模块
 支持双向转换，包括tool use处理
 """
 
-import json
 import re
 from typing import Dict, List, Any, Optional
 import logging
-import os
 import secrets
 import string
 
-DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
-logger = logging.getLogger(__name__)
+import fast_json
+from sse_encoder import SSEEncoder
+from tracing import trace
+from capture_buffer import CaptureBuffer
 
-def debug_print(*args, **kwargs):
-    """统一的DEBUG输出函数，只在DEBUG_MODE启用时输出"""
-    if DEBUG_MODE:
-        print(*args, **kwargs)
+logger = logging.getLogger(__name__)
 
 def generate_claude_message_id() -> str:
     """生成Claude风格的消息ID"""
@@ -26,20 +23,223 @@ def generate_claude_message_id() -> str:
     random_part = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(20))
     return f"msg_{random_part}"
 
+TOOL_USE_OPEN_TAG = "<use_tool>"
+TOOL_USE_CLOSE_TAG = "</use_tool>"
+
+class ToolUseScanner:
+    """
+    <use_tool> 工具调用的增量扫描器，流式和非流式转换共用
+    逐块输入文本，输出标签外的文本片段和完整的工具调用；
+    标签可以被拆分在任意两块之间，每个字符只扫描常数次
+    """
+    
+    def __init__(self):
+        self.in_tool_use = False  # 是否正在工具调用中
+        self._pending = ""  # 可能是标签前缀的尾部文本，等下一块到达后再判断
+        self._tool_parts: List[str] = []  # 当前工具调用的内容片段
+    
+    def feed(self, text: str) -> List[tuple]:
+        """
+        输入一块文本
+        返回: 按顺序排列的片段列表，("text", 文本) 或 ("tool", {"name": 工具名, "input": 参数})
+        """
+        segments = []
+        data = self._pending + text if self._pending else text
+        self._pending = ""
+        pos = 0
+        length = len(data)
+        
+        while pos < length:
+            if not self.in_tool_use:
+                start = data.find(TOOL_USE_OPEN_TAG, pos)
+                if start == -1:
+                    # 尾部可能是被拆开的开始标签，先留到下一块
+                    end = length - self._partial_tag_length(data, TOOL_USE_OPEN_TAG, pos)
+                    if end > pos:
+                        segments.append(("text", data[pos:end]))
+                    self._pending = data[end:]
+                    break
+                if start > pos:
+                    segments.append(("text", data[pos:start]))
+                trace("[DEBUG] 检测到工具调用开始")
+                self.in_tool_use = True
+                pos = start + len(TOOL_USE_OPEN_TAG)
+            else:
+                end = data.find(TOOL_USE_CLOSE_TAG, pos)
+                if end == -1:
+                    # 工具调用未结束，累积内容（尾部可能是被拆开的结束标签）
+                    end = length - self._partial_tag_length(data, TOOL_USE_CLOSE_TAG, pos)
+                    if end > pos:
+                        self._tool_parts.append(data[pos:end])
+                    self._pending = data[end:]
+                    break
+                self._tool_parts.append(data[pos:end])
+                segments.append(self._complete_tool_use())
+                pos = end + len(TOOL_USE_CLOSE_TAG)
+        
+        return segments
+    
+    def finish(self) -> List[tuple]:
+        """输入结束，返回剩余内容；未闭合的工具调用按原文作为文本返回"""
+        if self.in_tool_use:
+            text = TOOL_USE_OPEN_TAG + "".join(self._tool_parts) + self._pending
+        else:
+            text = self._pending
+        self.reset()
+        return [("text", text)] if text else []
+    
+    def reset(self):
+        """重置扫描状态"""
+        self.in_tool_use = False
+        self._pending = ""
+        self._tool_parts = []
+    
+    @staticmethod
+    def _partial_tag_length(data: str, tag: str, start: int) -> int:
+        """返回data尾部与tag前缀重合的长度（标签中只有开头一个'<'，只需检查最后一个'<'）"""
+        index = data.rfind("<", max(start, len(data) - len(tag) + 1))
+        if index != -1 and tag.startswith(data[index:]):
+            return len(data) - index
+        return 0
+    
+    def _complete_tool_use(self) -> tuple:
+        """一个工具调用结束，解析工具名称和参数"""
+        tool_content = "".join(self._tool_parts)
+        self._tool_parts = []
+        self.in_tool_use = False
+        
+        tool_use = self.parse_tool_use(tool_content)
+        if tool_use is None:
+            # 无法解析的工具调用保留原文
+            return ("text", TOOL_USE_OPEN_TAG + tool_content + TOOL_USE_CLOSE_TAG)
+        return ("tool", tool_use)
+    
+    @staticmethod
+    def parse_tool_use(tool_content: str) -> Optional[Dict[str, Any]]:
+        """解析 <use_tool> 标签内的工具名称和JSON参数，失败返回None"""
+        tool_name = ToolUseScanner._find_between(tool_content, "<tool_name>", "</tool_name>")
+        if tool_name is None:
+            trace("[ERROR] 无法找到工具名称: %s", tool_content[:100])
+            return None
+        
+        params_str = ToolUseScanner._find_between(tool_content, "<parameters>", "</parameters>")
+        if params_str is None:
+            trace("[ERROR] 无法找到工具参数: %s", tool_content[:100])
+            return None
+        
+        try:
+            params = fast_json.loads(params_str.strip())
+        except fast_json.JSONDecodeError as e:
+            trace("[ERROR] 工具参数 JSON 解析失败: %s, params_str: %s", e, params_str[:200])
+            return None
+        
+        return {"name": tool_name.strip(), "input": params}
+    
+    @staticmethod
+    def _find_between(text: str, open_tag: str, close_tag: str) -> Optional[str]:
+        start = text.find(open_tag)
+        if start == -1:
+            return None
+        start += len(open_tag)
+        end = text.find(close_tag, start)
+        if end == -1:
+            return None
+        return text[start:end]
+
+def cached_prompt_tokens(usage: Dict[str, Any]) -> int:
+    """从上游usage中读取命中提示词缓存的token数
+    OpenAI/百炼/OpenRouter/硅基流动: prompt_tokens_details.cached_tokens；DeepSeek: prompt_cache_hit_tokens"""
+    if not isinstance(usage, dict):
+        return 0
+    details = usage.get("prompt_tokens_details")
+    if isinstance(details, dict) and details.get("cached_tokens"):
+        return details["cached_tokens"]
+    return usage.get("prompt_cache_hit_tokens") or 0
+
+CHINESE_CHAR_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+STRUCTURED_TEXT_MARKERS = ('{', '[', '<', 'def ', 'function')
+
+class StreamingTokenCounter:
+    """
+    流式输出的增量token估算器
+    每个增量只处理新增文本，跨块保持单词边界状态；上游返回usage后优先使用上游数值
+    估算规则：中文字符按字计算，结构化文本（代码、JSON等）约3.5字符1个token，普通文本按单词计算
+    """
+    
+    _MARKER_TAIL = max(len(marker) for marker in STRUCTURED_TEXT_MARKERS) - 1
+    
+    def __init__(self):
+        self.chinese_chars = 0  # 中文字符数
+        self.other_chars = 0  # 非中文字符数
+        self.words = 0  # 去掉中文字符后的单词数
+        self.structured = False  # 是否出现过结构化文本特征
+        self.upstream_tokens: Optional[int] = None  # 上游返回的输出token数
+        self._has_text = False
+        self._in_word = False  # 上一块是否以单词字符结尾
+        self._tail = ""  # 上一块的尾部，用于检测跨块的结构化特征
+    
+    def add(self, text: str):
+        """累加一段新增输出文本"""
+        if not text:
+            return
+        self._has_text = True
+        
+        if not self.structured:
+            window = self._tail + text
+            self.structured = any(marker in window for marker in STRUCTURED_TEXT_MARKERS)
+            self._tail = window[-self._MARKER_TAIL:]
+        
+        chinese_chars = len(CHINESE_CHAR_PATTERN.findall(text))
+        self.chinese_chars += chinese_chars
+        others = CHINESE_CHAR_PATTERN.sub('', text) if chinese_chars else text
+        if not others:
+            return
+        
+        self.other_chars += len(others)
+        words = len(others.split())
+        # 上一块结尾和这一块开头都是单词字符，属于同一个单词
+        if words and self._in_word and not others[0].isspace():
+            words -= 1
+        self.words += words
+        self._in_word = not others[-1].isspace()
+    
+    def set_upstream(self, tokens: Optional[int]):
+        """记录上游返回的输出token数（0或缺失时继续使用估算值）"""
+        if tokens:
+            self.upstream_tokens = tokens
+    
+    @property
+    def estimate(self) -> int:
+        """根据已累加文本估算的token数"""
+        if not self._has_text:
+            return 0
+        if self.structured:
+            other_tokens = max(1, self.other_chars // 3.5)
+        else:
+            other_tokens = self.words
+        return int(self.chinese_chars + other_tokens)
+    
+    @property
+    def total(self) -> int:
+        """输出token数：优先使用上游数值"""
+        return self.upstream_tokens if self.upstream_tokens is not None else self.estimate
+
 class FormatConverter:
     """格式转换器"""
     
     @staticmethod
-    def claude_to_openai(claude_messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def claude_to_openai(claude_messages: List[Dict[str, Any]], keep_cache_control: bool = False) -> List[Dict[str, Any]]:
         """
         将Claude格式的消息转换为OpenAI格式
         主要处理tool use，将其压到prompt中
+        keep_cache_control 为True时，带有 cache_control 标记的消息转换为内容数组并保留该标记
         """
         openai_messages = []
         
         for message in claude_messages:
             role = message.get("role", "user")
             content = message.get("content", "")
+            cache_control = None
             
             # 处理不同的content格式
             if isinstance(content, list):
@@ -49,6 +249,8 @@ class FormatConverter:
                 
                 for item in content:
                     if isinstance(item, dict):
+                        if item.get("cache_control"):
+                            cache_control = item["cache_control"]
                         if item.get("type") == "text":
                             text_content += item.get("text", "")
                         elif item.get("type") == "tool_use":
@@ -69,6 +271,9 @@ class FormatConverter:
                 tool_text = FormatConverter._tool_calls_to_text(message["tool_calls"])
                 content = f"{content}\n\n{tool_text}".strip()
             
+            if keep_cache_control and cache_control and content:
+                content = [{"type": "text", "text": content, "cache_control": cache_control}]
+            
             openai_message = {
                 "role": role,
                 "content": content
@@ -90,7 +295,7 @@ class FormatConverter:
             # 格式化工具调用 - 真实记录调用情况
             tool_desc = f"调用工具: {tool_name}"
             if tool_input:
-                tool_desc += f"\n参数: {json.dumps(tool_input, ensure_ascii=False, indent=2)}"
+                tool_desc += f"\n参数: {fast_json.dumps(tool_input, ensure_ascii=False, indent=2)}"
             
             tool_descriptions.append(tool_desc)
         
@@ -108,9 +313,9 @@ class FormatConverter:
             
             # 尝试解析参数
             try:
-                args_dict = json.loads(arguments) if isinstance(arguments, str) else arguments
-                args_text = json.dumps(args_dict, ensure_ascii=False, indent=2)
-            except json.JSONDecodeError:
+                args_dict = fast_json.loads(arguments) if isinstance(arguments, str) else arguments
+                args_text = fast_json.dumps(args_dict, ensure_ascii=False, indent=2)
+            except fast_json.JSONDecodeError:
                 args_text = str(arguments)
             
             tool_desc = f"调用函数: {function_name}"
@@ -148,7 +353,7 @@ class FormatConverter:
     def _convert_complete_response(openai_response: str, original_model: Optional[str] = None) -> str:
         """转换完整响应，支持工具调用"""
         try:
-            data = json.loads(openai_response)
+            data = fast_json.loads(openai_response)
             
             # 检查是否是OpenAI格式的完整响应
             if "choices" in data and len(data["choices"]) > 0:
@@ -185,8 +390,8 @@ class FormatConverter:
                         function = tool_call.get("function", {})
                         tool_name = function.get("name", "unknown")
                         try:
-                            arguments = json.loads(function.get("arguments", "{}"))
-                        except json.JSONDecodeError:
+                            arguments = fast_json.loads(function.get("arguments", "{}"))
+                        except fast_json.JSONDecodeError:
                             arguments = {}
                         
                         claude_content.append({
@@ -232,16 +437,17 @@ class FormatConverter:
                     "stop_sequence": None,
                     "usage": {
                         "input_tokens": data.get("usage", {}).get("prompt_tokens", 0),
-                        "output_tokens": data.get("usage", {}).get("completion_tokens", 0)
+                        "output_tokens": data.get("usage", {}).get("completion_tokens", 0),
+                        "cache_read_input_tokens": cached_prompt_tokens(data.get("usage"))
                     }
                 }
                 
-                return json.dumps(claude_response, ensure_ascii=False)
+                return fast_json.dumps(claude_response, ensure_ascii=False)
             
             # 如果不是标准格式，直接返回
             return openai_response
             
-        except json.JSONDecodeError:
+        except fast_json.JSONDecodeError:
             return openai_response
     
     @staticmethod
@@ -250,62 +456,22 @@ class FormatConverter:
         从文本中提取 <use_tool> 标签并转换为Claude格式的tool_use blocks
         返回: (处理后的文本, 工具调用列表)
         """
-        import re
-        import json
-        
+        scanner = ToolUseScanner()
+        text_parts = []
         extracted_tools = []
-        remaining_text = text
         
-        # 查找所有 <use_tool> 标签
-        pattern = r'<use_tool>(.*?)</use_tool>'
-        matches = re.finditer(pattern, text, re.DOTALL)
-        
-        # 从后往前处理，避免索引变化
-        for match in reversed(list(matches)):
-            tool_content = match.group(1)
-            
-            try:
-                # 提取工具名称
-                tool_name_match = re.search(r'<tool_name>(.*?)</tool_name>', tool_content, re.DOTALL)
-                if not tool_name_match:
-                    continue
-                
-                tool_name = tool_name_match.group(1).strip()
-                
-                # 提取参数
-                params_match = re.search(r'<parameters>(.*?)</parameters>', tool_content, re.DOTALL)
-                if not params_match:
-                    continue
-                
-                params_str = params_match.group(1).strip()
-                
-                # 解析 JSON 参数
-                try:
-                    params = json.loads(params_str)
-                except json.JSONDecodeError:
-                    continue
-                
-                # 生成工具调用ID
-                tool_id = f"call_{len(extracted_tools):012d}f"
-                
-                # 创建工具调用对象
-                tool_use = {
+        for kind, value in scanner.feed(text) + scanner.finish():
+            if kind == "tool":
+                extracted_tools.append({
                     "type": "tool_use",
-                    "id": tool_id,
-                    "name": tool_name,
-                    "input": params
-                }
-                
-                extracted_tools.insert(0, tool_use)  # 插入到开头保持顺序
-                
-                # 从文本中移除这个工具调用标签
-                remaining_text = remaining_text[:match.start()] + remaining_text[match.end():]
-                
-            except Exception as e:
-                debug_print(f"[DEBUG] 解析工具调用失败: {e}")
-                continue
+                    "id": f"call_{len(extracted_tools):012d}f",
+                    "name": value["name"],
+                    "input": value["input"]
+                })
+            else:
+                text_parts.append(value)
         
-        return remaining_text.strip(), extracted_tools
+        return "".join(text_parts).strip(), extracted_tools
     
     @staticmethod
     def extract_last_user_message(messages: List[Dict[str, Any]]) -> str:
@@ -349,31 +515,47 @@ class FormatConverter:
         return cleaned
 
 class StreamingConverter:
-    """流式响应转换器 - 支持完整的Claude SSE格式"""
+    """流式响应转换器 - 支持完整的Claude SSE格式，输出编码好的bytes"""
+    
+    __slots__ = (
+        "buffer", "sse", "message_started", "content_block_started", "total_input_tokens",
+        "cached_input_tokens", "output_token_counter", "message_id", "model_name", "original_model", "_content_capture",
+        "tool_scanner", "tool_use_count", "has_tool_use"
+    )
     
     def __init__(self, original_model: str = "unknown"):
         self.buffer = ""
-        self.event_id = 0
+        self.sse = SSEEncoder()  # SSE事件编码，维护事件ID
         self.message_started = False
         self.content_block_started = False
         self.total_input_tokens = 0
-        self.total_output_tokens = 0
+        self.cached_input_tokens = 0  # 上游命中提示词缓存的输入token数
+        self.output_token_counter = StreamingTokenCounter()  # 增量统计输出token
         self.message_id = generate_claude_message_id()
         self.model_name = "unknown"
         self.original_model = original_model  # 用户请求的原始模型名称
-        self.current_content = ""  # 累积当前输出内容
-        self.tool_use_buffer = ""  # 累积工具调用内容
-        self.in_tool_use = False  # 是否正在工具调用中
+        self._content_capture = CaptureBuffer()  # 累积当前输出内容（按捕获模式限制内存）
+        self.tool_scanner = ToolUseScanner()  # 增量解析 <use_tool> 工具调用
         self.tool_use_count = 0  # 工具调用计数
         self.has_tool_use = False  # 是否使用了工具
     
+    @property
+    def total_output_tokens(self) -> int:
+        """输出token数（上游usage优先，否则为增量估算值）"""
+        return self.output_token_counter.total
+    
+    @property
+    def current_content(self) -> str:
+        """当前累积的输出内容"""
+        return self._content_capture.getvalue()
+    
     def _normalize_message_id(self, message_id: str) -> str:
         """将各种格式的message_id转换为Claude格式"""
         if not message_id:
-            debug_print(f"[DEBUG] _normalize_message_id: 收到空message_id")
+            trace("[DEBUG] _normalize_message_id: 收到空message_id")
             return "msg_unknown"
         
-        debug_print(f"[DEBUG] _normalize_message_id: 处理message_id: {repr(message_id)}, type: {type(message_id)}")
+        trace("[DEBUG] _normalize_message_id: 处理message_id: %r, type: %s", message_id, type(message_id))
         
         if message_id.startswith("msg_"):
             return message_id
@@ -386,260 +568,114 @@ class StreamingConverter:
     
     def _estimate_tokens(self, text: str) -> int:
         """估算文本的token数量"""
-        if not text:
-            return 0
-        
-        # 更准确的token估算
-        # 中文字符通常是1个token
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
-        
-        # 英文单词和标点，去掉中文字符后计算
-        text_without_chinese = re.sub(r'[\u4e00-\u9fff]', '', text)
-        
-        # 特殊处理：代码、JSON等结构化文本token密度更高
-        if '{' in text or '[' in text or '<' in text or 'def ' in text or 'function' in text:
-            # 结构化文本，按字符估算（约3-4字符1个token）
-            other_tokens = max(1, len(text_without_chinese) // 3.5)
-        else:
-            # 普通文本，按单词估算
-            english_words = len(text_without_chinese.split())
-            other_tokens = english_words
-        
-        return int(chinese_chars + other_tokens)
+        counter = StreamingTokenCounter()
+        counter.add(text)
+        return counter.estimate
     
-    def _process_tool_use_content(self, text: str) -> tuple[str, str]:
+    def _create_tool_use_events(self, tool_name: str, params: Any) -> bytes:
         """
-        处理文本内容，检测并转换工具调用
-        返回: (处理后的文本, 工具调用事件)
+        将解析出的工具调用转换为 Claude 的 tool_use content block 序列
         """
-        import re
-        import json
+        # 生成工具调用 ID
+        self.tool_use_count += 1
+        self.has_tool_use = True
+        tool_use_id = f"call_{self.tool_use_count:012d}f"  # 使用类似Claude的ID格式
         
-        # 将新文本添加到缓冲区
-        self.tool_use_buffer += text
+        trace("[DEBUG] 生成工具调用: %s, id: %s, params: %s", tool_name, tool_use_id, params)
         
-        tool_events = ""
-        remaining_text = ""
-        
-        # 检测 <use_tool> 标签开始
-        if "<use_tool>" in self.tool_use_buffer and not self.in_tool_use:
-            self.in_tool_use = True
-            debug_print(f"[DEBUG] 检测到工具调用开始")
-            
-            # 提取工具调用前的文本
-            tool_start = self.tool_use_buffer.find("<use_tool>")
-            if tool_start > 0:
-                remaining_text = self.tool_use_buffer[:tool_start]
-                self.tool_use_buffer = self.tool_use_buffer[tool_start:]
-        
-        # 检测完整的工具调用
-        if self.in_tool_use and "</use_tool>" in self.tool_use_buffer:
-            # 找到完整的工具调用
-            pattern = r'<use_tool>(.*?)</use_tool>'
-            match = re.search(pattern, self.tool_use_buffer, re.DOTALL)
-            
-            if match:
-                tool_content = match.group(1)
-                tool_events = self._convert_tool_use_to_claude_format(tool_content)
-                debug_print(f"[DEBUG] 转换了工具调用: {tool_content[:100]}")
-                
-                # 标记使用了工具
-                self.has_tool_use = True
-                
-                # 移除已处理的工具调用
-                self.tool_use_buffer = self.tool_use_buffer[match.end():]
-                self.in_tool_use = False
-        elif not self.in_tool_use:
-            # 不在工具调用中，直接返回文本
-            remaining_text = text
-            self.tool_use_buffer = ""
-        # 在工具调用中但还没结束，不返回文本，等待更多内容
-        
-        return remaining_text, tool_events
-    
-    def _convert_tool_use_to_claude_format(self, tool_content: str) -> str:
-        """
-        将 <use_tool> 格式转换为 Claude 的 tool_use content block 序列
-        """
-        import re
-        import json
+        # 1. 发送 content_block_start 事件（tool_use 类型）
+        content_block_start_data = {
+            "type": "content_block_start",
+            "content_block": {
+                "name": tool_name,
+                "input": {},
+                "id": tool_use_id,
+                "type": "tool_use"
+            },
+            "index": 1  # 工具调用通常是第二个 content block
+        }
+        result = self.sse.event("content_block_start", content_block_start_data)
         
-        try:
-            # 提取工具名称
-            tool_name_match = re.search(r'<tool_name>(.*?)</tool_name>', tool_content, re.DOTALL)
-            if not tool_name_match:
-                debug_print(f"[ERROR] 无法找到工具名称: {tool_content[:100]}")
-                return ""
-            
-            tool_name = tool_name_match.group(1).strip()
-            
-            # 提取参数
-            params_match = re.search(r'<parameters>(.*?)</parameters>', tool_content, re.DOTALL)
-            if not params_match:
-                debug_print(f"[ERROR] 无法找到工具参数: {tool_content[:100]}")
-                return ""
-            
-            params_str = params_match.group(1).strip()
-            
-            # 解析 JSON 参数
-            try:
-                params = json.loads(params_str)
-            except json.JSONDecodeError as e:
-                debug_print(f"[ERROR] 工具参数 JSON 解析失败: {e}, params_str: {params_str}")
-                return ""
-            
-            # 生成工具调用 ID
-            self.tool_use_count += 1
-            tool_use_id = f"call_{self.tool_use_count:012d}f"  # 使用类似Claude的ID格式
-            
-            debug_print(f"[DEBUG] 生成工具调用: {tool_name}, id: {tool_use_id}, params: {params}")
-            
-            # 创建 tool_use content block 序列
-            result = ""
-            
-            # 1. 发送 content_block_start 事件（tool_use 类型）
-            content_block_start_data = {
-                "type": "content_block_start",
-                "content_block": {
-                    "name": tool_name,
-                    "input": {},
-                    "id": tool_use_id,
-                    "type": "tool_use"
+        # 2. 发送 content_block_delta 事件（只在有参数时发送）
+        if params:
+            content_block_delta_data = {
+                "delta": {
+                    "partial_json": fast_json.dumps(params, ensure_ascii=False),
+                    "type": "input_json_delta"
                 },
-                "index": 1  # 工具调用通常是第二个 content block
+                "type": "content_block_delta",
+                "index": 1
             }
-            result += self._create_sse_event("content_block_start", content_block_start_data)
-            
-            # 2. 发送 content_block_delta 事件（只在有参数时发送）
-            if params:  # 只有当参数非空时才发送delta事件
-                params_json = json.dumps(params, ensure_ascii=False)
-                content_block_delta_data = {
-                    "delta": {
-                        "partial_json": params_json,
-                        "type": "input_json_delta"
-                    },
-                    "type": "content_block_delta",
-                    "index": 1
-                }
-                result += self._create_sse_event("content_block_delta", content_block_delta_data)
-            
-            return result
-            
-        except Exception as e:
-            debug_print(f"[ERROR] 工具调用转换失败: {e}")
-            return ""
-    
-    def _get_next_event_id(self) -> int:
-        """获取下一个事件ID"""
-        self.event_id += 1
-        return self.event_id
+            result += self.sse.event("content_block_delta", content_block_delta_data)
+        
+        return result
     
-    def _create_sse_event(self, event_type: str, data: dict) -> str:
-        """创建SSE格式的事件，匹配Claude官方格式"""
-        event_id = self._get_next_event_id()
-        return f"id:{event_id}\nevent:{event_type}\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n"
+    def _create_text_delta_event(self, text: str) -> bytes:
+        """创建文本的content_block_delta事件"""
+        return self.sse.text_delta(text, 0)
     
-    def _create_message_start_event(self, message_id: str, model: Optional[str] = None) -> str:
+    def _create_message_start_event(self, message_id: str, model: Optional[str] = None) -> bytes:
         """创建message_start事件"""
         # 优先使用原始模型名称，如果没有则使用传入的model
         model_to_use = self.original_model if self.original_model != "unknown" else (model or self.model_name or "unknown")
         
-        debug_print(f"[DEBUG] _create_message_start_event: original_model={self.original_model}, model={model}, model_name={self.model_name}, 最终使用={model_to_use}")
+        trace("[DEBUG] _create_message_start_event: original_model=%s, model=%s, model_name=%s, 最终使用=%s", self.original_model, model, self.model_name, model_to_use)
         
-        data = {
-            "type": "message_start",
-            "message": {
-                "model": model_to_use,
-                "role": "assistant", 
-                "id": message_id,
-                "type": "message",
-                "content": [],
-                "usage": {
-                    "input_tokens": 0,
-                    "output_tokens": 0
-                }
-            }
-        }
-        return self._create_sse_event("message_start", data)
+        return self.sse.message_start(message_id, model_to_use)
     
-    def _create_content_block_start_event(self) -> str:
+    def _create_content_block_start_event(self) -> bytes:
         """创建content_block_start事件"""
-        data = {
-            "type": "content_block_start",
-            "content_block": {
-                "type": "text",
-                "text": ""
-            },
-            "index": 0
-        }
-        return self._create_sse_event("content_block_start", data)
+        return self.sse.text_block_start(0)
     
-    def _create_ping_event(self) -> str:
+    def _create_ping_event(self) -> bytes:
         """创建ping事件"""
-        data = {"type": "ping"}
-        return self._create_sse_event("ping", data)
+        return self.sse.ping()
     
-    def _create_content_delta_event(self, text: str) -> str:
+    def _create_content_delta_event(self, text: str) -> bytes:
         """创建content_block_delta事件，支持工具调用检测"""
-        # 检测和处理工具调用
-        processed_text, tool_events = self._process_tool_use_content(text)
+        segments = self.tool_scanner.feed(text)
+        # 常见情况：只有一段文本
+        if len(segments) == 1 and segments[0][0] == "text":
+            return self._create_text_delta_event(segments[0][1])
         
-        result = ""
+        events = []
+        text_sent = False
         
-        # 先发送工具调用事件（如果有）
-        result += tool_events
+        # 按顺序发送文本和工具调用事件
+        for kind, value in segments:
+            if kind == "tool":
+                events.append(self._create_tool_use_events(value["name"], value["input"]))
+            else:
+                events.append(self._create_text_delta_event(value))
+                text_sent = True
         
-        # 再发送文本内容（即使为空也发送，保持流连续性）
-        if processed_text is not None:
-            data = {
-                "delta": {
-                    "type": "text_delta",
-                    "text": processed_text
-                },
-                "type": "content_block_delta",
-                "index": 0
-            }
-            result += self._create_sse_event("content_block_delta", data)
+        # 没有可发送的文本时也发送空增量，保持流连续性
+        if not text_sent:
+            events.append(self._create_text_delta_event(""))
         
-        return result
+        return b"".join(events)
     
-    def _create_content_stop_event(self) -> str:
+    def _create_content_stop_event(self) -> bytes:
         """创建content_block_stop事件"""
-        data = {
-            "type": "content_block_stop",
-            "index": 0
-        }
-        return self._create_sse_event("content_block_stop", data)
+        return self.sse.content_block_stop(0)
     
-    def _create_message_delta_event(self, stop_reason: str = "end_turn") -> str:
+    def _create_message_delta_event(self, stop_reason: str = "end_turn") -> bytes:
         """创建message_delta事件"""
-        data = {
-            "delta": {
-                "stop_reason": stop_reason
-            },
-            "type": "message_delta",
-            "usage": {
-                "input_tokens": self.total_input_tokens,
-                "output_tokens": self.total_output_tokens,
-                "cache_read_input_tokens": 0
-            }
-        }
-        return self._create_sse_event("message_delta", data)
+        return self.sse.message_delta(stop_reason, self.total_input_tokens, self.total_output_tokens, self.cached_input_tokens)
     
-    def _create_message_stop_event(self) -> str:
+    def _create_message_stop_event(self) -> bytes:
         """创建message_stop事件"""
-        data = {"type": "message_stop"}
-        return self._create_sse_event("message_stop", data)
+        return self.sse.message_stop()
     
-    async def convert_stream(self, chunk: str, platform_type: str = "openai") -> str:
+    async def convert_stream(self, chunk: str, platform_type: str = "openai") -> bytes:
         """转换流式响应块 - 根据平台类型进行不同的转换"""
         try:
             # 检查chunk是否为空
             if chunk is None:
-                debug_print(f"[DEBUG] convert_stream: 收到None chunk, platform_type={platform_type}")
-                return ""
+                trace("[DEBUG] convert_stream: 收到None chunk, platform_type=%s", platform_type)
+                return b""
             
-            debug_print(f"[DEBUG] convert_stream: platform_type={platform_type}, chunk长度={len(chunk)}, chunk前50字符={repr(chunk[:50])}")
+            trace("[DEBUG] convert_stream: platform_type=%s, chunk长度=%s, chunk前50字符=%r", platform_type, len(chunk), chunk[:50])
             
             # 处理不同平台的数据格式
             if platform_type == "qwen":
@@ -654,23 +690,23 @@ class StreamingConverter:
                 result = self._convert_openai_chunk(chunk)
             
             if result:
-                debug_print(f"[DEBUG] convert_stream: 转换成功, 输出长度={len(result)}")
+                trace("[DEBUG] convert_stream: 转换成功, 输出长度=%s", len(result))
             
             return result
         except Exception as e:
             print(f"[ERROR] convert_stream: 转换失败: {e}")
             logger.error(f"转换流式响应失败: {e}")
-            return ""
+            return b""
     
-    def _convert_qwen_chunk(self, chunk: str) -> str:
+    def _convert_qwen_chunk(self, chunk: str) -> bytes:
         """转换通义千问的chunk格式"""
         try:
             # 检查chunk是否为空或None
             if not chunk:
-                debug_print(f"[DEBUG] _convert_qwen_chunk: 收到空chunk")
-                return ""
+                trace("[DEBUG] _convert_qwen_chunk: 收到空chunk")
+                return b""
             
-            debug_print(f"[DEBUG] _convert_qwen_chunk: 处理chunk: {repr(chunk[:100])}")
+            trace("[DEBUG] _convert_qwen_chunk: 处理chunk: %r", chunk[:100])
             
             # 去掉"data: "前缀
             if chunk.startswith("data: "):
@@ -678,47 +714,48 @@ class StreamingConverter:
                 if json_str == "[DONE]":
                     return self._handle_stream_end()
                 
-                data = json.loads(json_str)
+                data = fast_json.loads(json_str)
             else:
-                data = json.loads(chunk)
+                data = fast_json.loads(chunk)
             
             # 检查data是否有效
             if not data or not isinstance(data, dict):
-                debug_print(f"[DEBUG] _convert_qwen_chunk: data无效或为空: {data}")
-                return ""
+                trace("[DEBUG] _convert_qwen_chunk: data无效或为空: %s", data)
+                return b""
             
-            debug_print(f"[DEBUG] _convert_qwen_chunk: 解析成功的数据结构: {list(data.keys()) if data else 'None'}")
-            debug_print(f"[DEBUG] _convert_qwen_chunk: 完整数据内容: {data}")
+            trace("[DEBUG] _convert_qwen_chunk: 解析成功的数据结构: %s", data.keys() if data else None)
+            trace("[DEBUG] _convert_qwen_chunk: 完整数据内容: %s", data)
             
             # 提取基本信息
             if "id" in data:
-                debug_print(f"[DEBUG] _convert_qwen_chunk: 提取到id: {data['id']}")
+                trace("[DEBUG] _convert_qwen_chunk: 提取到id: %s", data['id'])
                 self.message_id = self._normalize_message_id(data["id"])
-                debug_print(f"[DEBUG] _convert_qwen_chunk: 标准化后的message_id: {self.message_id}")
+                trace("[DEBUG] _convert_qwen_chunk: 标准化后的message_id: %s", self.message_id)
             elif self.message_id == "msg_unknown":
                 # 为通义千问生成一个默认ID
                 self.message_id = generate_claude_message_id()
-                debug_print(f"[DEBUG] _convert_qwen_chunk: 生成默认message_id: {self.message_id}")
+                trace("[DEBUG] _convert_qwen_chunk: 生成默认message_id: %s", self.message_id)
             
             if "model" in data:
-                debug_print(f"[DEBUG] _convert_qwen_chunk: 提取到model: {data['model']}")
+                trace("[DEBUG] _convert_qwen_chunk: 提取到model: %s", data['model'])
                 self.model_name = data["model"]
-                debug_print(f"[DEBUG] _convert_qwen_chunk: 设置model_name: {self.model_name}")
+                trace("[DEBUG] _convert_qwen_chunk: 设置model_name: %s", self.model_name)
             elif self.model_name == "unknown":
                 # 使用默认的模型名
                 self.model_name = "qwen-turbo"
-                debug_print(f"[DEBUG] _convert_qwen_chunk: 使用默认model_name: {self.model_name}")
+                trace("[DEBUG] _convert_qwen_chunk: 使用默认model_name: %s", self.model_name)
             
             # 提取usage信息（如果有）
             if "usage" in data and data["usage"]:
                 usage = data["usage"]
+                self.cached_input_tokens = cached_prompt_tokens(usage) or self.cached_input_tokens
                 if "prompt_tokens" in usage and usage["prompt_tokens"] > 0:
                     # 如果API提供了准确的prompt_tokens，使用API值
                     self.total_input_tokens = usage["prompt_tokens"]
-                    debug_print(f"[DEBUG] _convert_qwen_chunk: 使用API提供的input_tokens: {self.total_input_tokens}")
+                    trace("[DEBUG] _convert_qwen_chunk: 使用API提供的input_tokens: %s", self.total_input_tokens)
                 if "completion_tokens" in usage:
-                    self.total_output_tokens = usage["completion_tokens"]
-                    debug_print(f"[DEBUG] _convert_qwen_chunk: 使用API提供的output_tokens: {self.total_output_tokens}")
+                    self.output_token_counter.set_upstream(usage["completion_tokens"])
+                    trace("[DEBUG] _convert_qwen_chunk: 使用API提供的output_tokens: %s", self.total_output_tokens)
             
             # 处理选择
             if "choices" in data and len(data["choices"]) > 0:
@@ -727,7 +764,7 @@ class StreamingConverter:
                 content = delta.get("content", "")
                 finish_reason = choice.get("finish_reason")
                 
-                result = ""
+                result = b""
                 
                 # 发送初始事件
                 if not self.message_started:
@@ -742,9 +779,9 @@ class StreamingConverter:
                 # 发送内容增量
                 if content:
                     result += self._create_content_delta_event(content)
-                    self.current_content += content
-                    # 更精确的token计算：中文字符按字计算，英文按单词计算
-                    self.total_output_tokens = self._estimate_tokens(self.current_content)
+                    self._content_capture.append(content)
+                    # 增量估算token，只处理新增内容
+                    self.output_token_counter.add(content)
                 
                 # 处理结束
                 if finish_reason == "stop":
@@ -752,58 +789,59 @@ class StreamingConverter:
                 
                 return result
             
-            return ""
+            return b""
             
-        except json.JSONDecodeError:
-            return ""
+        except fast_json.JSONDecodeError:
+            return b""
     
-    def _convert_openrouter_chunk(self, chunk: str) -> str:
+    def _convert_openrouter_chunk(self, chunk: str) -> bytes:
         """转换OpenRouter的chunk格式"""
         try:
             # 检查chunk是否为空或None
             if not chunk:
-                return ""
+                return b""
             
-            debug_print(f"[DEBUG] _convert_openrouter_chunk: 处理chunk: {repr(chunk[:100])}")
+            trace("[DEBUG] _convert_openrouter_chunk: 处理chunk: %r", chunk[:100])
             
             # 处理OpenRouter的特殊前缀
             if chunk.startswith(": OPENROUTER PROCESSING"):
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: 忽略处理状态消息")
-                return ""  # 忽略处理状态消息
+                trace("[DEBUG] _convert_openrouter_chunk: 忽略处理状态消息")
+                return b""  # 忽略处理状态消息
             
             # 去掉"data: "前缀
             if chunk.startswith("data: "):
                 json_str = chunk[6:].strip()
                 if json_str == "[DONE]":
-                    debug_print(f"[DEBUG] _convert_openrouter_chunk: 收到[DONE]信号")
+                    trace("[DEBUG] _convert_openrouter_chunk: 收到[DONE]信号")
                     return self._handle_stream_end()
                 
-                data = json.loads(json_str)
+                data = fast_json.loads(json_str)
             else:
                 # 尝试直接解析JSON
-                data = json.loads(chunk)
+                data = fast_json.loads(chunk)
             
-            debug_print(f"[DEBUG] _convert_openrouter_chunk: 解析成功的数据结构: {list(data.keys())}")
-            debug_print(f"[DEBUG] _convert_openrouter_chunk: 完整数据内容: {data}")
+            trace("[DEBUG] _convert_openrouter_chunk: 解析成功的数据结构: %s", data.keys())
+            trace("[DEBUG] _convert_openrouter_chunk: 完整数据内容: %s", data)
             
             # 提取基本信息
             if "id" in data:
                 self.message_id = self._normalize_message_id(data["id"])
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: 提取到id: {data['id']}")
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: 标准化后的message_id: {self.message_id}")
+                trace("[DEBUG] _convert_openrouter_chunk: 提取到id: %s", data['id'])
+                trace("[DEBUG] _convert_openrouter_chunk: 标准化后的message_id: %s", self.message_id)
             if "model" in data:
                 self.model_name = data["model"]
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: 提取到model: {data['model']}")
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: 设置model_name: {self.model_name}")
+                trace("[DEBUG] _convert_openrouter_chunk: 提取到model: %s", data['model'])
+                trace("[DEBUG] _convert_openrouter_chunk: 设置model_name: %s", self.model_name)
             
             # 提取usage信息（如果有）
             if "usage" in data and data["usage"]:
                 usage = data["usage"]
+                self.cached_input_tokens = cached_prompt_tokens(usage) or self.cached_input_tokens
                 if "prompt_tokens" in usage:
                     self.total_input_tokens = usage["prompt_tokens"]
                 if "completion_tokens" in usage:
-                    self.total_output_tokens = usage["completion_tokens"]
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: 提取到usage信息: input={self.total_input_tokens}, output={self.total_output_tokens}")
+                    self.output_token_counter.set_upstream(usage["completion_tokens"])
+                trace("[DEBUG] _convert_openrouter_chunk: 提取到usage信息: input=%s, output=%s", self.total_input_tokens, self.total_output_tokens)
             
             # 处理选择
             if "choices" in data and len(data["choices"]) > 0:
@@ -812,10 +850,10 @@ class StreamingConverter:
                 content = delta.get("content", "")
                 finish_reason = choice.get("finish_reason")
                 
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: choice={choice}")
-                debug_print(f"[DEBUG] _convert_openrouter_chunk: content='{content}', finish_reason={finish_reason}")
+                trace("[DEBUG] _convert_openrouter_chunk: choice=%s", choice)
+                trace("[DEBUG] _convert_openrouter_chunk: content='%s', finish_reason=%s", content, finish_reason)
                 
-                result = ""
+                result = b""
                 
                 # 发送初始事件
                 if not self.message_started:
@@ -826,54 +864,55 @@ class StreamingConverter:
                     result += self._create_content_delta_event("")
                     self.message_started = True
                     self.content_block_started = True
-                    debug_print(f"[DEBUG] _convert_openrouter_chunk: 发送了初始事件")
+                    trace("[DEBUG] _convert_openrouter_chunk: 发送了初始事件")
                 
                 # 发送内容增量
                 if content:
                     result += self._create_content_delta_event(content)
-                    self.current_content += content
-                    # 更精确的token计算：中文字符按字计算，英文按单词计算
-                    self.total_output_tokens = self._estimate_tokens(self.current_content)
-                    debug_print(f"[DEBUG] _convert_openrouter_chunk: 发送内容增量: '{content}'")
+                    self._content_capture.append(content)
+                    # 增量估算token，只处理新增内容
+                    self.output_token_counter.add(content)
+                    trace("[DEBUG] _convert_openrouter_chunk: 发送内容增量: '%s'", content)
                 
                 # 处理使用统计（覆盖之前的估算）
                 if "usage" in data and data["usage"]:
                     usage = data["usage"]
+                    self.cached_input_tokens = cached_prompt_tokens(usage) or self.cached_input_tokens
                     if "prompt_tokens" in usage and usage.get("prompt_tokens", 0) > 0:
                         # 如果API提供了准确的prompt_tokens，使用API值
                         self.total_input_tokens = usage.get("prompt_tokens", 0)
-                        debug_print(f"[DEBUG] _convert_openrouter_chunk: 使用API提供的input_tokens: {self.total_input_tokens}")
+                        trace("[DEBUG] _convert_openrouter_chunk: 使用API提供的input_tokens: %s", self.total_input_tokens)
                     if "completion_tokens" in usage:
-                        self.total_output_tokens = usage.get("completion_tokens", 0)
-                        debug_print(f"[DEBUG] _convert_openrouter_chunk: 使用API提供的output_tokens: {self.total_output_tokens}")
+                        self.output_token_counter.set_upstream(usage.get("completion_tokens", 0))
+                        trace("[DEBUG] _convert_openrouter_chunk: 使用API提供的output_tokens: %s", self.total_output_tokens)
                 
                 # 处理结束
                 if finish_reason == "stop":
                     result += self._handle_stream_end()
-                    debug_print(f"[DEBUG] _convert_openrouter_chunk: 处理流结束")
+                    trace("[DEBUG] _convert_openrouter_chunk: 处理流结束")
                 
                 return result
             else:
                 # 如果没有choices但有usage，可能是最后的统计信息
                 if "usage" in data and data["usage"]:
-                    debug_print(f"[DEBUG] _convert_openrouter_chunk: 只有usage信息的chunk")
-                    return ""  # 不输出任何内容，只更新统计
+                    trace("[DEBUG] _convert_openrouter_chunk: 只有usage信息的chunk")
+                    return b""  # 不输出任何内容，只更新统计
             
-            return ""
+            return b""
             
-        except json.JSONDecodeError as e:
-            debug_print(f"[DEBUG] _convert_openrouter_chunk: JSON解析失败: {e}")
-            return ""
+        except fast_json.JSONDecodeError as e:
+            trace("[DEBUG] _convert_openrouter_chunk: JSON解析失败: %s", e)
+            return b""
         except Exception as e:
             print(f"[ERROR] _convert_openrouter_chunk: 处理失败: {e}")
-            return ""
+            return b""
     
-    def _convert_openai_chunk(self, chunk: str) -> str:
+    def _convert_openai_chunk(self, chunk: str) -> bytes:
         """转换标准OpenAI格式的chunk"""
         try:
             # 检查chunk是否为空或None
             if not chunk:
-                return ""
+                return b""
             
             # 去掉"data: "前缀
             if chunk.startswith("data: "):
@@ -881,9 +920,9 @@ class StreamingConverter:
                 if json_str == "[DONE]":
                     return self._handle_stream_end()
                 
-                data = json.loads(json_str)
+                data = fast_json.loads(json_str)
             else:
-                data = json.loads(chunk)
+                data = fast_json.loads(chunk)
             
             # 提取基本信息
             if "id" in data:
@@ -894,13 +933,14 @@ class StreamingConverter:
             # 提取usage信息（如果有）
             if "usage" in data and data["usage"]:
                 usage = data["usage"]
+                self.cached_input_tokens = cached_prompt_tokens(usage) or self.cached_input_tokens
                 if "prompt_tokens" in usage and usage.get("prompt_tokens", 0) > 0:
                     # 如果API提供了准确的prompt_tokens，使用API值
                     self.total_input_tokens = usage.get("prompt_tokens", 0)
-                    debug_print(f"[DEBUG] _convert_openai_chunk: 使用API提供的input_tokens: {self.total_input_tokens}")
+                    trace("[DEBUG] _convert_openai_chunk: 使用API提供的input_tokens: %s", self.total_input_tokens)
                 if "completion_tokens" in usage:
-                    self.total_output_tokens = usage.get("completion_tokens", 0)
-                    debug_print(f"[DEBUG] _convert_openai_chunk: 使用API提供的output_tokens: {self.total_output_tokens}")
+                    self.output_token_counter.set_upstream(usage.get("completion_tokens", 0))
+                    trace("[DEBUG] _convert_openai_chunk: 使用API提供的output_tokens: %s", self.total_output_tokens)
             
             # 处理选择
             if "choices" in data and len(data["choices"]) > 0:
@@ -909,7 +949,7 @@ class StreamingConverter:
                 content = delta.get("content", "")
                 finish_reason = choice.get("finish_reason")
                 
-                result = ""
+                result = b""
                 
                 # 发送初始事件
                 if not self.message_started:
@@ -924,9 +964,9 @@ class StreamingConverter:
                 # 发送内容增量
                 if content:
                     result += self._create_content_delta_event(content)
-                    self.current_content += content
-                    # 更精确的token计算：中文字符按字计算，英文按单词计算
-                    self.total_output_tokens = self._estimate_tokens(self.current_content)
+                    self._content_capture.append(content)
+                    # 增量估算token，只处理新增内容
+                    self.output_token_counter.add(content)
                 
                 # 处理结束
                 if finish_reason == "stop":
@@ -934,20 +974,20 @@ class StreamingConverter:
                 
                 return result
             
-            return ""
+            return b""
             
-        except json.JSONDecodeError:
-            return ""
+        except fast_json.JSONDecodeError:
+            return b""
     
-    def _convert_ollama_chunk(self, chunk: str) -> str:
+    def _convert_ollama_chunk(self, chunk: str) -> bytes:
         """转换Ollama的chunk格式"""
         try:
             # 检查chunk是否为空或None
             if not chunk:
-                return ""
+                return b""
             
             # Ollama直接返回JSON对象，不使用"data: "前缀
-            data = json.loads(chunk.strip())
+            data = fast_json.loads(chunk.strip())
             
             # 提取基本信息
             if "model" in data:
@@ -962,7 +1002,7 @@ class StreamingConverter:
                 content = message.get("content", "")
                 done = data.get("done", False)
                 
-                result = ""
+                result = b""
                 
                 # 发送初始事件
                 if not self.message_started:
@@ -978,18 +1018,18 @@ class StreamingConverter:
                 if content is not None:  # 只要content字段存在就发送
                     result += self._create_content_delta_event(content)
                     if content:  # 只有非空内容才累加和计算token
-                        self.current_content += content
-                        # 更精确的token计算：中文字符按字计算，英文按单词计算
-                        self.total_output_tokens = self._estimate_tokens(self.current_content)
+                        self._content_capture.append(content)
+                        # 增量估算token，只处理新增内容
+                        self.output_token_counter.add(content)
                 
                 # 处理使用统计（从Ollama的详细信息中提取）
                 if done and "prompt_eval_count" in data and data.get("prompt_eval_count", 0) > 0:
                     # 如果Ollama提供了准确的prompt_eval_count，使用API值
                     self.total_input_tokens = data.get("prompt_eval_count", 0)
-                    debug_print(f"[DEBUG] _convert_ollama_chunk: 使用API提供的input_tokens: {self.total_input_tokens}")
+                    trace("[DEBUG] _convert_ollama_chunk: 使用API提供的input_tokens: %s", self.total_input_tokens)
                 if done and "eval_count" in data:
-                    self.total_output_tokens = data.get("eval_count", 0)
-                    debug_print(f"[DEBUG] _convert_ollama_chunk: 使用API提供的output_tokens: {self.total_output_tokens}")
+                    self.output_token_counter.set_upstream(data.get("eval_count", 0))
+                    trace("[DEBUG] _convert_ollama_chunk: 使用API提供的output_tokens: %s", self.total_output_tokens)
                 
                 # 处理结束
                 if done:
@@ -997,17 +1037,17 @@ class StreamingConverter:
                 
                 return result
             
-            return ""
+            return b""
             
-        except json.JSONDecodeError:
-            return ""
+        except fast_json.JSONDecodeError:
+            return b""
     
-    def _convert_lmstudio_chunk(self, chunk: str) -> str:
+    def _convert_lmstudio_chunk(self, chunk: str) -> bytes:
         """转换LMStudio的chunk格式（类似OpenAI格式）"""
         try:
             # 检查chunk是否为空或None
             if not chunk:
-                return ""
+                return b""
             
             # 去掉"data: "前缀
             if chunk.startswith("data: "):
@@ -1015,9 +1055,9 @@ class StreamingConverter:
                 if json_str == "[DONE]":
                     return self._handle_stream_end()
                 
-                data = json.loads(json_str)
+                data = fast_json.loads(json_str)
             else:
-                data = json.loads(chunk)
+                data = fast_json.loads(chunk)
             
             # 提取基本信息
             if "id" in data:
@@ -1028,13 +1068,14 @@ class StreamingConverter:
             # 提取usage信息（如果有）
             if "usage" in data and data["usage"]:
                 usage = data["usage"]
+                self.cached_input_tokens = cached_prompt_tokens(usage) or self.cached_input_tokens
                 if "prompt_tokens" in usage and usage.get("prompt_tokens", 0) > 0:
                     # 如果LMStudio提供了准确的prompt_tokens，使用API值
                     self.total_input_tokens = usage.get("prompt_tokens", 0)
-                    debug_print(f"[DEBUG] _convert_lmstudio_chunk: 使用API提供的input_tokens: {self.total_input_tokens}")
+                    trace("[DEBUG] _convert_lmstudio_chunk: 使用API提供的input_tokens: %s", self.total_input_tokens)
                 if "completion_tokens" in usage:
-                    self.total_output_tokens = usage.get("completion_tokens", 0)
-                    debug_print(f"[DEBUG] _convert_lmstudio_chunk: 使用API提供的output_tokens: {self.total_output_tokens}")
+                    self.output_token_counter.set_upstream(usage.get("completion_tokens", 0))
+                    trace("[DEBUG] _convert_lmstudio_chunk: 使用API提供的output_tokens: %s", self.total_output_tokens)
             
             # 处理选择
             if "choices" in data and len(data["choices"]) > 0:
@@ -1043,7 +1084,7 @@ class StreamingConverter:
                 content = delta.get("content", "")
                 finish_reason = choice.get("finish_reason")
                 
-                result = ""
+                result = b""
                 
                 # 发送初始事件
                 if not self.message_started:
@@ -1058,9 +1099,9 @@ class StreamingConverter:
                 # 发送内容增量
                 if content:
                     result += self._create_content_delta_event(content)
-                    self.current_content += content
-                    # 更精确的token计算：中文字符按字计算，英文按单词计算
-                    self.total_output_tokens = self._estimate_tokens(self.current_content)
+                    self._content_capture.append(content)
+                    # 增量估算token，只处理新增内容
+                    self.output_token_counter.add(content)
                 
                 # 处理结束
                 if finish_reason == "stop":
@@ -1068,25 +1109,24 @@ class StreamingConverter:
                 
                 return result
             
-            return ""
+            return b""
             
-        except json.JSONDecodeError:
-            return ""
+        except fast_json.JSONDecodeError:
+            return b""
     
-    def _handle_stream_end(self) -> str:
+    def _handle_stream_end(self) -> bytes:
         """处理流结束"""
-        result = ""
+        result = b""
         if self.content_block_started:
+            # 发送扫描器中剩余的文本（被保留的标签前缀或未闭合的工具调用）
+            for _, text in self.tool_scanner.finish():
+                result += self._create_text_delta_event(text)
             result += self._create_content_stop_event()
             
             # 如果有工具调用，需要添加工具调用的content_block_stop
             if self.has_tool_use:
                 # 为工具调用添加 content_block_stop
-                tool_stop_data = {
-                    "type": "content_block_stop",
-                    "index": 1
-                }
-                result += self._create_sse_event("content_block_stop", tool_stop_data)
+                result += self.sse.content_block_stop(1)
                 
                 # 设置stop_reason为tool_use
                 result += self._create_message_delta_event("tool_use")
@@ -1113,22 +1153,24 @@ class StreamingConverter:
             "stop_sequence": None,
             "usage": {
                 "input_tokens": self.total_input_tokens,
-                "output_tokens": self.total_output_tokens
+                "output_tokens": self.total_output_tokens,
+                "cache_read_input_tokens": self.cached_input_tokens
             }
         }
     
     def reset(self):
         """重置转换器状态"""
         self.buffer = ""
-        self.event_id = 0
+        self.sse.reset()
         self.message_started = False
         self.content_block_started = False
         self.total_input_tokens = 0
-        self.total_output_tokens = 0
+        self.cached_input_tokens = 0
+        self.output_token_counter = StreamingTokenCounter()
         self.message_id = generate_claude_message_id()
         self.model_name = "unknown"
-        self.current_content = ""
-        self.tool_use_buffer = ""
-        self.in_tool_use = False
+        self._content_capture.close()
+        self._content_capture = CaptureBuffer()
+        self.tool_scanner.reset()
         self.tool_use_count = 0
         self.has_tool_use = False
\ No newline at end of file
@@ -108,6 +108,7 @@ KeyManager.prototype.openKeyForm = function(keyData = null) {
         if (keyData) {
             document.getElementById('key-name').value = keyData.key_name || '';
             document.getElementById('key-max-tokens').value = keyData.max_tokens > 0 ? (keyData.max_tokens / 10000) : 0;
+            document.getElementById('key-response-cache').checked = keyData.response_cache_enabled !== false;
             
             // 处理到期时间
             if (keyData.expires_at) {
@@ -169,7 +170,8 @@ KeyManager.prototype.saveKey = async function() {
         const data = {
             key_name: keyName,
             max_tokens: Math.round(maxTokens * 10000), // 转换为实际token数量
-            expires_at: expiresAt
+            expires_at: expiresAt,
+            response_cache_enabled: document.getElementById('key-response-cache').checked
         };
 
         let response;
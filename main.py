@@ -4,11 +4,12 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
+from sqlalchemy.exc import OperationalError
 import httpx
-import json
 import time
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
 import asyncio
 import logging
 
@@ -23,18 +24,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def debug_print(*args, **kwargs):
-    """统一的DEBUG输出函数，只在DEBUG_MODE启用时输出"""
-    if DEBUG_MODE:
-        print(*args, **kwargs)
-
 from database import (
-    get_db, APIRecord, PlatformConfig, ModelConfig, RoutingConfig, RoutingScene, SystemConfig,
+    get_db, get_read_db, run_db, db_executor, SessionLocal, APIRecord, PlatformConfig, ModelConfig, RoutingConfig, RoutingScene, SystemConfig,
     ClaudeCodeServer, UserAuth, LoginSession, hash_password, verify_password, generate_session_token
 )
-from multi_platform_service import multi_platform_service
+from multi_platform_service import multi_platform_service, RequestContext
+from format_converter import cached_prompt_tokens
+from record_writer import record_writer
+from blob_store import blob_store
+from conversation_store import conversation_store
+from circuit_breaker import server_health, BREAKER_FAILURE_STATUS
+import fast_json
+from tracing import trace, start_trace, end_trace
+from capture_buffer import CaptureBuffer
+from parsed_request import ParsedRequest
+from record_query import RecordFilters, RECORDS_MAX_LIMIT, SUMMARY_COLUMNS, apply_cursor, encode_cursor, record_summary
+from record_search import search_index, SEARCH_MAX_LIMIT
+from response_cache import RESPONSE_CACHE_CHARGE_HITS
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时建立上游连接池和记录写入任务，关闭时写完剩余记录并释放连接"""
+    db = SessionLocal()
+    try:
+        await multi_platform_service.start(db)
+    except Exception as e:
+        logger.error(f"❌ [Lifespan] 多平台服务启动失败: {e}")
+    finally:
+        db.close()
+    record_writer.start()
+    await server_health.start()
+    
+    yield
+    
+    await server_health.stop()
+    await record_writer.stop()
+    await multi_platform_service.shutdown()
+    if upstream_http_client is not None:
+        await upstream_http_client.aclose()
+    db_executor.shutdown(wait=False)
 
-app = FastAPI(title="API Hook System")
+app = FastAPI(title="API Hook System", lifespan=lifespan)
 
 # 静态文件服务
 app.mount("/static", StaticFiles(directory="."), name="static")
@@ -130,7 +160,7 @@ class ConnectionManager:
     async def broadcast(self, message: dict):
         for connection in self.active_connections:
             try:
-                await connection.send_text(json.dumps(message))
+                await connection.send_text(fast_json.dumps(message))
             except:
                 # 连接已断开，移除连接
                 self.active_connections.remove(connection)
@@ -164,7 +194,7 @@ def check_first_login(db: Session = Depends(get_db)) -> bool:
     return user.is_first_login if user else True
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root(request: Request, db: Session = Depends(get_db)):
+def read_root(request: Request, db: Session = Depends(get_db)):
     # 检查是否已登录
     session = get_current_session(request, db)
     if not session:
@@ -370,9 +400,9 @@ async def websocket_endpoint(websocket: WebSocket):
         while True:
             data = await websocket.receive_text()
             # 处理来自前端的消息
-            message = json.loads(data)
+            message = fast_json.loads(data)
             if message.get("type") == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
+                await websocket.send_text(fast_json.dumps({"type": "pong"}))
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
@@ -456,7 +486,7 @@ async def change_password(request: Request, db: Session = Depends(get_db)):
     return {"message": "密码修改成功"}
 
 @app.post("/_api/logout")
-async def logout(request: Request, db: Session = Depends(get_db)):
+def logout(request: Request, db: Session = Depends(get_db)):
     """用户登出"""
     session_token = request.cookies.get("session_token")
     if session_token:
@@ -479,7 +509,7 @@ async def get_config(session: LoginSession = Depends(require_auth)):
 async def update_config(request: Request, session: LoginSession = Depends(require_auth)):
     global config_data
     new_config = await request.json()
-    logger.info(f"🔄 [Config] 收到配置更新请求: {json.dumps(new_config, ensure_ascii=False)}")
+    logger.info(f"🔄 [Config] 收到配置更新请求: {fast_json.dumps(new_config, ensure_ascii=False)}")
     
     # 如果工作模式发生变化，持久化到数据库
     if "current_work_mode" in new_config and new_config["current_work_mode"] != config_data.get("current_work_mode"):
@@ -489,14 +519,14 @@ async def update_config(request: Request, session: LoginSession = Depends(requir
     
     config_data.update(new_config)
     await manager.broadcast({"type": "config_updated", "config": config_data})
-    logger.info(f"✅ [Config] 配置更新完成并广播: {json.dumps(config_data, ensure_ascii=False)}")
+    logger.info(f"✅ [Config] 配置更新完成并广播: {fast_json.dumps(config_data, ensure_ascii=False)}")
     return {"message": "配置已更新", "config": config_data}
 
 @app.post("/control/clear-records")
-async def clear_records(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+async def clear_records(session: LoginSession = Depends(require_auth)):
     try:
-        db.query(APIRecord).delete()
-        db.commit()
+        # 由记录写入器执行，不会与正在写入的批次交错
+        await record_writer.clear()
         return {"message": "记录已清空"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"清空记录失败: {str(e)}"})
@@ -508,7 +538,7 @@ async def get_debug_status(session: LoginSession = Depends(require_auth)):
 
 # 多平台API端点
 @app.get("/_api/platforms")
-async def get_platforms(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def get_platforms(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
     """获取所有平台配置"""
     platforms = db.query(PlatformConfig).all()
     return [
@@ -581,7 +611,7 @@ async def get_models(session: LoginSession = Depends(require_auth), db: Session
         return JSONResponse(status_code=500, content={"error": f"获取模型列表失败: {str(e)}"})
 
 @app.get("/_api/models/from-db")
-async def get_models_from_db(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def get_models_from_db(session: LoginSession = Depends(require_auth), db: Session = Depends(get_read_db)):
     """从数据库获取模型信息（用于配置恢复）"""
     try:
         model_configs = db.query(ModelConfig).filter(ModelConfig.enabled == True).all()
@@ -623,9 +653,13 @@ async def refresh_models(request: Request, session: LoginSession = Depends(requi
         return JSONResponse(status_code=500, content={"error": f"刷新模型列表失败: {str(e)}"})
 
 @app.get("/_api/platforms/test")
-async def test_platform_connections(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
-    """测试平台连接"""
+async def test_platform_connections(detail: bool = False, refresh: bool = False, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+    """测试平台连接，detail=true 时返回各平台耗时和错误信息，refresh=true 时忽略缓存"""
     try:
+        if detail:
+            return await multi_platform_service.get_platform_report(db, use_cache=not refresh)
+        if refresh:
+            multi_platform_service.platform_manager.invalidate_probe_cache()
         results = await multi_platform_service.test_platform_connections(db)
         return results
     except Exception as e:
@@ -650,9 +684,10 @@ async def test_single_platform(request: Request, session: LoginSession = Depends
         # 重新初始化服务以加载最新配置
         await multi_platform_service.initialize(db)
         
-        # 测试连接
-        results = await multi_platform_service.test_platform_connections(db)
-        platform_success = results.get(platform_type, False)
+        # 只测试指定平台
+        report = await multi_platform_service.get_platform_report(db, platform_type=platform_type)
+        platform_result = report[0] if report else {"ok": False, "error": "平台未配置或未启用"}
+        platform_success = platform_result["ok"]
         
         if platform_success:
             # 如果连接成功，尝试发送测试消息
@@ -664,8 +699,8 @@ async def test_single_platform(request: Request, session: LoginSession = Depends
                 logger.error(f"❌ [API] {platform_type} 测试消息发送失败: {test_error}")
                 return {"success": False, "error": f"连接成功但测试消息失败: {str(test_error)}"}
         else:
-            logger.error(f"❌ [API] {platform_type} 连接失败")
-            return {"success": False, "error": f"{platform_type} 连接失败"}
+            logger.error(f"❌ [API] {platform_type} 连接失败: {platform_result['error']}")
+            return {"success": False, "error": f"{platform_type} 连接失败: {platform_result['error']}"}
             
     except Exception as e:
         logger.error(f"❌ [API] 测试单个平台出错: {e}")
@@ -692,8 +727,8 @@ async def get_routing_config(session: LoginSession = Depends(require_auth), db:
             config_data = {}
             if config.config_data:
                 try:
-                    config_data = json.loads(config.config_data)
-                except json.JSONDecodeError:
+                    config_data = fast_json.loads(config.config_data)
+                except fast_json.JSONDecodeError:
                     continue
             
             # 如果是智能路由配置，从RoutingScene表中获取最新的场景配置
@@ -705,7 +740,7 @@ async def get_routing_config(session: LoginSession = Depends(require_auth), db:
                 scene_list = []
                 for scene in scenes:
                     try:
-                        models = json.loads(scene.models) if scene.models else []
+                        models = fast_json.loads(scene.models) if scene.models else []
                         scene_data = {
                             "name": scene.scene_name,
                             "description": scene.scene_description,
@@ -717,7 +752,7 @@ async def get_routing_config(session: LoginSession = Depends(require_auth), db:
                         if scene.scene_name == "默认对话":
                             scene_data["is_default"] = True
                         scene_list.append(scene_data)
-                    except json.JSONDecodeError:
+                    except fast_json.JSONDecodeError:
                         continue
                 
                 config_data["scenes"] = scene_list
@@ -760,14 +795,14 @@ async def update_routing_config(request: Request, session: LoginSession = Depend
         
         if existing:
             existing.config_type = config_type
-            existing.config_data = json.dumps(config_data)
+            existing.config_data = fast_json.dumps(config_data)
             existing.is_active = True
             config_id = existing.id
         else:
             new_config = RoutingConfig(
                 config_name=config_name,
                 config_type=config_type,
-                config_data=json.dumps(config_data),
+                config_data=fast_json.dumps(config_data),
                 is_active=True
             )
             db.add(new_config)
@@ -807,9 +842,9 @@ async def update_routing_config(request: Request, session: LoginSession = Depend
                 # 更新config_data
                 config_data["scenes"] = scenes
                 if existing:
-                    existing.config_data = json.dumps(config_data)
+                    existing.config_data = fast_json.dumps(config_data)
                 else:
-                    new_config.config_data = json.dumps(config_data)
+                    new_config.config_data = fast_json.dumps(config_data)
             
             # 保存场景到RoutingScene表
             print(f"💾 [Backend] 开始保存 {len(scenes)} 个场景到数据库")
@@ -818,7 +853,7 @@ async def update_routing_config(request: Request, session: LoginSession = Depend
                     routing_config_id=config_id,
                     scene_name=scene["name"],
                     scene_description=scene["description"],
-                    models=json.dumps(scene["models"]),
+                    models=fast_json.dumps(scene["models"]),
                     priority=scene.get("priority", 0),
                     enabled=scene.get("enabled", True)
                 )
@@ -843,47 +878,134 @@ async def update_routing_config(request: Request, session: LoginSession = Depend
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"保存路由配置失败: {str(e)}"})
 
+@app.get("/_api/routing/stats")
+async def get_routing_stats(session: LoginSession = Depends(require_auth)):
+    """获取路由统计信息（对冲请求的对冲率、各模型胜出次数、浪费的token）"""
+    return multi_platform_service.get_routing_stats()
+
+@app.post("/_api/response-cache/clear")
+async def clear_response_cache(session: LoginSession = Depends(require_auth)):
+    """清空响应缓存"""
+    await multi_platform_service.response_cache.clear()
+    return {"message": "响应缓存已清空"}
+
 @app.get("/_api/records")
-async def get_records(limit: int = 100, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
-    records = db.query(APIRecord).order_by(desc(APIRecord.timestamp)).limit(limit).all()
-    return [
+def get_records(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    filters: RecordFilters = Depends(),
+    session: LoginSession = Depends(require_auth),
+    db: Session = Depends(get_read_db)
+):
+    """记录列表：服务端筛选，按 (timestamp, id) 倒序游标分页，下一页游标在 X-Next-Cursor 响应头中"""
+    limit = max(1, min(limit, RECORDS_MAX_LIMIT))
+    try:
+        query = apply_cursor(filters.apply(db.query(*SUMMARY_COLUMNS)), cursor)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": f"查询参数格式错误: {str(e)}"})
+
+    # 多查一条判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return JSONResponse(content=[record_summary(row) for row in rows], headers=headers)
+
+@app.get("/_api/records/search")
+def search_records(
+    q: str,
+    order: str = "rank",
+    limit: int = 20,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    filters: RecordFilters = Depends(),
+    session: LoginSession = Depends(require_auth),
+    db: Session = Depends(get_read_db)
+):
+    """全文搜索记录的用户输入和模型输出
+    order=rank 按相关度排序，用 offset 翻页（X-Next-Offset）；order=time 按写入时间倒序，用游标翻页（X-Next-Cursor）
+    筛选条件与记录列表相同，摘要中匹配的文字用 <mark></mark> 标出（原文未转义）
+    """
+    if not search_index.enabled:
+        return JSONResponse(status_code=400, content={"error": "全文搜索未启用"})
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    offset = max(0, offset)
+    try:
+        rows, use_match, terms = search_index.search(
+            db, SUMMARY_COLUMNS, q, filters, order=order, limit=limit,
+            cursor=int(cursor) if cursor else None, offset=offset
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": f"查询参数格式错误: {str(e)}"})
+    except OperationalError as e:
+        return JSONResponse(status_code=400, content={"error": f"搜索失败: {str(e.orig)}"})
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if order == "time":
+            headers["X-Next-Cursor"] = str(rows[-1].id)
+        else:
+            headers["X-Next-Offset"] = str(offset + limit)
+    results = [
         {
-            "id": record.id,
-            "method": record.method,
-            "path": record.path,
-            "timestamp": record.timestamp.isoformat(),
-            "response_status": record.response_status,
-            "duration_ms": record.duration_ms,
-            "user_key_id": record.user_key_id,
-            "target_platform": record.target_platform,
-            "target_model": record.target_model,
-            "token_usage": {
-                "input_tokens": record.input_tokens or 0,
-                "output_tokens": record.output_tokens or 0,
-                "total_tokens": record.total_tokens or 0
-            } if (record.input_tokens or 0) + (record.output_tokens or 0) > 0 else None
+            **record_summary(row),
+            "rank": round(row.rank, 4) if use_match else None,
+            **search_index.snippets(row, use_match, terms)
         }
-        for record in records
+        for row in rows
     ]
+    return JSONResponse(content=results, headers=headers)
+
+def load_search_fields(db: Session, record: APIRecord) -> Dict[str, Optional[str]]:
+    """还原建立全文索引需要的请求体和响应体"""
+    fields = blob_store.load_fields(db, record, ("body", "response_body"))
+    fields["body"] = conversation_store.restore_body(db, record, fields["body"])
+    return fields
+
+@app.post("/_api/records/search/backfill")
+async def backfill_search_index(session: LoginSession = Depends(require_auth)):
+    """为全文索引启用前的已有记录建立索引"""
+    if not search_index.enabled:
+        return JSONResponse(status_code=400, content={"error": "全文搜索未启用"})
+
+    def backfill():
+        db = SessionLocal()
+        try:
+            return search_index.backfill(db, load_search_fields)
+        finally:
+            db.close()
+
+    try:
+        count = await run_db(backfill)
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": f"建立索引失败: {str(e)}"})
+    return {"message": f"已为 {count} 条记录建立全文索引", "indexed": count}
 
 @app.get("/_api/records/{record_id}")
-async def get_record_detail(record_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def get_record_detail(record_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_read_db)):
     from database import UserKey
     
     record = db.query(APIRecord).filter(APIRecord.id == record_id).first()
     if not record:
         return JSONResponse(status_code=404, content={"message": "记录未找到"})
     
+    # 大字段可能保存在 record_blobs 表中，请求体可能只保存了相对上一轮的增量
+    fields = blob_store.load_fields(db, record)
+    fields["body"] = conversation_store.restore_body(db, record, fields["body"])
+    
     # 获取Token使用量（优先使用数据库字段，fallback到解析）
     if record.input_tokens is not None or record.output_tokens is not None or record.total_tokens is not None:
         token_info = {
             "input_tokens": record.input_tokens or 0,
             "output_tokens": record.output_tokens or 0,
-            "total_tokens": record.total_tokens or 0
+            "total_tokens": record.total_tokens or 0,
+            "cached_tokens": record.cached_tokens or 0
         }
     else:
         # 如果数据库字段为空，回退到解析response_body
-        token_info = parse_token_usage(record.response_body)
+        token_info = parse_token_usage(fields["response_body"])
     
     # 获取关联的KEY信息
     key_info = None
@@ -900,30 +1022,37 @@ async def get_record_detail(record_id: int, session: LoginSession = Depends(requ
         "id": record.id,
         "method": record.method,
         "path": record.path,
-        "headers": json.loads(record.headers) if record.headers else {},
-        "body": record.body,
+        "headers": fast_json.loads(fields["headers"]) if fields["headers"] else {},
+        "body": fields["body"],
         "response_status": record.response_status,
-        "response_headers": json.loads(record.response_headers) if record.response_headers else {},
-        "response_body": record.response_body,
+        "response_headers": fast_json.loads(record.response_headers) if record.response_headers else {},
+        "response_body": fields["response_body"],
         "timestamp": record.timestamp.isoformat(),
         "duration_ms": record.duration_ms,
         "target_platform": record.target_platform,
         "target_model": record.target_model,
         "platform_base_url": record.platform_base_url,
-        "processed_prompt": record.processed_prompt,
-        "processed_headers": record.processed_headers,
-        "model_raw_headers": record.model_raw_headers,
-        "model_raw_response": record.model_raw_response,
+        "processed_prompt": fields["processed_prompt"],
+        "processed_headers": fields["processed_headers"],
+        "model_raw_headers": fields["model_raw_headers"],
+        "model_raw_response": fields["model_raw_response"],
         "routing_scene": record.routing_scene,
         "user_key_id": record.user_key_id,
         "key_info": key_info,
-        "token_usage": token_info
+        "token_usage": token_info,
+        "capture_info": fast_json.loads(record.capture_info) if record.capture_info else None,
+        "cache_hit": bool(record.cache_hit)
     }
 
+@app.get("/_api/recorder/stats")
+async def get_recorder_stats(session: LoginSession = Depends(require_auth)):
+    """获取记录写入队列的统计信息"""
+    return record_writer.get_stats()
+
 # ==================== Claude Code 服务器管理 API ====================
 
 @app.get("/_api/claude-code-servers")
-async def get_claude_code_servers(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def get_claude_code_servers(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
     """获取所有Claude Code服务器配置"""
     servers = db.query(ClaudeCodeServer).order_by(ClaudeCodeServer.priority, ClaudeCodeServer.id).all()
     return [
@@ -936,7 +1065,8 @@ async def get_claude_code_servers(session: LoginSession = Depends(require_auth),
             "priority": server.priority,
             "enabled": server.enabled,
             "created_at": server.created_at.isoformat(),
-            "updated_at": server.updated_at.isoformat()
+            "updated_at": server.updated_at.isoformat(),
+            "breaker": server_health.get_state(server.id)
         }
         for server in servers
     ]
@@ -975,6 +1105,7 @@ async def create_claude_code_server(request: Request, session: LoginSession = De
         
         db.add(new_server)
         db.commit()
+        server_health.invalidate()
         db.refresh(new_server)
         
         return {
@@ -1036,6 +1167,7 @@ async def update_claude_code_server(server_id: int, request: Request, session: L
         
         server.updated_at = datetime.utcnow()
         db.commit()
+        server_health.invalidate()
         
         return {
             "id": server.id,
@@ -1053,7 +1185,7 @@ async def update_claude_code_server(server_id: int, request: Request, session: L
         return JSONResponse(status_code=500, content={"error": f"更新服务器配置失败: {str(e)}"})
 
 @app.delete("/_api/claude-code-servers/{server_id}")
-async def delete_claude_code_server(server_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def delete_claude_code_server(server_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
     """删除Claude Code服务器配置"""
     try:
         server = db.query(ClaudeCodeServer).filter(ClaudeCodeServer.id == server_id).first()
@@ -1063,6 +1195,7 @@ async def delete_claude_code_server(server_id: int, session: LoginSession = Depe
         # 删除服务器配置
         db.delete(server)
         db.commit()
+        server_health.invalidate()
         
         return {"message": "服务器配置删除成功"}
         
@@ -1086,6 +1219,7 @@ async def reorder_claude_code_servers(request: Request, session: LoginSession =
                 server.updated_at = datetime.utcnow()
         
         db.commit()
+        server_health.invalidate()
         return {"message": "服务器排序更新成功"}
         
     except Exception as e:
@@ -1094,7 +1228,7 @@ async def reorder_claude_code_servers(request: Request, session: LoginSession =
 # ==================== KEY 管理 API ====================
 
 @app.get("/_api/keys")
-async def get_user_keys(session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def get_user_keys(session: LoginSession = Depends(require_auth), db: Session = Depends(get_read_db)):
     """获取所有用户 KEY"""
     from database import UserKey
     
@@ -1108,6 +1242,7 @@ async def get_user_keys(session: LoginSession = Depends(require_auth), db: Sessi
             "used_tokens": key.used_tokens,
             "expires_at": key.expires_at.isoformat() if key.expires_at else None,
             "is_active": key.is_active,
+            "response_cache_enabled": key.response_cache_enabled is not False,
             "created_at": key.created_at.isoformat(),
             "updated_at": key.updated_at.isoformat()
         }
@@ -1125,6 +1260,7 @@ async def create_user_key(request: Request, session: LoginSession = Depends(requ
         key_name = data.get("key_name", "").strip()
         max_tokens = data.get("max_tokens", 0)
         expires_at_str = data.get("expires_at")  # 直接接收绝对时间
+        response_cache_enabled = bool(data.get("response_cache_enabled", True))
         
         if not key_name:
             return JSONResponse(status_code=400, content={"error": "KEY 名称不能为空"})
@@ -1157,12 +1293,14 @@ async def create_user_key(request: Request, session: LoginSession = Depends(requ
             key_name=key_name,
             api_key=api_key,
             max_tokens=max_tokens,
-            expires_at=expires_at
+            expires_at=expires_at,
+            response_cache_enabled=response_cache_enabled
         )
         
         db.add(new_key)
         db.commit()
         db.refresh(new_key)
+        multi_platform_service.response_cache.set_key_enabled(new_key.id, response_cache_enabled)
         
         return {
             "id": new_key.id,
@@ -1172,6 +1310,7 @@ async def create_user_key(request: Request, session: LoginSession = Depends(requ
             "used_tokens": new_key.used_tokens,
             "expires_at": new_key.expires_at.isoformat() if new_key.expires_at else None,
             "is_active": new_key.is_active,
+            "response_cache_enabled": new_key.response_cache_enabled,
             "created_at": new_key.created_at.isoformat(),
             "updated_at": new_key.updated_at.isoformat()
         }
@@ -1224,8 +1363,12 @@ async def update_user_key(key_id: int, request: Request, session: LoginSession =
         if "is_active" in data:
             key.is_active = data["is_active"]
         
+        if "response_cache_enabled" in data:
+            key.response_cache_enabled = bool(data["response_cache_enabled"])
+        
         key.updated_at = datetime.utcnow()
         db.commit()
+        multi_platform_service.response_cache.set_key_enabled(key.id, key.response_cache_enabled is not False)
         
         return {
             "id": key.id,
@@ -1235,6 +1378,7 @@ async def update_user_key(key_id: int, request: Request, session: LoginSession =
             "used_tokens": key.used_tokens,
             "expires_at": key.expires_at.isoformat() if key.expires_at else None,
             "is_active": key.is_active,
+            "response_cache_enabled": key.response_cache_enabled is not False,
             "created_at": key.created_at.isoformat(),
             "updated_at": key.updated_at.isoformat()
         }
@@ -1243,7 +1387,7 @@ async def update_user_key(key_id: int, request: Request, session: LoginSession =
         return JSONResponse(status_code=500, content={"error": f"更新 KEY 失败: {str(e)}"})
 
 @app.delete("/_api/keys/{key_id}")
-async def delete_user_key(key_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def delete_user_key(key_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
     """删除用户 KEY"""
     from database import UserKey, KeyUsageLog
     
@@ -1258,6 +1402,7 @@ async def delete_user_key(key_id: int, session: LoginSession = Depends(require_a
         # 删除 KEY
         db.delete(key)
         db.commit()
+        multi_platform_service.response_cache.set_key_enabled(key_id, True)
         
         return {"message": "KEY 删除成功"}
         
@@ -1265,12 +1410,12 @@ async def delete_user_key(key_id: int, session: LoginSession = Depends(require_a
         return JSONResponse(status_code=500, content={"error": f"删除 KEY 失败: {str(e)}"})
 
 @app.get("/_api/keys/{key_id}/statistics")
-async def get_key_statistics(
+def get_key_statistics(
     key_id: int, 
     start_date: str = None, 
     end_date: str = None,
     session: LoginSession = Depends(require_auth), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """获取 KEY 使用统计"""
     from database import UserKey, KeyUsageLog
@@ -1401,11 +1546,11 @@ async def get_key_statistics(
         return JSONResponse(status_code=500, content={"error": f"获取统计数据失败: {str(e)}"})
 
 @app.get("/_api/keys/statistics/overview")
-async def get_all_keys_statistics(
+def get_all_keys_statistics(
     start_date: str = None, 
     end_date: str = None,
     session: LoginSession = Depends(require_auth), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """获取所有 KEY 的概览统计"""
     from database import UserKey, KeyUsageLog
@@ -1481,7 +1626,7 @@ async def get_all_keys_statistics(
         return JSONResponse(status_code=500, content={"error": f"获取概览统计失败: {str(e)}"})
 
 @app.post("/_api/keys/{key_id}/reset")
-async def reset_key_usage(key_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
+def reset_key_usage(key_id: int, session: LoginSession = Depends(require_auth), db: Session = Depends(get_db)):
     """清零用户 KEY 的使用量"""
     from database import UserKey, KeyUsageLog
     from datetime import datetime
@@ -1514,7 +1659,6 @@ async def save_api_record(
     response_headers: Dict[str, Any],
     response_body: str,
     duration_ms: int,
-    db: Session,
     target_platform: Optional[str] = None,
     target_model: Optional[str] = None,
     routing_info: Optional[str] = None,
@@ -1525,9 +1669,11 @@ async def save_api_record(
     model_raw_response: Optional[str] = None,
     routing_scene: Optional[str] = None,
     user_key_id: Optional[int] = None,
-    token_usage: Optional[Dict[str, int]] = None
-):
-    """保存API调用记录"""
+    token_usage: Optional[Dict[str, int]] = None,
+    capture_info: Optional[Dict[str, Any]] = None,
+    cache_hit: bool = False
+) -> bool:
+    """保存API调用记录（放入写入队列，由后台任务批量写入数据库），返回是否成功入队"""
     # 如果有夺舍信息，添加到path中显示
     enhanced_path = path
     if target_platform or target_model:
@@ -1548,14 +1694,15 @@ async def save_api_record(
     if token_usage is None:
         token_usage = parse_token_usage(response_body)
     
-    api_record = APIRecord(
+    record = dict(
         method=method,
         path=enhanced_path,
-        headers=json.dumps(dict(headers)),
+        headers=fast_json.dumps(dict(headers)),
         body=body,
         response_status=response_status,
-        response_headers=json.dumps(dict(response_headers)),
+        response_headers=fast_json.dumps(dict(response_headers)),
         response_body=enhanced_response_body,
+        timestamp=datetime.utcnow(),
         duration_ms=duration_ms,
         target_platform=target_platform,
         target_model=target_model,
@@ -1568,48 +1715,51 @@ async def save_api_record(
         user_key_id=user_key_id,
         input_tokens=token_usage["input_tokens"],
         output_tokens=token_usage["output_tokens"],
-        total_tokens=token_usage["total_tokens"]
+        total_tokens=token_usage["total_tokens"],
+        cached_tokens=token_usage.get("cached_tokens", 0),
+        cache_hit=cache_hit,
+        capture_info=fast_json.dumps(capture_info) if capture_info else None
     )
-    db.add(api_record)
-    db.commit()
-    db.refresh(api_record)
-    
-    # 如果有用户KEY，记录token使用量并更新KEY的统计
-    if user_key_id and target_model and response_status < 400:
-        print(f"🔑 [KEY统计] 开始记录KEY使用：KEY_ID={user_key_id}, 模型={target_model}, 状态={response_status}")
-        print(f"🔑 [KEY统计] Token信息：{token_usage}")
-        await save_key_usage_log(
-            db=db,
+    
+    # 如果有用户KEY，同时记录token使用量并更新KEY的统计（响应缓存命中默认不计入）
+    key_usage = None
+    if user_key_id and target_model and response_status < 400 and (not cache_hit or RESPONSE_CACHE_CHARGE_HITS):
+        trace("🔑 [KEY统计] 记录KEY使用：KEY_ID=%s, 模型=%s, Token信息：%s", user_key_id, target_model, token_usage)
+        key_usage = dict(
             user_key_id=user_key_id,
-            api_record_id=api_record.id,
             model_name=target_model,
-            platform_type=target_platform,
-            response_body=response_body,
-            token_usage=token_usage
+            platform_type=target_platform or "unknown",
+            input_tokens=token_usage.get("input_tokens", 0),
+            output_tokens=token_usage.get("output_tokens", 0),
+            total_tokens=token_usage.get("total_tokens", 0),
+            timestamp=record["timestamp"]
         )
-    else:
-        if not user_key_id:
-            print(f"🔑 [KEY统计] 跳过：无user_key_id")
-        elif not target_model:
-            print(f"🔑 [KEY统计] 跳过：无target_model")
-        elif response_status >= 400:
-            print(f"🔑 [KEY统计] 跳过：响应错误status={response_status}")
-    
-    # 发送实时更新到前端
+    
+    end_trace(status=response_status, target_platform=target_platform, target_model=target_model,
+              routing_scene=routing_scene, tokens=token_usage)
+    return await record_writer.submit(record, key_usage)
+
+async def broadcast_new_record(record: Dict[str, Any], record_id: int):
+    """记录写入数据库后发送实时更新到前端"""
+    token_usage = {
+        "input_tokens": record["input_tokens"],
+        "output_tokens": record["output_tokens"],
+        "total_tokens": record["total_tokens"]
+    }
     await manager.broadcast({
         "type": "new_record",
         "record": {
-            "id": api_record.id,
-            "method": method,
-            "path": enhanced_path,  # 使用增强后的路径，显示夺舍信息
-            "timestamp": api_record.timestamp.isoformat(),
-            "response_status": response_status,
-            "duration_ms": duration_ms,
+            "id": record_id,
+            "method": record["method"],
+            "path": record["path"],  # 使用增强后的路径，显示夺舍信息
+            "timestamp": record["timestamp"].isoformat(),
+            "response_status": record["response_status"],
+            "duration_ms": record["duration_ms"],
             "token_usage": token_usage if token_usage["total_tokens"] > 0 else None
         }
     })
-    
-    return api_record
+
+record_writer.on_written = broadcast_new_record
 
 
 def parse_token_usage(response_body: str) -> dict:
@@ -1618,7 +1768,7 @@ def parse_token_usage(response_body: str) -> dict:
         return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
     
     try:
-        response_data = json.loads(response_body)
+        response_data = fast_json.loads(response_body)
         
         # 支持不同格式的token统计
         if "usage" in response_data:
@@ -1627,20 +1777,24 @@ def parse_token_usage(response_body: str) -> dict:
             if "input_tokens" in usage and "output_tokens" in usage:
                 input_tokens = usage.get("input_tokens", 0)
                 output_tokens = usage.get("output_tokens", 0)
+                cached_tokens = usage.get("cache_read_input_tokens") or 0
             # OpenRouter/OpenAI格式
             elif "prompt_tokens" in usage and "completion_tokens" in usage:
                 input_tokens = usage.get("prompt_tokens", 0)
                 output_tokens = usage.get("completion_tokens", 0)
+                cached_tokens = cached_prompt_tokens(usage)
             else:
                 input_tokens = 0
                 output_tokens = 0
+                cached_tokens = 0
             
             total_tokens = usage.get("total_tokens", input_tokens + output_tokens)
             
             return {
                 "input_tokens": input_tokens,
                 "output_tokens": output_tokens,
-                "total_tokens": total_tokens
+                "total_tokens": total_tokens,
+                "cached_tokens": cached_tokens
             }
         
         # Ollama格式直接在根级别
@@ -1655,103 +1809,13 @@ def parse_token_usage(response_body: str) -> dict:
                 "total_tokens": total_tokens
             }
             
-    except json.JSONDecodeError:
+    except fast_json.JSONDecodeError:
         # 如果解析失败，尝试从流式响应中提取最后的usage信息
         pass
     
     return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
 
 
-async def save_key_usage_log(
-    db: Session,
-    user_key_id: int,
-    api_record_id: int,
-    model_name: str,
-    platform_type: str,
-    response_body: str,
-    token_usage: Optional[Dict[str, int]] = None
-):
-    """保存KEY使用记录并更新KEY统计"""
-    from database import UserKey, KeyUsageLog
-    from datetime import datetime
-    import json
-    
-    try:
-        # 优先使用传入的token_usage，如果没有则从响应体解析
-        if token_usage:
-            input_tokens = token_usage.get("input_tokens", 0)
-            output_tokens = token_usage.get("output_tokens", 0)
-            total_tokens = token_usage.get("total_tokens", 0)
-        else:
-            # 从响应体中提取token使用量
-            input_tokens = 0
-            output_tokens = 0
-            total_tokens = 0
-            
-            if response_body:
-                try:
-                    response_data = json.loads(response_body)
-                    
-                    # 支持不同格式的token统计
-                    if "usage" in response_data:
-                        usage = response_data["usage"]
-                        # Claude格式
-                        if "input_tokens" in usage and "output_tokens" in usage:
-                            input_tokens = usage.get("input_tokens", 0)
-                            output_tokens = usage.get("output_tokens", 0)
-                        # OpenRouter/OpenAI格式
-                        elif "prompt_tokens" in usage and "completion_tokens" in usage:
-                            input_tokens = usage.get("prompt_tokens", 0)
-                            output_tokens = usage.get("completion_tokens", 0)
-                        
-                        total_tokens = usage.get("total_tokens", input_tokens + output_tokens)
-                    
-                    # Ollama格式直接在根级别
-                    elif "prompt_eval_count" in response_data and "eval_count" in response_data:
-                        input_tokens = response_data.get("prompt_eval_count", 0)
-                        output_tokens = response_data.get("eval_count", 0)
-                        total_tokens = input_tokens + output_tokens
-                        
-                except json.JSONDecodeError:
-                    # 如果解析失败，尝试从流式响应中提取
-                    pass
-        
-        # 创建使用记录
-        usage_log = KeyUsageLog(
-            user_key_id=user_key_id,
-            api_record_id=api_record_id,
-            model_name=model_name,
-            platform_type=platform_type or "unknown",
-            input_tokens=input_tokens,
-            output_tokens=output_tokens,
-            total_tokens=total_tokens
-        )
-        
-        db.add(usage_log)
-        
-        # 更新KEY的使用统计
-        if total_tokens > 0:
-            user_key = db.query(UserKey).filter(UserKey.id == user_key_id).first()
-            if user_key:
-                old_used_tokens = user_key.used_tokens
-                user_key.used_tokens += total_tokens
-                user_key.updated_at = datetime.utcnow()
-                print(f"✅ [KEY统计] KEY ID {user_key_id} 更新：{old_used_tokens} → {user_key.used_tokens} (+{total_tokens})")
-            else:
-                print(f"❌ [KEY统计] 未找到KEY ID {user_key_id}")
-        else:
-            print(f"⚠️ [KEY统计] token数量为0，不更新KEY统计。input_tokens={input_tokens}, output_tokens={output_tokens}")
-        
-        print(f"📝 [KEY统计] 保存使用记录：KEY={user_key_id}, 模型={model_name}, tokens={total_tokens}")
-        db.commit()
-        
-    except Exception as e:
-        print(f"❌ [KEY统计] 保存KEY使用记录失败: {e}")
-        import traceback
-        traceback.print_exc()
-        db.rollback()
-
-
 async def validate_user_key(api_key: str, db: Session) -> Optional[int]:
     """验证用户KEY并检查限制，返回KEY ID，如果验证失败返回None"""
     from database import UserKey
@@ -1760,25 +1824,33 @@ async def validate_user_key(api_key: str, db: Session) -> Optional[int]:
     if not api_key or not api_key.startswith('lxs_'):
         return None
     
+    def check_key() -> Optional[int]:
+        try:
+            # 查找KEY
+            user_key = db.query(UserKey).filter(
+                UserKey.api_key == api_key,
+                UserKey.is_active == True
+            ).first()
+            
+            if not user_key:
+                return None
+            
+            # 检查是否过期
+            if user_key.expires_at and user_key.expires_at < datetime.utcnow():
+                return None
+            
+            # 检查token限制
+            if user_key.max_tokens > 0 and user_key.used_tokens >= user_key.max_tokens:
+                return None
+            
+            return user_key.id
+        finally:
+            # 结束读事务，把连接还给连接池：请求会话要到流式响应结束才关闭，
+            # 一直占用连接时，并发流超过连接池容量后新请求要等前面的流结束才能验证KEY
+            db.rollback()
+    
     try:
-        # 查找KEY
-        user_key = db.query(UserKey).filter(
-            UserKey.api_key == api_key,
-            UserKey.is_active == True
-        ).first()
-        
-        if not user_key:
-            return None
-        
-        # 检查是否过期
-        if user_key.expires_at and user_key.expires_at < datetime.utcnow():
-            return None
-        
-        # 检查token限制
-        if user_key.max_tokens > 0 and user_key.used_tokens >= user_key.max_tokens:
-            return None
-        
-        return user_key.id
+        return await run_db(check_key)
         
     except Exception as e:
         print(f"验证KEY失败: {e}")
@@ -1786,7 +1858,7 @@ async def validate_user_key(api_key: str, db: Session) -> Optional[int]:
 
 
 @app.get("/about")
-async def about_luoxiaoshan():
+def about_luoxiaoshan():
     """洛小山介绍页面 - 包含详细系统调试信息"""
     try:
         import psutil
@@ -2034,27 +2106,25 @@ async def proxy_request(request: Request, path: str, db: Session = Depends(get_d
     logger.info(f"🌐 [夺舍] 请求路径: /{path}")
     logger.info(f"📋 [夺舍] 请求头数量: {len(request.headers)}")
     
-    # 获取请求体信息（用于日志）
+    # 读取并解析请求体（只解析一次，后续处理共享解析结果）
     try:
-        body = await request.body()
-        body_str = body.decode('utf-8') if body else ""
-        body_size = len(body_str)
-        logger.info(f"📊 [夺舍] 请求体大小: {body_size} 字符")
+        parsed = await ParsedRequest.from_request(request)
+        logger.info(f"📊 [夺舍] 请求体大小: {parsed.size} 字节")
         
         # 如果是JSON请求，解析一些基本信息
-        if body_str and request.headers.get("content-type", "").startswith("application/json"):
-            try:
-                request_data = json.loads(body_str)
+        if parsed.raw and parsed.is_json:
+            request_data = parsed.data
+            if request_data is not None:
                 if "model" in request_data:
                     logger.info(f"🤖 [夺舍] 请求模型: {request_data.get('model')}")
                 if "messages" in request_data:
                     logger.info(f"💬 [夺舍] 消息数量: {len(request_data.get('messages', []))}")
                 if "stream" in request_data:
                     logger.info(f"🌊 [夺舍] 流式响应: {'是' if request_data.get('stream') else '否'}")
-            except:
+            else:
                 logger.info("📄 [夺舍] 请求体: JSON格式但解析失败")
-    except:
-        body_str = ""
+    except Exception:
+        parsed = ParsedRequest()
         logger.info("📄 [夺舍] 无法读取请求体")
     
     # 显示当前工作模式
@@ -2067,15 +2137,8 @@ async def proxy_request(request: Request, path: str, db: Session = Depends(get_d
     # KEY验证逻辑 - 只对多平台模式下的全局直连和小模型路由进行KEY验证
     user_key_id = None
     if use_multi_platform and current_mode in ["global_direct", "smart_routing"]:
-        # 从Authorization头或api-key头中获取KEY
-        auth_header = request.headers.get("authorization", "")
-        api_key_header = request.headers.get("api-key", "")
-        
-        api_key = ""
-        if auth_header.startswith("Bearer "):
-            api_key = auth_header[7:]  # 移除 "Bearer " 前缀
-        elif api_key_header:
-            api_key = api_key_header
+        # 从Authorization头或api-key头中获取KEY（已在解析请求时提取）
+        api_key = parsed.api_key
         
         if api_key:
             logger.info(f"🔑 [夺舍] 检测到用户KEY: {api_key[:8]}****")
@@ -2106,205 +2169,206 @@ async def proxy_request(request: Request, path: str, db: Session = Depends(get_d
     # 选择处理模式
     if use_multi_platform:
         logger.info("🎯 [夺舍] 选择处理方式: 多平台智能转发")
-        return await handle_multi_platform_request(request, path, db, start_time, body_str, user_key_id)
+        return await handle_multi_platform_request(request, path, db, start_time, parsed, user_key_id)
     else:
         logger.info("🎯 [夺舍] 选择处理方式: 原始代理转发")
-        return await handle_original_proxy_request(request, path, db, start_time, body_str)
+        return await handle_original_proxy_request(request, path, db, start_time, parsed)
 
-async def handle_multi_platform_request(request: Request, path: str, db: Session, start_time: float, body_str: str = "", user_key_id: Optional[int] = None):
+async def handle_multi_platform_request(request: Request, path: str, db: Session, start_time: float, parsed: ParsedRequest, user_key_id: Optional[int] = None):
     """处理多平台转发请求"""
+    start_trace(user_key_id, mode="multi_platform", method=request.method, path=f"/{path}")
     try:
         logger.info("🚀 [夺舍] 开始多平台智能转发处理...")
         
         # 解析请求数据（假设是Claude API格式）
-        if body_str and request.method == "POST":
-            try:
-                request_data = json.loads(body_str)
+        if parsed.raw and request.method == "POST":
+            # 请求体已在上层解析，这里直接复用
+            request_data = parsed.data
+            if request_data is None:
+                return JSONResponse(
+                    status_code=400,
+                    content={"error": "Invalid JSON in request body"}
+                )
+            
+            messages = parsed.messages
+            model = parsed.model
+            stream = parsed.stream
+            
+            # 显示简化的消息内容（用于调试）
+            if messages:
+                last_msg = messages[-1] if messages else {}
+                content_preview = str(last_msg.get('content', ''))[:100] + "..." if len(str(last_msg.get('content', ''))) > 100 else str(last_msg.get('content', ''))
+                logger.info(f"💭 [夺舍] 最后消息预览: {content_preview}")
+            
+            logger.info("🔄 [夺舍] 开始多平台智能路由处理...")
+            
+            # 使用多平台服务处理请求
+            # 每个请求独立的执行上下文，保存路由结果和HOOK处理数据
+            ctx = RequestContext(user_key_id=user_key_id)
+            
+            if stream:
+                # 流式响应
+                sse_capture = CaptureBuffer(separator="\n")  # 收集原始SSE数据（按捕获模式限制内存）
                 
-                messages = request_data.get("messages", [])
-                model = request_data.get("model", "")
-                stream = request_data.get("stream", False)
+                async def generate_response():
+                    try:
+                        async for chunk in multi_platform_service.handle_request(
+                            messages=messages,
+                            model=model,
+                            stream=stream,
+                            db=db,
+                            original_request=request_data,
+                            ctx=ctx,
+                            **parsed.extra_params()
+                        ):
+                            # chunk已经是编码好的SSE事件（错误信息为字符串），直接输出
+                            if isinstance(chunk, str):
+                                chunk = chunk.encode("utf-8")
+                            if chunk.strip():  # 只有非空内容才输出
+                                # 收集原始SSE数据用于数据库记录
+                                sse_capture.append(chunk.strip())
+                                yield chunk
+                    finally:
+                        # 流式响应结束后保存记录
+                        if sse_capture.chunks:
+                            try:
+                                # 将所有SSE chunks合并为完整的SSE格式数据
+                                sse_data = sse_capture.getvalue()
+                                capture_info = dict(ctx.capture_info)
+                                capture_info["response_body"] = sse_capture.info()
+                                sse_capture.close()
+                                
+                                # 获取路由信息
+                                routing_result = ctx.routing_result
+                                target_platform = None
+                                target_model = None
+                                platform_info = None
+                                routing_mode = ctx.routing_mode
+                                
+                                if routing_result and routing_result.success:
+                                    target_platform = routing_result.platform_type.value
+                                    target_model = routing_result.model_id
+                                    platform_info = multi_platform_service.get_platform_info(routing_result.platform_type)
+                                
+                                # 确定路由标识符
+                                mode_emoji = "🔄"  # 默认多平台转发
+                                if routing_mode == "global_direct":
+                                    mode_emoji = "🔄"  # 多平台转发
+                                elif routing_mode == "smart_routing":
+                                    mode_emoji = "🆎"  # 小模型分发
+                                
+                                end_time = time.time()
+                                duration_ms = int((end_time - start_time) * 1000)
+                                
+                                # 获取token使用量
+                                token_usage = ctx.get_token_usage()
+                                
+                                await save_api_record(
+                                    method=request.method,
+                                    path=f"/{path}",
+                                    headers=dict(request.headers),
+                                    body=parsed.text,
+                                    response_status=200,
+                                    response_headers={"Content-Type": "text/event-stream"},
+                                    response_body=sse_data,
+                                    duration_ms=duration_ms,
+                                    target_platform=target_platform,
+                                    target_model=target_model,
+                                    routing_info=f"{mode_emoji} 流式响应",
+                                    platform_base_url=platform_info.get("base_url") if platform_info else None,
+                                    processed_prompt=ctx.processed_prompt,
+                                    processed_headers=ctx.processed_headers,
+                                    model_raw_headers=ctx.model_raw_headers,
+                                    model_raw_response=ctx.model_raw_response,
+                                    routing_scene=routing_result.scene_name if routing_result and hasattr(routing_result, 'scene_name') else None,
+                                    user_key_id=user_key_id,
+                                    token_usage=token_usage,
+                                    capture_info=capture_info
+                                )
+                                
+                                logger.info(f"✅ [夺舍] 流式响应记录已保存，平台: {target_platform}, 模型: {target_model}, SSE数据长度: {capture_info['response_body']['total_bytes']} 字节")
+                            except Exception as e:
+                                logger.error(f"❌ [夺舍] 保存流式响应记录失败: {e}")
+                        else:
+                            logger.warning(f"⚠️ [夺舍] 流式响应完成但没有收集到SSE数据")
                 
-                # 显示简化的消息内容（用于调试）
-                if messages:
-                    last_msg = messages[-1] if messages else {}
-                    content_preview = str(last_msg.get('content', ''))[:100] + "..." if len(str(last_msg.get('content', ''))) > 100 else str(last_msg.get('content', ''))
-                    logger.info(f"💭 [夺舍] 最后消息预览: {content_preview}")
+                headers = {
+                    "Content-Type": "text/event-stream",
+                    "Cache-Control": "no-cache",
+                    "Connection": "keep-alive"
+                }
                 
-                logger.info("🔄 [夺舍] 开始多平台智能路由处理...")
+                return StreamingResponse(generate_response(), headers=headers)
+            else:
+                # 非流式响应
+                response_text = ""
+                async for chunk in multi_platform_service.handle_request(
+                    messages=messages,
+                    model=model,
+                    stream=stream,
+                    db=db,
+                    original_request=request_data,
+                    ctx=ctx,
+                    **parsed.extra_params()
+                ):
+                    response_text = chunk
+                    break
                 
-                # 使用多平台服务处理请求
-                if stream:
-                    # 流式响应
-                    streaming_converter = None  # 保存StreamingConverter实例的引用
-                    sse_chunks = []  # 收集原始SSE数据
-                    
-                    async def generate_response():
-                        nonlocal streaming_converter, sse_chunks
-                        try:
-                            async for chunk in multi_platform_service.handle_request(
-                                messages=messages,
-                                model=model,
-                                stream=stream,
-                                db=db,
-                                original_request=request_data,
-                                **{k: v for k, v in request_data.items() if k not in ["messages", "model", "stream"]}
-                            ):
-                                # 获取streaming_converter的引用（第一次调用时）
-                                if streaming_converter is None and hasattr(multi_platform_service, 'streaming_converter'):
-                                    streaming_converter = multi_platform_service.streaming_converter
-                                
-                                # chunk已经是完整的SSE格式，直接输出
-                                if chunk.strip():  # 只有非空内容才输出
-                                    # 收集原始SSE数据用于数据库记录
-                                    sse_chunks.append(chunk.strip())
-                                    yield chunk
-                        finally:
-                            # 流式响应结束后保存记录
-                            if sse_chunks:
-                                try:
-                                    # 将所有SSE chunks合并为完整的SSE格式数据
-                                    sse_data = "\n".join(sse_chunks)
-                                    
-                                    # 获取路由信息
-                                    routing_result = getattr(multi_platform_service, 'last_routing_result', None)
-                                    target_platform = None
-                                    target_model = None
-                                    platform_info = None
-                                    routing_mode = multi_platform_service.get_current_routing_mode()
-                                    
-                                    if routing_result and routing_result.success:
-                                        target_platform = routing_result.platform_type.value
-                                        target_model = routing_result.model_id
-                                        platform_info = multi_platform_service.get_platform_info(routing_result.platform_type)
-                                    
-                                    # 确定路由标识符
-                                    mode_emoji = "🔄"  # 默认多平台转发
-                                    if routing_mode == "global_direct":
-                                        mode_emoji = "🔄"  # 多平台转发
-                                    elif routing_mode == "smart_routing":
-                                        mode_emoji = "🆎"  # 小模型分发
-                                    
-                                    end_time = time.time()
-                                    duration_ms = int((end_time - start_time) * 1000)
-                                    
-                                    # 获取token使用量
-                                    token_usage = multi_platform_service.get_token_usage()
-                                    
-                                    await save_api_record(
-                                        method=request.method,
-                                        path=f"/{path}",
-                                        headers=dict(request.headers),
-                                        body=body_str,
-                                        response_status=200,
-                                        response_headers={"Content-Type": "text/event-stream"},
-                                        response_body=sse_data,
-                                        duration_ms=duration_ms,
-                                        db=db,
-                                        target_platform=target_platform,
-                                        target_model=target_model,
-                                        routing_info=f"{mode_emoji} 流式响应",
-                                        platform_base_url=platform_info.get("base_url") if platform_info else None,
-                                        processed_prompt=getattr(multi_platform_service, 'processed_prompt', None),
-                                        processed_headers=getattr(multi_platform_service, 'processed_headers', None),
-                                        model_raw_headers=getattr(multi_platform_service, 'model_raw_headers', None),
-                                        model_raw_response=getattr(multi_platform_service, 'model_raw_response', None),
-                                        routing_scene=routing_result.scene_name if routing_result and hasattr(routing_result, 'scene_name') else None,
-                                        user_key_id=user_key_id,
-                                        token_usage=token_usage
-                                    )
-                                    
-                                    # 从SSE数据中提取实际内容长度用于日志
-                                    content_length = 0
-                                    if streaming_converter and hasattr(streaming_converter, 'current_content'):
-                                        content_length = len(streaming_converter.current_content)
-                                    
-                                    logger.info(f"✅ [夺舍] 流式响应记录已保存，平台: {target_platform}, 模型: {target_model}, SSE数据长度: {len(sse_data)} 字符")
-                                except Exception as e:
-                                    logger.error(f"❌ [夺舍] 保存流式响应记录失败: {e}")
-                            else:
-                                logger.warning(f"⚠️ [夺舍] 流式响应完成但没有收集到SSE数据")
-                    
-                    headers = {
-                        "Content-Type": "text/event-stream",
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive"
-                    }
-                    
-                    return StreamingResponse(generate_response(), headers=headers)
-                else:
-                    # 非流式响应
-                    response_text = ""
-                    async for chunk in multi_platform_service.handle_request(
-                        messages=messages,
-                        model=model,
-                        stream=stream,
-                        db=db,
-                        original_request=request_data,
-                        **{k: v for k, v in request_data.items() if k not in ["messages", "model", "stream"]}
-                    ):
-                        response_text = chunk
-                        break
-                    
-                    # 保存记录
-                    end_time = time.time()
-                    duration_ms = int((end_time - start_time) * 1000)
-                    
-                    # 获取路由信息
-                    routing_result = getattr(multi_platform_service, 'last_routing_result', None)
-                    target_platform = None
-                    target_model = None
-                    platform_info = None
-                    routing_mode = multi_platform_service.get_current_routing_mode()
-                    
-                    if routing_result and routing_result.success:
-                        target_platform = routing_result.platform_type.value
-                        target_model = routing_result.model_id
-                        platform_info = multi_platform_service.get_platform_info(routing_result.platform_type)
-                    
-                    # 确定路由标识符
-                    mode_emoji = "🔄"  # 默认多平台转发
-                    if routing_mode == "global_direct":
-                        mode_emoji = "🔄"  # 多平台转发
-                    elif routing_mode == "smart_routing":
-                        mode_emoji = "🆎"  # 小模型分发
-                    
-                    # 获取token使用量
-                    token_usage = multi_platform_service.get_token_usage()
-                    
-                    await save_api_record(
-                        method=request.method,
-                        path=f"/{path}",
-                        headers=dict(request.headers),
-                        body=body_str,
-                        response_status=200,
-                        response_headers={"Content-Type": "application/json"},
-                        response_body=response_text,
-                        duration_ms=duration_ms,
-                        db=db,
-                        target_platform=target_platform,
-                        target_model=target_model,
-                        routing_info=f"{mode_emoji} 非流式响应",
-                        platform_base_url=platform_info.get("base_url") if platform_info else None,
-                        processed_prompt=getattr(multi_platform_service, 'processed_prompt', None),
-                        processed_headers=getattr(multi_platform_service, 'processed_headers', None),
-                        model_raw_headers=getattr(multi_platform_service, 'model_raw_headers', None),
-                        model_raw_response=getattr(multi_platform_service, 'model_raw_response', None),
-                        routing_scene=routing_result.scene_name if routing_result and hasattr(routing_result, 'scene_name') else None,
-                        user_key_id=user_key_id,
-                        token_usage=token_usage
-                    )
-                    
-                    return Response(
-                        content=response_text,
-                        media_type="application/json"
-                    )
-                    
-            except json.JSONDecodeError:
-                return JSONResponse(
-                    status_code=400,
-                    content={"error": "Invalid JSON in request body"}
+                # 保存记录
+                end_time = time.time()
+                duration_ms = int((end_time - start_time) * 1000)
+                
+                # 获取路由信息
+                routing_result = ctx.routing_result
+                target_platform = None
+                target_model = None
+                platform_info = None
+                routing_mode = ctx.routing_mode
+                
+                if routing_result and routing_result.success:
+                    target_platform = routing_result.platform_type.value
+                    target_model = routing_result.model_id
+                    platform_info = multi_platform_service.get_platform_info(routing_result.platform_type)
+                
+                # 确定路由标识符
+                mode_emoji = "🔄"  # 默认多平台转发
+                if routing_mode == "global_direct":
+                    mode_emoji = "🔄"  # 多平台转发
+                elif routing_mode == "smart_routing":
+                    mode_emoji = "🆎"  # 小模型分发
+                
+                # 获取token使用量
+                token_usage = ctx.get_token_usage()
+                
+                await save_api_record(
+                    method=request.method,
+                    path=f"/{path}",
+                    headers=dict(request.headers),
+                    body=parsed.text,
+                    response_status=200,
+                    response_headers={"Content-Type": "application/json"},
+                    response_body=response_text,
+                    duration_ms=duration_ms,
+                    target_platform=target_platform,
+                    target_model=target_model,
+                    routing_info=f"{mode_emoji} 非流式响应" + (" 💾 缓存命中" if ctx.cache_hit else ""),
+                    platform_base_url=platform_info.get("base_url") if platform_info else None,
+                    processed_prompt=ctx.processed_prompt,
+                    processed_headers=ctx.processed_headers,
+                    model_raw_headers=ctx.model_raw_headers,
+                    model_raw_response=ctx.model_raw_response,
+                    routing_scene=routing_result.scene_name if routing_result and hasattr(routing_result, 'scene_name') else None,
+                    user_key_id=user_key_id,
+                    token_usage=token_usage,
+                    capture_info=ctx.capture_info or None,
+                    cache_hit=ctx.cache_hit
+                )
+                
+                return Response(
+                    content=response_text,
+                    media_type="application/json"
                 )
+                
         else:
             return JSONResponse(
                 status_code=400,
@@ -2319,12 +2383,11 @@ async def handle_multi_platform_request(request: Request, path: str, db: Session
             method=request.method,
             path=f"/{path}",
             headers=dict(request.headers),
-            body=body_str if 'body_str' in locals() else "",
+            body=parsed.text,
             response_status=500,
             response_headers={},
             response_body=f"Multi-platform error: {str(e)}",
             duration_ms=duration_ms,
-            db=db,
             routing_info="❌ 多平台转发失败",
             user_key_id=user_key_id if 'user_key_id' in locals() else None
         )
@@ -2334,7 +2397,99 @@ async def handle_multi_platform_request(request: Request, path: str, db: Session
             content={"error": f"多平台转发失败: {str(e)}"}
         )
 
-async def handle_original_proxy_request(request: Request, path: str, db: Session, start_time: float, body_str: str = ""):
+# Claude Code 转发使用的共享长连接客户端（由lifespan创建和关闭）
+upstream_http_client: Optional[httpx.AsyncClient] = None
+
+# 首个数据块中出现这些关键词时切换到下一个服务器
+UPSTREAM_ERROR_KEYWORDS = [
+    "unauthorized", "authentication", "permission", "access denied",
+    "quota", "limit", "exceeded", "insufficient", "balance",
+    "api key", "invalid key", "expired", "blocked"
+]
+
+# 转发响应时需要移除的响应头（响应体已由httpx解压并以分块方式重新发送）
+RELAY_RESPONSE_HEADERS_TO_REMOVE = ['connection', 'transfer-encoding', 'content-length', 'content-encoding']
+
+def get_upstream_http_client() -> httpx.AsyncClient:
+    """获取Claude Code转发使用的共享客户端"""
+    global upstream_http_client
+    if upstream_http_client is None or upstream_http_client.is_closed:
+        upstream_http_client = httpx.AsyncClient(verify=True)
+    return upstream_http_client
+
+async def open_upstream_stream(method: str, url: str, headers: Dict[str, str], body: bytes, params, timeout: float) -> httpx.Response:
+    """发送请求并以流式方式返回响应（只读取响应头）"""
+    client = get_upstream_http_client()
+    upstream_request = client.build_request(
+        method=method,
+        url=url,
+        headers=headers,
+        content=body,
+        params=params,
+        timeout=timeout
+    )
+    return await client.send(upstream_request, stream=True, follow_redirects=True)
+
+async def read_first_chunk(response: httpx.Response):
+    """读取响应的第一个数据块，返回 (首个数据块, 剩余数据迭代器)"""
+    byte_iter = response.aiter_bytes()
+    try:
+        first_chunk = await byte_iter.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    return first_chunk, byte_iter
+
+def check_upstream_fallback(status_code: int, first_chunk: bytes):
+    """根据状态码和首个数据块判断是否需要切换服务器，返回 (是否切换, 原因)"""
+    if status_code != 200:
+        return True, f"HTTP错误码: {status_code}"
+    
+    first_chunk_lower = first_chunk.decode("utf-8", errors="ignore").lower()
+    for keyword in UPSTREAM_ERROR_KEYWORDS:
+        if keyword in first_chunk_lower:
+            return True, f"响应包含错误关键词: {keyword}"
+    
+    return False, ""
+
+def relay_upstream_response(response: httpx.Response, first_chunk: bytes, byte_iter, record_kwargs: Dict[str, Any], start_time: float) -> StreamingResponse:
+    """将上游响应边读边转发给客户端，同时保留一份副本，流结束后保存记录"""
+    
+    async def relay():
+        captured = CaptureBuffer()
+        try:
+            if first_chunk:
+                captured.append(first_chunk)
+                yield first_chunk
+            if byte_iter is not None:
+                async for chunk in byte_iter:
+                    captured.append(chunk)
+                    yield chunk
+        finally:
+            await response.aclose()
+            duration_ms = int((time.time() - start_time) * 1000)
+            response_body = captured.getvalue()
+            capture_info = captured.info()
+            captured.close()
+            logger.info(f"📤 [夺舍] 转发结束，响应大小: {capture_info['total_bytes']} 字节, 耗时: {duration_ms}ms")
+            try:
+                await save_api_record(
+                    response_status=response.status_code,
+                    response_headers=dict(response.headers),
+                    response_body=response_body,
+                    duration_ms=duration_ms,
+                    capture_info={"response_body": capture_info},
+                    **record_kwargs
+                )
+            except Exception as e:
+                logger.error(f"❌ [夺舍] 保存转发记录失败: {e}")
+    
+    response_headers = {
+        k: v for k, v in response.headers.items()
+        if k.lower() not in RELAY_RESPONSE_HEADERS_TO_REMOVE
+    }
+    return StreamingResponse(relay(), status_code=response.status_code, headers=response_headers)
+
+async def handle_original_proxy_request(request: Request, path: str, db: Session, start_time: float, parsed: ParsedRequest):
     """处理原有的代理请求逻辑 - 支持多服务器轮询"""
     logger.info("🎯 [夺舍] 开始Claude Code多服务器代理转发处理...")
     
@@ -2345,15 +2500,8 @@ async def handle_original_proxy_request(request: Request, path: str, db: Session
         # Claude Code模式：使用多服务器配置，需要KEY验证
         logger.info("🔑 [夺舍] Claude Code模式开始KEY验证...")
         
-        # 从Authorization头或api-key头中获取KEY
-        auth_header = request.headers.get("authorization", "")
-        api_key_header = request.headers.get("api-key", "")
-        
-        api_key = ""
-        if auth_header.startswith("Bearer "):
-            api_key = auth_header[7:]  # 移除 "Bearer " 前缀
-        elif api_key_header:
-            api_key = api_key_header
+        # 从Authorization头或api-key头中获取KEY（已在解析请求时提取）
+        api_key = parsed.api_key
         
         user_key_id = None
         if api_key:
@@ -2382,27 +2530,26 @@ async def handle_original_proxy_request(request: Request, path: str, db: Session
             }
             return JSONResponse(status_code=401, content=error_response)
         
-        return await handle_claude_code_multi_server_request(request, path, db, start_time, body_str, user_key_id)
+        return await handle_claude_code_multi_server_request(request, path, db, start_time, parsed, user_key_id)
     else:
         # 其他模式：使用原有的单服务器逻辑（兼容性）
-        return await handle_legacy_single_server_request(request, path, db, start_time, body_str)
+        return await handle_legacy_single_server_request(request, path, db, start_time, parsed)
 
-async def handle_claude_code_multi_server_request(request: Request, path: str, db: Session, start_time: float, body_str: str = "", user_key_id: Optional[int] = None):
+async def handle_claude_code_multi_server_request(request: Request, path: str, db: Session, start_time: float, parsed: ParsedRequest, user_key_id: Optional[int] = None):
     """处理Claude Code多服务器请求"""
     logger.info("🔄 [夺舍] Claude Code多服务器模式")
+    start_trace(user_key_id, mode="claude_code", method=request.method, path=f"/{path}")
     
     if user_key_id:
         logger.info(f"🔑 [夺舍] 使用用户KEY ID: {user_key_id}")
     
-    # 获取所有启用的服务器，按优先级排序
-    servers = db.query(ClaudeCodeServer).filter(
-        ClaudeCodeServer.enabled == True
-    ).order_by(ClaudeCodeServer.priority, ClaudeCodeServer.id).all()
+    # 获取所有启用的服务器，按优先级排序（短时间缓存，不必每次查询数据库）
+    servers = await server_health.get_servers()
     
     if not servers:
         logger.warning("⚠️ [夺舍] 没有可用的Claude Code服务器配置")
         # 回退到原有配置
-        return await handle_legacy_single_server_request(request, path, db, start_time, body_str)
+        return await handle_legacy_single_server_request(request, path, db, start_time, parsed)
     
     logger.info(f"📋 [夺舍] 找到 {len(servers)} 个可用服务器")
     
@@ -2425,14 +2572,21 @@ async def handle_claude_code_multi_server_request(request: Request, path: str, d
     headers.pop('api-key', None)  # 移除用户的api-key头
     logger.info("🔑 [夺舍] 已移除用户认证头，将使用服务器配置的API Key")
     
-    body = body_str.encode('utf-8') if body_str else b""
+    body = parsed.raw  # 原始请求体直接透传
     
-    # 逐个尝试服务器
+    # 逐个尝试服务器，已熔断的服务器直接跳过
     for i, server in enumerate(servers):
         server_name = server.name
         target_url = f"{server.url.rstrip('/')}{remaining_path}"
         timeout = server.timeout
         
+        breaker = server_health.get_breaker(server)
+        if not breaker.allow_request():
+            logger.warning(f"⏭️ [夺舍] 服务器 {server_name} 已熔断，跳过")
+            continue
+        # 后面没有可用服务器时，本次就是最后一次尝试
+        has_next = any(server_health.get_breaker(s).is_available() for s in servers[i + 1:])
+        
         logger.info(f"🎯 [夺舍] 尝试服务器 {i+1}/{len(servers)}: {server_name}")
         logger.info(f"📡 [夺舍] 目标URL: {target_url}")
         logger.info(f"⏱️ [夺舍] 超时设置: {timeout}秒")
@@ -2446,96 +2600,85 @@ async def handle_claude_code_multi_server_request(request: Request, path: str, d
         else:
             logger.warning(f"⚠️ [夺舍] 服务器 {server_name} 未配置API Key")
         
+        attempt_start = time.time()
+        response = None
+        outcome_recorded = False
         try:
-            # 发送请求到当前服务器
-            async with httpx.AsyncClient(timeout=timeout, verify=True) as client:
-                response = await client.request(
-                    method=request.method,
-                    url=target_url,
-                    headers=request_headers,
-                    content=body,
-                    params=request.query_params,
-                    follow_redirects=True
-                )
-            
-            # 检查响应状态
-            response_text = response.text
+            # 发送请求到当前服务器（流式读取，不等待完整响应）
+            response = await open_upstream_stream(
+                method=request.method,
+                url=target_url,
+                headers=request_headers,
+                body=body,
+                params=request.query_params,
+                timeout=timeout
+            )
             logger.info(f"📊 [夺舍] 服务器响应: {response.status_code}")
             
-            # 判断是否需要切换到下一个服务器
-            should_fallback = False
-            fallback_reason = ""
-            
+            # 根据状态码和首个数据块判断是否需要切换到下一个服务器
             if response.status_code != 200:
-                should_fallback = True
-                fallback_reason = f"HTTP错误码: {response.status_code}"
+                first_chunk = await response.aread()
+                byte_iter = None
+                await response.aclose()
             else:
-                # 检查响应内容中的错误关键词
-                error_keywords = [
-                    "unauthorized", "authentication", "permission", "access denied",
-                    "quota", "limit", "exceeded", "insufficient", "balance",
-                    "api key", "invalid key", "expired", "blocked"
-                ]
-                
-                response_lower = response_text.lower()
-                for keyword in error_keywords:
-                    if keyword in response_lower:
-                        should_fallback = True
-                        fallback_reason = f"响应包含错误关键词: {keyword}"
-                        break
+                first_chunk, byte_iter = await read_first_chunk(response)
+            
+            should_fallback, fallback_reason = check_upstream_fallback(response.status_code, first_chunk)
+            trace("📊 [Trace] 服务器响应", server=server_name, status=response.status_code,
+                  fallback=should_fallback, reason=fallback_reason, elapsed_ms=int((time.time() - attempt_start) * 1000))
             
-            if should_fallback and i < len(servers) - 1:
+            # 更新熔断器：连接失败、5xx、认证/限流错误和错误关键词计为失败
+            if response.status_code >= 500 or response.status_code in BREAKER_FAILURE_STATUS or (should_fallback and response.status_code == 200):
+                breaker.record_failure(fallback_reason)
+            else:
+                breaker.record_success((time.time() - attempt_start) * 1000)
+            outcome_recorded = True
+            
+            if should_fallback and has_next:
                 # 还有其他服务器可以尝试
+                await response.aclose()
                 logger.warning(f"⚠️ [夺舍] 服务器 {server_name} 失败: {fallback_reason}")
                 logger.info(f"🔄 [夺舍] 切换到下一个服务器...")
                 continue
             
-            # 记录成功或最后一次尝试的结果
-            end_time = time.time()
-            duration_ms = int((end_time - start_time) * 1000)
-            
             if should_fallback:
                 logger.error(f"❌ [夺舍] 所有服务器都失败了，最后尝试: {server_name}")
                 logger.error(f"❌ [夺舍] 最终错误: {fallback_reason}")
                 routing_info = f"❌ 多服务器失败 ({len(servers)}个)"
             else:
-                logger.info(f"✅ [夺舍] 转发成功! 服务器: {server_name}, 状态码: {response.status_code}, 耗时: {duration_ms}ms")
-                logger.info(f"📤 [夺舍] 响应大小: {len(response_text)} 字符")
+                logger.info(f"✅ [夺舍] 开始转发! 服务器: {server_name}, 状态码: {response.status_code}, 首包耗时: {int((time.time() - start_time) * 1000)}ms")
                 routing_info = f"❇️ Claude Code ({server_name})"
             
-            # 保存记录
-            await save_api_record(
-                method=request.method,
-                path=f"/{path}",
-                headers=headers,
-                body=body_str,
-                response_status=response.status_code,
-                response_headers=dict(response.headers),
-                response_body=response_text,
-                duration_ms=duration_ms,
-                db=db,
-                target_platform="Claude Code",
-                target_model=server_name,
-                routing_info=routing_info,
-                platform_base_url=server.url,
-                user_key_id=user_key_id
-            )
-            
-            # 返回响应
-            response_headers = dict(response.headers)
-            response_headers_to_remove = ['connection', 'transfer-encoding']
-            response_headers = {k: v for k, v in response_headers.items() if k.lower() not in response_headers_to_remove}
-            
             logger.info("🎯 [夺舍] ============ Claude Code多服务器夺舍完成 ============")
             
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=response_headers
+            # 边转发边记录，流结束后保存记录
+            return relay_upstream_response(
+                response=response,
+                first_chunk=first_chunk,
+                byte_iter=byte_iter,
+                record_kwargs=dict(
+                    method=request.method,
+                    path=f"/{path}",
+                    headers=headers,
+                    body=parsed.text,
+                    target_platform="Claude Code",
+                    target_model=server_name,
+                    routing_info=routing_info,
+                    platform_base_url=server.url,
+                    user_key_id=user_key_id
+                ),
+                start_time=start_time
             )
             
         except Exception as e:
-            if i < len(servers) - 1:
+            if not outcome_recorded:
+                breaker.record_failure(str(e) or type(e).__name__)
+                outcome_recorded = True
+            if response is not None:
+                # 读取首个数据块失败时归还连接
+                await response.aclose()
+            trace("❌ [Trace] 服务器连接失败", server=server_name, error=str(e) or type(e).__name__)
+            if has_next:
                 # 还有其他服务器可以尝试
                 logger.warning(f"⚠️ [夺舍] 服务器 {server_name} 连接失败: {str(e)}")
                 logger.info(f"🔄 [夺舍] 切换到下一个服务器...")
@@ -2552,12 +2695,11 @@ async def handle_claude_code_multi_server_request(request: Request, path: str, d
                     method=request.method,
                     path=f"/{path}",
                     headers=headers,
-                    body=body_str,
+                    body=parsed.text,
                     response_status=500,
                     response_headers={},
                     response_body=f"所有Claude Code服务器都失败: {str(e)}",
                     duration_ms=duration_ms,
-                    db=db,
                     routing_info=f"❌ 多服务器全部失败 ({len(servers)}个)",
                     user_key_id=user_key_id
                 )
@@ -2568,8 +2710,34 @@ async def handle_claude_code_multi_server_request(request: Request, path: str, d
                     status_code=500,
                     content={"error": f"所有Claude Code服务器都无法访问: {str(e)}"}
                 )
+        finally:
+            if not outcome_recorded:
+                # 客户端断开或任务取消（CancelledError 不是 Exception）时没有记录结果，释放半开状态的试探名额
+                breaker.release_trial("请求在收到响应前被取消")
+                if response is not None:
+                    await response.aclose()
+    
+    # 所有服务器都处于熔断状态
+    logger.error(f"❌ [夺舍] 所有Claude Code服务器都已熔断 ({len(servers)}个)")
+    duration_ms = int((time.time() - start_time) * 1000)
+    await save_api_record(
+        method=request.method,
+        path=f"/{path}",
+        headers=headers,
+        body=parsed.text,
+        response_status=503,
+        response_headers={},
+        response_body="所有Claude Code服务器都已熔断",
+        duration_ms=duration_ms,
+        routing_info=f"❌ 多服务器全部熔断 ({len(servers)}个)",
+        user_key_id=user_key_id
+    )
+    return JSONResponse(
+        status_code=503,
+        content={"error": "所有Claude Code服务器都已熔断，请稍后重试"}
+    )
 
-async def handle_legacy_single_server_request(request: Request, path: str, db: Session, start_time: float, body_str: str = ""):
+async def handle_legacy_single_server_request(request: Request, path: str, db: Session, start_time: float, parsed: ParsedRequest):
     """处理传统单服务器请求（兼容性）"""
     logger.info("🎯 [夺舍] 传统单服务器模式")
     
@@ -2594,59 +2762,44 @@ async def handle_legacy_single_server_request(request: Request, path: str, db: S
     # 移除host header，让httpx自动设置正确的目标host
     headers.pop('host', None)
     
-    # 请求体已在上层函数中获取
-    body = body_str.encode('utf-8') if body_str else b""
+    # 请求体已在上层函数中获取，原始字节直接透传
+    body = parsed.raw
     
     logger.info(f"🎯 [夺舍] 目标URL: {target_url}")
     logger.info(f"🔄 [夺舍] 转发模式: {'自定义映射' if path.startswith(local_path) else '完整路径映射'}")
     
     try:
-        # 发送请求到目标服务器
-        async with httpx.AsyncClient(timeout=30.0, verify=True) as client:
-            response = await client.request(
-                method=request.method,
-                url=target_url,
-                headers=headers,
-                content=body,
-                params=request.query_params,
-                follow_redirects=True
-            )
-            
-        end_time = time.time()
-        duration_ms = int((end_time - start_time) * 1000)
-        
-        # 记录转发成功信息
-        logger.info(f"✅ [夺舍] 转发成功! 状态码: {response.status_code}, 耗时: {duration_ms}ms")
-        logger.info(f"📤 [夺舍] 响应大小: {len(response.text)} 字符")
-        logger.info("🎯 [夺舍] ============ 夺舍过程完成 ============")
-        
-        # 始终保存记录
-        await save_api_record(
+        # 发送请求到目标服务器（流式读取，不等待完整响应）
+        response = await open_upstream_stream(
             method=request.method,
-            path=f"/{path}",
+            url=target_url,
             headers=headers,
-            body=body_str,
-            response_status=response.status_code,
-            response_headers=dict(response.headers),
-            response_body=response.text,
-            duration_ms=duration_ms,
-            db=db,
-            target_platform="DashScope",
-            target_model="claude-code-proxy",
-            routing_info="❇️ Claude Code (传统)",
-            platform_base_url="https://dashscope.aliyuncs.com"
+            body=body,
+            params=request.query_params,
+            timeout=30.0
         )
+        first_chunk, byte_iter = await read_first_chunk(response)
         
-        # 返回响应，只移除真正会导致冲突的响应头
-        response_headers = dict(response.headers)
-        # 只移除可能导致FastAPI冲突的hop-by-hop响应头
-        response_headers_to_remove = ['connection', 'transfer-encoding']
-        response_headers = {k: v for k, v in response_headers.items() if k.lower() not in response_headers_to_remove}
+        # 记录转发开始信息
+        logger.info(f"✅ [夺舍] 开始转发! 状态码: {response.status_code}, 首包耗时: {int((time.time() - start_time) * 1000)}ms")
+        logger.info("🎯 [夺舍] ============ 夺舍过程完成 ============")
         
-        return Response(
-            content=response.content,
-            status_code=response.status_code,
-            headers=response_headers
+        # 边转发边记录，流结束后始终保存记录
+        return relay_upstream_response(
+            response=response,
+            first_chunk=first_chunk,
+            byte_iter=byte_iter,
+            record_kwargs=dict(
+                method=request.method,
+                path=f"/{path}",
+                headers=headers,
+                body=parsed.text,
+                target_platform="DashScope",
+                target_model="claude-code-proxy",
+                routing_info="❇️ Claude Code (传统)",
+                platform_base_url="https://dashscope.aliyuncs.com"
+            ),
+            start_time=start_time
         )
         
     except Exception as e:
@@ -2662,12 +2815,11 @@ async def handle_legacy_single_server_request(request: Request, path: str, db: S
             method=request.method,
             path=f"/{path}",
             headers=headers,
-            body=body_str,
+            body=parsed.text,
             response_status=500,
             response_headers={},
             response_body=f"Error: {str(e)}",
             duration_ms=duration_ms,
-            db=db,
             routing_info="❌ 传统代理模式失败"
         )
         
@@ -33,6 +33,18 @@ def migrate_database():
             fields_to_add.append('total_tokens INTEGER DEFAULT 0')
         if 'processed_headers' not in columns:
             fields_to_add.append('processed_headers TEXT')
+        if 'capture_info' not in columns:
+            fields_to_add.append('capture_info TEXT')
+        if 'cached_tokens' not in columns:
+            fields_to_add.append('cached_tokens INTEGER DEFAULT 0')
+        if 'cache_hit' not in columns:
+            fields_to_add.append('cache_hit BOOLEAN DEFAULT 0')
+        if 'blob_refs' not in columns:
+            fields_to_add.append('blob_refs TEXT')
+        if 'messages_hash' not in columns:
+            fields_to_add.append('messages_hash VARCHAR')
+        if 'body_delta' not in columns:
+            fields_to_add.append('body_delta TEXT')
         
         if not fields_to_add:
             print("✅ 数据库已经包含所有必要字段，无需迁移")
@@ -21,6 +21,8 @@ class APIHookMonitor {
         this.records = [];
         this.filteredRecords = []; // 筛选后的记录
         this.currentFilter = 'all'; // 当前筛选条件
+        this.nextCursor = null; // 服务端下一页记录的游标，为空表示没有更多记录
+        this.recordsPageSize = 100; // 每次从服务端获取的记录数
         this.globalViewStates = { // 全局视图状态
             body: 'formatted',
             response_body: 'table',
@@ -47,8 +49,8 @@ class APIHookMonitor {
         this.bindEvents();
         this.initializeResizer();
         this.connectWebSocket();
+        this.loadFilterFromCache(); // 加载缓存的筛选条件（在加载记录之前，筛选在服务端进行）
         this.loadInitialData();
-        this.loadFilterFromCache(); // 加载缓存的筛选条件
         this.loadGlobalViewStatesFromStorage(); // 加载全局视图状态缓存
     }
 
@@ -421,22 +423,53 @@ class APIHookMonitor {
 
     async loadInitialData() {
         try {
-            const [configResponse, recordsResponse] = await Promise.all([
+            const [configResponse, page] = await Promise.all([
                 fetch('/control/config'),
-                fetch('/_api/records')
+                this.fetchRecordsPage()
             ]);
             
             const config = await configResponse.json();
-            const records = await recordsResponse.json();
             
             this.updateConfigDisplay(config);
-            this.records = records;
+            this.records = page.records;
+            this.nextCursor = page.nextCursor;
             this.renderRecordsList();
         } catch (error) {
             console.error('加载初始数据失败:', error);
         }
     }
 
+    // 从服务端获取一页记录（按当前筛选条件），cursor 为空时获取最新的记录
+    async fetchRecordsPage(cursor = null) {
+        const params = new URLSearchParams({ limit: this.recordsPageSize });
+        if (this.currentFilter !== 'all') {
+            params.set('method', this.currentFilter);
+        }
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        const response = await fetch(`/_api/records?${params.toString()}`);
+        if (!response.ok) {
+            throw new Error(`获取记录失败: ${response.status}`);
+        }
+        return {
+            records: await response.json(),
+            nextCursor: response.headers.get('X-Next-Cursor')
+        };
+    }
+
+    // 按当前筛选条件重新加载记录
+    async reloadRecords() {
+        try {
+            const page = await this.fetchRecordsPage();
+            this.records = page.records;
+            this.nextCursor = page.nextCursor;
+        } catch (error) {
+            console.error('加载记录失败:', error);
+        }
+        this.renderRecordsList();
+    }
+
     // 配置管理
     showConfigModal() {
         this.loadConfig();
@@ -724,6 +757,8 @@ class APIHookMonitor {
                 return;
             }
             
+            this.smartRoutingClassifier = configData ? configData.local_classifier : null;
+            
             console.log('📋 [Frontend] 路由模型列表:', routingModels);
             
             if (routingModels.length > 0) {
@@ -1777,6 +1812,10 @@ class APIHookMonitor {
             const configData = {
                 model_priority_list: modelPriorityList
             };
+            // 保留通过API配置的对冲参数
+            if (this.globalDirectHedging) {
+                configData.hedging = this.globalDirectHedging;
+            }
             
             await fetch('/_api/routing', {
                 method: 'POST',
@@ -1823,6 +1862,8 @@ class APIHookMonitor {
                 console.log(`🎯 [Frontend] 从active_config加载全局直连配置，包含 ${modelPriorityList.length} 个模型`);
             }
             
+            this.globalDirectHedging = configData ? configData.hedging : null;
+            
             if (modelPriorityList.length > 0) {
                 
                 console.log(`🎯 [Frontend] 恢复优先级队列，包含 ${modelPriorityList.length} 个模型`);
@@ -2107,6 +2148,10 @@ class APIHookMonitor {
                 routing_models: routingModels,
                 scenes: scenes
             };
+            // 保留通过API配置的本地场景分类器参数
+            if (this.smartRoutingClassifier) {
+                configData.local_classifier = this.smartRoutingClassifier;
+            }
             
             await fetch('/_api/routing', {
                 method: 'POST',
@@ -3248,6 +3293,7 @@ class APIHookMonitor {
                 
                 if (response.ok) {
                     this.records = [];
+                    this.nextCursor = null;
                     this.filteredRecords = [];
                     this.selectedRecordId = null;
                     this.renderRecordsList();
@@ -3260,6 +3306,7 @@ class APIHookMonitor {
                 console.error('清空记录时出错:', error);
                 // 即使后端失败，也清空前端显示
                 this.records = [];
+                this.nextCursor = null;
                 this.filteredRecords = [];
                 this.selectedRecordId = null;
                 this.renderRecordsList();
@@ -3352,7 +3399,7 @@ class APIHookMonitor {
 
         // 更新懒加载状态
         this.lazyLoading.currentPage++;
-        this.lazyLoading.hasMore = endIndex < this.filteredRecords.length;
+        this.lazyLoading.hasMore = endIndex < this.filteredRecords.length || !!this.nextCursor;
         
         // 添加加载更多指示器
         this.updateLoadMoreIndicator();
@@ -3374,12 +3421,25 @@ class APIHookMonitor {
         this.lazyLoading.isLoading = true;
         this.updateLoadMoreIndicator();
 
-        // 使用 setTimeout 来避免阻塞 UI
-        setTimeout(() => {
-            this.renderRecordsList(false);
-            this.lazyLoading.isLoading = false;
-            this.updateLoadMoreIndicator();
-        }, 100);
+        // 已加载的记录都显示完后，从服务端获取下一页
+        const renderedCount = this.lazyLoading.currentPage * this.lazyLoading.pageSize;
+        const fetchNext = renderedCount >= this.filteredRecords.length && this.nextCursor
+            ? this.fetchRecordsPage(this.nextCursor).then(page => {
+                this.records.push(...page.records);
+                this.nextCursor = page.nextCursor;
+            })
+            : Promise.resolve();
+
+        fetchNext.catch(error => {
+            console.error('加载更多记录失败:', error);
+        }).finally(() => {
+            // 使用 setTimeout 来避免阻塞 UI
+            setTimeout(() => {
+                this.renderRecordsList(false);
+                this.lazyLoading.isLoading = false;
+                this.updateLoadMoreIndicator();
+            }, 100);
+        });
     }
 
     // 更新"加载更多"指示器
@@ -3564,6 +3624,12 @@ class APIHookMonitor {
                                 <span class="text-gray-500">总计</span>
                                 <span class="font-medium text-green-700">${record.token_usage.total_tokens.toLocaleString()}</span>
                             </div>
+                            ${record.token_usage.cached_tokens > 0 ? `
+                            <div>
+                                <span class="text-gray-500">缓存命中</span>
+                                <span class="font-medium text-green-700">${record.token_usage.cached_tokens.toLocaleString()}</span>
+                            </div>
+                            ` : ''}
                         </div>
                         ` : ''}
                     </div>
@@ -3670,6 +3736,7 @@ class APIHookMonitor {
                             <div class="flex items-center mb-1">
                                 <h3 class="text-sm font-medium text-gray-700">响应体</h3>
                                 <span class="ml-2 text-xs text-gray-500">(大模型API返回)</span>
+                                ${this.renderCaptureNotice(record.capture_info, 'model_raw_response')}
                             </div>
                             <div class="json-data-container" data-content-type="model_raw_response"></div>
                         </div>
@@ -3693,6 +3760,7 @@ class APIHookMonitor {
                         <div class="col-span-6">
                             <div class="flex items-center mb-1">
                                 <h3 class="text-sm font-medium text-gray-700">响应体</h3>
+                                ${this.renderCaptureNotice(record.capture_info, 'response_body')}
                             </div>
                             <div class="json-data-container" data-content-type="response_body"></div>
                         </div>
@@ -3712,6 +3780,20 @@ class APIHookMonitor {
         this.setJsonContent('response_body', record.response_body, '响应体内容');
     }
 
+    // 响应体被截断或未保存内容时显示捕获说明
+    renderCaptureNotice(captureInfo, field) {
+        const info = captureInfo && captureInfo[field];
+        if (!info || !info.truncated) return '';
+        let text;
+        if (info.mode === 'metadata') {
+            text = `仅记录元数据，未保存内容 (共 ${info.total_bytes} 字节, ${info.chunks} 块)`;
+        } else {
+            const [start, end] = info.omitted_range || [0, 0];
+            text = `已截断: 省略第 ${start} - ${end} 字节 (共 ${info.total_bytes} 字节)`;
+        }
+        return `<span class="ml-2 text-xs text-orange-600 bg-orange-50 px-1 py-0.5 rounded" title="捕获模式: ${this.escapeHtml(String(info.mode))}">✂️ ${this.escapeHtml(text)}</span>`;
+    }
+
     // 安全地设置JSON内容到指定容器，避免HTML注入
     setJsonContent(type, data, title) {
         const container = this.detailContent.querySelector(`[data-content-type="${type}"]`);
@@ -4608,11 +4690,11 @@ class APIHookMonitor {
         }
     }
 
-    filterByMethod(method) {
+    async filterByMethod(method) {
         this.currentFilter = method;
         this.saveFilterToCache();
         this.updateFilterButtons();
-        this.renderRecordsList();
+        await this.reloadRecords();
         
         // 如果当前选中的记录不在筛选结果中，清空详情面板
         if (this.selectedRecordId) {
@@ -6392,6 +6474,14 @@ class APIHookMonitor {
         const statusColor = server.enabled ? 'bg-green-100 text-green-800' : 'bg-gray-100 text-gray-600';
         const statusText = server.enabled ? '启用' : '禁用';
         
+        // 熔断状态
+        const breakerLabels = { closed: '🟢 健康', open: '🔴 已熔断', half_open: '🟡 探测恢复中' };
+        const breaker = server.breaker || { state: 'closed' };
+        let breakerText = breakerLabels[breaker.state] || breaker.state;
+        if (breaker.state === 'open' && breaker.retry_in_seconds) {
+            breakerText += ` (${breaker.retry_in_seconds}秒后重试)`;
+        }
+        
         card.innerHTML = `
             <div class="flex items-start justify-between">
                 <div class="flex-1 min-w-0">
@@ -6411,6 +6501,7 @@ class APIHookMonitor {
                     <div class="text-xs text-gray-400 space-x-4">
                         <span>超时: ${server.timeout}秒</span>
                         ${server.api_key ? '<span>🔑 已配置API Key</span>' : '<span>🔓 无API Key</span>'}
+                        ${server.enabled ? `<span title="${this.escapeHtml(breaker.last_error || '')}">${breakerText}</span>` : ''}
                     </div>
                 </div>
                 <div class="flex items-center space-x-2 ml-4">
@@ -3,23 +3,31 @@
 整合所有组件，提供统一的API接口
 """
 
-import json
+import time
 import asyncio
+import hashlib
 import logging
 import httpx
-from typing import Dict, List, Any, Optional, AsyncGenerator
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, AsyncGenerator, AsyncIterator, Tuple, Union
+from dataclasses import dataclass, field
 from sqlalchemy.orm import Session
 from fastapi import Response
 from fastapi.responses import StreamingResponse
 
 from platforms import PlatformManager, PlatformConfig, PlatformType
-from routing_system import RoutingManager, RoutingMode
-from format_converter import FormatConverter, StreamingConverter
+from routing_system import RoutingManager, RoutingMode, RoutingResult, HedgingConfig
+from format_converter import FormatConverter, StreamingConverter, CHINESE_CHAR_PATTERN
+import fast_json
+from tracing import trace, is_tracing
+from capture_buffer import CaptureBuffer
+from response_cache import response_cache
 from database import (
     PlatformConfig as DBPlatformConfig, 
     ModelConfig, 
     SystemConfig,
-    get_db
+    get_db,
+    run_db
 )
 
 # 配置日志
@@ -29,10 +37,226 @@ DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
 logging.basicConfig(level=logging.DEBUG if DEBUG_MODE else logging.INFO)
 logger = logging.getLogger(__name__)
 
-def debug_print(*args, **kwargs):
-    """统一的DEBUG输出函数，只在DEBUG_MODE启用时输出"""
-    if DEBUG_MODE:
-        print(*args, **kwargs)
+# 工具说明缓存大小（不同的tools定义数量）
+TOOLS_PROMPT_CACHE_SIZE = int(os.getenv('TOOLS_PROMPT_CACHE_SIZE', '64'))
+
+# 稳定前缀模式：工具说明放在system最前面，system各段和历史消息按原样逐字节保持不变，
+# 使上游的提示词缓存（前缀缓存）在多轮对话和不同会话之间都能命中
+STABLE_PREFIX_PROMPT = os.getenv('STABLE_PREFIX_PROMPT', 'false').lower() == 'true'
+# 支持在消息内容中使用 cache_control 标记的平台（其他平台发送前合并为纯文本）
+CACHE_CONTROL_PLATFORMS = {PlatformType.DASHSCOPE, PlatformType.OPENROUTER}
+# 流式响应中返回usage（含缓存命中token数）的平台
+STREAM_USAGE_PLATFORMS = {PlatformType.DASHSCOPE, PlatformType.OPENROUTER, PlatformType.SILICONFLOW, PlatformType.OPENAI_COMPATIBLE}
+
+@dataclass
+class RequestContext:
+    """单次请求的执行上下文，贯穿路由、转换和记录，避免并发请求之间互相覆盖"""
+    routing_result: Optional[RoutingResult] = None
+    routing_mode: Optional[str] = None
+    streaming_converter: Optional[StreamingConverter] = None
+    user_key_id: Optional[int] = None
+    cache_hit: bool = False  # 是否由响应缓存直接返回
+    # HOOK处理数据
+    processed_prompt: Optional[str] = None
+    processed_headers: Optional[str] = None
+    model_raw_headers: Optional[str] = None
+    model_raw_response: Optional[str] = None
+    # 各响应字段的捕获信息（模式、大小、是否截断），随记录一起保存
+    capture_info: Dict[str, Any] = field(default_factory=dict)
+    
+    def set_raw_response(self, capture: CaptureBuffer):
+        """保存捕获的大模型原始响应，并释放捕获缓冲区"""
+        self.model_raw_response = capture.getvalue()
+        self.capture_info["model_raw_response"] = capture.info()
+        capture.close()
+    
+    def get_token_usage(self) -> Optional[Dict[str, int]]:
+        """获取Token使用量，非流式请求返回None（由记录器从响应体解析）"""
+        if self.streaming_converter:
+            return {
+                "input_tokens": self.streaming_converter.total_input_tokens,
+                "output_tokens": self.streaming_converter.total_output_tokens,
+                "total_tokens": self.streaming_converter.total_input_tokens + self.streaming_converter.total_output_tokens,
+                "cached_tokens": self.streaming_converter.cached_input_tokens
+            }
+        return None
+
+def estimate_text_tokens(text: str) -> int:
+    """估算文本的token数量（简单估算）"""
+    if not text:
+        return 0
+    
+    # 简单的token估算：中文字符约1个token，英文单词约1个token
+    chinese_chars = len(CHINESE_CHAR_PATTERN.findall(text))
+    # 去掉中文字符后计算英文单词
+    text_without_chinese = CHINESE_CHAR_PATTERN.sub('', text)
+    english_words = len(text_without_chinese.split())
+    
+    return chinese_chars + english_words
+
+def render_tools_prompt(tools: List[Dict[str, Any]]) -> str:
+    """将tools定义渲染为system prompt中的工具说明，指导模型使用 <use_tool> 格式"""
+    tools_description = "\n\n=== Available Tools ===\n"
+    tools_description += "You have access to the following tools. You MUST follow the exact XML format specified below.\n\n"
+    
+    for tool in tools:
+        name = tool.get("name", "Unknown")
+        description = tool.get("description", "No description")
+        schema = tool.get("input_schema", {})
+        
+        tools_description += f"**{name}**\n"
+        tools_description += f"Description: {description}\n"
+        
+        # 添加参数信息
+        if "properties" in schema:
+            tools_description += "Parameters:\n"
+            for param_name, param_info in schema["properties"].items():
+                param_type = param_info.get("type", "unknown")
+                param_desc = param_info.get("description", "No description")
+                required = param_name in schema.get("required", [])
+                req_mark = " (required)" if required else " (optional)"
+                tools_description += f"  - {param_name} ({param_type}){req_mark}: {param_desc}\n"
+        
+        tools_description += "\n"
+    
+    # 添加工具使用格式说明 - 更严格的约束
+    tools_description += """**CRITICAL TOOL USAGE REQUIREMENTS:**
+
+YOU MUST use tools in the EXACT format specified below. NO EXCEPTIONS.
+
+**MANDATORY FORMAT:**
+<use_tool>
+<tool_name>exact_tool_name</tool_name>
+<parameters>
+{
+  "parameter1": "value1",
+  "parameter2": "value2"
+}
+</parameters>
+</use_tool>
+
+**STRICT RULES:**
+1. NEVER use descriptive text like "UseTool: ToolName" or "Param: {...}"
+2. ALWAYS use the <use_tool> XML tags exactly as shown
+3. Tool names MUST match exactly what's listed above
+4. Parameters MUST be valid JSON format
+5. NO additional text between the XML tags
+6. NO explanations inside the tool call
+
+**CORRECT Example:**
+<use_tool>
+<tool_name>Bash</tool_name>
+<parameters>
+{
+  "command": "ls -la",
+  "description": "List files"
+}
+</parameters>
+</use_tool>
+
+**WRONG Examples (DO NOT USE):**
+❌ Tool: Bash
+❌ Param: {"command": "ls"}
+❌ Tool call: Bash with parameters...
+❌ Using tool Bash...
+
+If you use ANY format other than the exact <use_tool> XML format, the tool call will FAIL.
+
+**IMPORTANT REMINDERS:**
+- Do NOT explain tool calls in natural language
+- Do NOT use Chinese descriptive text like "Tool"
+- Do NOT use any format other than <use_tool> XML tags
+- The system can ONLY process the exact XML format shown above
+- Multiple tools can be used by repeating the <use_tool> block
+- You can only use one tool at a time
+
+**COMPLIANCE CHECK:**
+Before responding, verify that ALL tool calls use the exact format:
+<use_tool><tool_name>NAME</tool_name><parameters>{JSON}</parameters></use_tool>
+
+"""
+    return tools_description
+
+@dataclass
+class ToolsPrompt:
+    """渲染好的工具说明及其token估算值"""
+    text: str
+    tokens: int
+
+class ToolsPromptCache:
+    """工具说明缓存（LRU）：tools定义的哈希 → 渲染结果
+    Claude Code 每轮对话都发送相同的 tools，命中时不再重新拼接和估算"""
+    
+    def __init__(self, max_size: int = TOOLS_PROMPT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, ToolsPrompt]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def make_key(tools: List[Dict[str, Any]]) -> str:
+        return hashlib.sha256(fast_json.dumps_bytes(tools)).hexdigest()
+    
+    def render(self, tools: List[Dict[str, Any]]) -> ToolsPrompt:
+        """返回tools对应的工具说明，未命中时渲染并缓存"""
+        key = self.make_key(tools)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        text = render_tools_prompt(tools)
+        entry = ToolsPrompt(text=text, tokens=estimate_text_tokens(text))
+        if self.max_size > 0:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions
+        }
+
+@dataclass
+class HedgeAttempt:
+    """对冲请求中的一路上游调用"""
+    routing_result: RoutingResult
+    client: Any
+    api_url: str
+    headers: Dict[str, str]
+    payload: Dict[str, Any]
+    streaming_converter: StreamingConverter
+    response: Optional[httpx.Response] = None
+    lines: Optional[AsyncIterator[str]] = None
+    first_line: Optional[str] = None
+    error: Optional[str] = None
+    acquired: bool = False  # 是否已登记使用平台连接池
+    
+    async def output_tokens(self, converter_type: str) -> int:
+        """落败时已收到的输出token数：把已读到的数据交给这一路的转换器，由其 StreamingTokenCounter 统计"""
+        if self.first_line is not None:
+            await self.streaming_converter.convert_stream(self.first_line, converter_type)
+        return self.streaming_converter.total_output_tokens
+    
+    async def close(self):
+        """关闭上游响应，释放连接"""
+        try:
+            if self.response is not None:
+                await self.response.aclose()
+        finally:
+            if self.acquired:
+                self.acquired = False
+                self.client.release_http_client()
 
 class MultiPlatformService:
     """多平台API服务"""
@@ -41,7 +265,8 @@ class MultiPlatformService:
         self.platform_manager = PlatformManager()
         self.routing_manager = RoutingManager(self.platform_manager)
         self.format_converter = FormatConverter()
-        self.streaming_converter = None  # 每次请求时创建新的实例
+        self.tools_prompt_cache = ToolsPromptCache()
+        self.response_cache = response_cache
         self.initialized = False
     
     async def initialize(self, db: Session):
@@ -53,7 +278,7 @@ class MultiPlatformService:
             await self._load_platform_configs(db)
             
             logger.info("🧭 [MultiPlatformService] 加载路由配置...")
-            self.routing_manager.load_config(db)
+            await run_db(self.routing_manager.load_config, db)
             
             self.initialized = True
             logger.info("✅ [MultiPlatformService] 多平台服务初始化成功")
@@ -61,13 +286,23 @@ class MultiPlatformService:
             logger.error(f"❌ [MultiPlatformService] 初始化失败: {e}")
             self.initialized = False
     
+    async def start(self, db: Session):
+        """应用启动时初始化服务并建立各平台连接池"""
+        await self.initialize(db)
+        await run_db(self.response_cache.load, db)
+        await self.platform_manager.start()
+    
+    async def shutdown(self):
+        """应用关闭时释放各平台连接池"""
+        await self.platform_manager.shutdown()
+    
     async def _load_platform_configs(self, db: Session):
         """加载平台配置"""
         logger.info("🔍 [MultiPlatformService] 查询数据库中的平台配置...")
         
-        platform_configs = db.query(DBPlatformConfig).filter(
+        platform_configs = await run_db(db.query(DBPlatformConfig).filter(
             DBPlatformConfig.enabled == True
-        ).all()
+        ).all)
         
         logger.info(f"📊 [MultiPlatformService] 找到 {len(platform_configs)} 个启用的平台配置")
         
@@ -97,43 +332,46 @@ class MultiPlatformService:
         stream: bool = False,
         db: Session = None,
         original_request: Dict[str, Any] = None,
+        ctx: Optional[RequestContext] = None,
         **kwargs
-    ) -> AsyncGenerator[str, None]:
-        # 保存路由信息供外部访问
-        self.last_routing_result = None
-        # 保存HOOK处理数据供外部访问
-        self.processed_prompt = None
-        self.processed_headers = None
-        self.model_raw_headers = None
-        self.model_raw_response = None
-        """处理聊天请求"""
+    ) -> AsyncGenerator[Union[str, bytes], None]:
+        """处理聊天请求，路由结果和HOOK处理数据写入调用方传入的ctx
+        流式请求转换后的SSE事件为bytes，错误信息为字符串"""
+        if ctx is None:
+            ctx = RequestContext()
+        
         if not self.initialized:
             if db:
                 await self.initialize(db)
             else:
-                yield json.dumps({"error": "Service not initialized"})
+                yield fast_json.dumps({"error": "Service not initialized"})
                 return
         
         # 1. 判断路由模式
+        ctx.routing_mode = self.get_current_routing_mode()
         routing_result = await self.routing_manager.route_request(messages)
-        self.last_routing_result = routing_result
+        ctx.routing_result = routing_result
+        trace("🎯 [Trace] 路由结果", routing_mode=ctx.routing_mode, success=routing_result.success,
+              platform=routing_result.platform_type.value if routing_result.platform_type else None,
+              model=routing_result.model_id, scene=routing_result.scene_name, error=routing_result.error_message)
         
         if not routing_result.success:
             if routing_result.error_message == "Use original Claude Code API":
                 # 使用原有的Claude Code API逻辑
-                yield json.dumps({"error": "Should use original Claude Code API"})
+                yield fast_json.dumps({"error": "Should use original Claude Code API"})
                 return
             else:
-                yield json.dumps({"error": routing_result.error_message})
+                yield fast_json.dumps({"error": routing_result.error_message})
                 return
         
         # 2. 转换消息格式
-        openai_messages = self.format_converter.claude_to_openai(messages)
+        openai_messages = self.format_converter.claude_to_openai(messages, keep_cache_control=STABLE_PREFIX_PROMPT)
         
         # 处理system参数：如果有system字段，添加为system message
         extracted_tools = None
         if "system" in kwargs and kwargs["system"]:
             system_content = kwargs["system"]
+            system_parts = None
             
             # 如果system是数组格式（Claude格式），提取文本内容和工具信息
             if isinstance(system_content, list):
@@ -141,34 +379,33 @@ class MultiPlatformService:
                 for item in system_content:
                     if isinstance(item, dict) and item.get("type") == "text":
                         text_parts.append(item.get("text", ""))
+                if STABLE_PREFIX_PROMPT:
+                    system_parts = self._system_blocks_to_parts(system_content)
                 system_content = "\n".join(text_parts)
             
             if system_content:  # 确保有内容
                 system_message = {
                     "role": "system",
-                    "content": system_content
+                    "content": system_parts or system_content
                 }
                 # 将system message插入到消息列表开头
                 openai_messages.insert(0, system_message)
-                debug_print(f"[DEBUG] 添加system message: {system_content[:100]}...")
-        
-        # 暂时保存转换后的消息，稍后会用完整的payload覆盖
-        self.processed_prompt = None
+                trace("[DEBUG] 添加system message: %s...", system_content[:100])
         
         # 3. 获取目标平台客户端
         client = self.platform_manager.get_platform(routing_result.platform_type)
         if not client:
-            yield json.dumps({"error": f"Platform {routing_result.platform_type} not available"})
+            yield fast_json.dumps({"error": f"Platform {routing_result.platform_type} not available"})
             return
         
         # 4. 创建流式转换器（每次请求都是新的实例）
         if stream:
-            debug_print(f"[DEBUG] MultiPlatformService: 创建流式转换器, original_model={model}, target_model={routing_result.model_id}")
-            self.streaming_converter = StreamingConverter(original_model=model)
+            trace("[DEBUG] MultiPlatformService: 创建流式转换器, original_model=%s, target_model=%s", model, routing_result.model_id)
+            ctx.streaming_converter = StreamingConverter(original_model=model)
             # 估算输入token数量
             estimated_input_tokens = self._estimate_input_tokens(openai_messages)
-            self.streaming_converter.total_input_tokens = estimated_input_tokens
-            debug_print(f"[DEBUG] MultiPlatformService: 估算输入tokens: {estimated_input_tokens}")
+            ctx.streaming_converter.total_input_tokens = estimated_input_tokens
+            trace("[DEBUG] MultiPlatformService: 估算输入tokens: %s", estimated_input_tokens)
         
         # 5. 处理 tools 参数（如果有的话，转换为 system prompt）
         tools_processed = False
@@ -177,129 +414,111 @@ class MultiPlatformService:
         # 优先检查独立的tools参数
         if "tools" in kwargs and kwargs["tools"]:
             tools_to_process = kwargs["tools"]
-            debug_print(f"[DEBUG] 检测到独立的tools参数")
+            trace("[DEBUG] 检测到独立的tools参数")
         # 如果没有独立的tools参数，检查原始请求中是否有tools字段
         elif original_request and "tools" in original_request and original_request["tools"]:
             tools_to_process = original_request["tools"]
-            debug_print(f"[DEBUG] 从原始请求中检测到tools参数，包含 {len(tools_to_process)} 个工具")
+            trace("[DEBUG] 从原始请求中检测到tools参数，包含 %s 个工具", len(tools_to_process))
         
         if tools_to_process:
-            openai_messages = self._convert_tools_to_system_prompt(openai_messages, tools_to_process)
-            debug_print(f"[DEBUG] 已将tools转换为system prompt")
+            # 相同的tools定义只渲染一次，token估算值随缓存一起复用
+            tools_prompt = self.tools_prompt_cache.render(tools_to_process)
+            openai_messages = self._convert_tools_to_system_prompt(openai_messages, tools_prompt.text)
+            trace("[DEBUG] 已将tools转换为system prompt")
             tools_processed = True
+            if stream:
+                estimated_input_tokens += tools_prompt.tokens
+                ctx.streaming_converter.total_input_tokens = estimated_input_tokens
         
-        # 6. 过滤和转换不支持的参数
-        filtered_kwargs = self._filter_unsupported_params(kwargs, routing_result.platform_type)
-        
-        # 移除system参数（因为已经转换为system message了）
-        if "system" in filtered_kwargs:
-            filtered_kwargs.pop("system")
-            debug_print(f"[DEBUG] 移除system参数（已转换为system message）")
-        
-        # 针对不同平台调整参数限制
-        filtered_kwargs = self._adjust_platform_limits(filtered_kwargs, routing_result.platform_type)
-        
-        # 如果已经处理了 tools，移除相关参数避免冲突
-        if tools_processed:
-            filtered_kwargs.pop("tools", None)
-            filtered_kwargs.pop("tool_choice", None)
-            debug_print(f"[DEBUG] 移除了 tools 和 tool_choice 参数，避免与 system prompt 冲突")
-        
-        debug_print(f"[DEBUG] 发送到{routing_result.platform_type.value}的参数: {filtered_kwargs.keys()}")
-        
-        # 7. 调用目标API - 直接使用httpx获取完整响应信息
+        # 6-7. 调用目标API - 直接使用httpx获取完整响应信息
         try:
-            # 构建API请求参数
-            api_url = self._get_api_url(client, routing_result.platform_type)
-            headers = self._get_api_headers(client, routing_result.platform_type)
+            # 全局直连模式启用对冲时，流式请求走对冲逻辑
+            hedging = self.routing_manager.get_hedging_config()
+            if stream and hedging.enabled:
+                async for chunk in self._hedged_stream(
+                    ctx, model, routing_result, openai_messages, kwargs, tools_processed,
+                    ctx.streaming_converter.total_input_tokens, hedging
+                ):
+                    yield chunk
+                return
             
-            payload = {
-                "model": routing_result.model_id,
-                "messages": openai_messages,
-                "stream": stream,
-                **filtered_kwargs
-            }
+            # 构建API请求参数
+            api_url, headers, payload = self._build_upstream_call(
+                client, routing_result, openai_messages, kwargs, tools_processed, stream
+            )
             
             # 保存真正发给远端大模型的完整请求内容（HOOK处理后的原样）
-            self.processed_prompt = json.dumps(payload, ensure_ascii=False, indent=2)
-            self.processed_headers = json.dumps(headers, ensure_ascii=False, indent=2)
-            
-            debug_print(f"[DEBUG] 调用API: {api_url}")
-            # 只显示关键信息，避免输出过长
-            debug_payload = {
-                "model": payload.get("model"),
-                "stream": payload.get("stream"),
-                "messages_count": len(payload.get("messages", [])),
-                "first_message_role": payload.get("messages", [{}])[0].get("role") if payload.get("messages") else None,
-                "last_message_role": payload.get("messages", [{}])[-1].get("role") if payload.get("messages") else None,
-                "other_params": [k for k in payload.keys() if k not in ["messages", "model", "stream"]]
-            }
-            debug_print(f"[DEBUG] 请求payload概要: {json.dumps(debug_payload, ensure_ascii=False, indent=2)}")
+            ctx.processed_prompt = fast_json.dumps(payload, ensure_ascii=False, indent=2)
+            ctx.processed_headers = fast_json.dumps(headers, ensure_ascii=False, indent=2)
             
-            async with httpx.AsyncClient(timeout=30.0) as http_client:
+            # 使用平台共享的长连接客户端，避免每次请求重新握手
+            http_client = client.acquire_http_client()
+            try:
                 if stream:
                     # 流式请求
-                    raw_response_chunks = []
-                    async with http_client.stream("POST", api_url, headers=headers, json=payload) as response:
-                        # 保存响应头
-                        self.model_raw_headers = json.dumps(dict(response.headers), ensure_ascii=False, indent=2)
-                        debug_print(f"[DEBUG] 获取到响应头: {response.status_code}")
+                    raw_response_capture = CaptureBuffer(separator="\n")
+                    try:
+                        async with http_client.stream("POST", api_url, headers=headers, content=fast_json.dumps_bytes(payload)) as response:
+                            # 保存响应头
+                            ctx.model_raw_headers = fast_json.dumps(dict(response.headers), ensure_ascii=False, indent=2)
+                            trace("[DEBUG] 获取到响应头: %s", response.status_code, status=response.status_code, url=api_url)
                         
-                        if response.status_code == 200:
-                            async for line in response.aiter_lines():
-                                if line.strip():
-                                    raw_response_chunks.append(line)
-                                    
-                                    # 转换响应格式
-                                    platform_type_str = routing_result.platform_type.value
-                                    if platform_type_str == "dashscope":
-                                        converter_type = "qwen"
-                                    elif platform_type_str == "openrouter":
-                                        converter_type = "openrouter"
-                                    elif platform_type_str == "ollama":
-                                        converter_type = "ollama"
-                                    elif platform_type_str == "lmstudio":
-                                        converter_type = "lmstudio"
-                                    elif platform_type_str == "siliconflow":
-                                        converter_type = "openai"  # 硅基流动使用OpenAI格式
-                                    elif platform_type_str == "openai_compatible":
-                                        converter_type = "openai"  # OpenAI兼容使用OpenAI格式
-                                    else:
-                                        converter_type = "openai"
+                            if response.status_code == 200:
+                                async for line in response.aiter_lines():
+                                    if line.strip():
+                                        raw_response_capture.append(line)
                                     
-                                    converted_chunk = await self.streaming_converter.convert_stream(line, converter_type)
-                                    if converted_chunk:
-                                        yield converted_chunk
-                        else:
-                            error_msg = await response.aread()
-                            error_data = json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
-                            raw_response_chunks.append(error_data)
-                            yield error_data
-                    
-                    # 保存流式响应数据
-                    self.model_raw_response = "\n".join(raw_response_chunks)
+                                        # 转换响应格式
+                                        converter_type = self._get_converter_type(routing_result.platform_type)
+                                        converted_chunk = await ctx.streaming_converter.convert_stream(line, converter_type)
+                                        if converted_chunk:
+                                            yield converted_chunk
+                            else:
+                                error_msg = await response.aread()
+                                error_data = fast_json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
+                                raw_response_capture.append(error_data)
+                                yield error_data
+                    finally:
+                        # 客户端断开或上游出错时也要关闭捕获缓冲区，并保留已捕获的内容和截断信息
+                        ctx.set_raw_response(raw_response_capture)
                     
                 else:
-                    # 非流式请求
-                    response = await http_client.post(api_url, headers=headers, json=payload)
+                    # 非流式请求：确定性请求先查响应缓存
+                    cache_key = None
+                    if self.response_cache.is_cacheable(payload, stream, ctx.user_key_id):
+                        cache_key = self.response_cache.make_key(routing_result.platform_type.value, payload)
+                        cached = self.response_cache.get(cache_key)
+                        if cached is not None:
+                            ctx.cache_hit = True
+                            ctx.model_raw_response = cached.model_raw_response
+                            trace("💾 [Trace] 响应缓存命中", cache_key=cache_key)
+                            yield cached.response_body
+                            return
+                
+                    response = await http_client.post(api_url, headers=headers, content=fast_json.dumps_bytes(payload))
                     
                     # 保存响应头和响应体
-                    self.model_raw_headers = json.dumps(dict(response.headers), ensure_ascii=False, indent=2)
-                    self.model_raw_response = response.text
+                    ctx.model_raw_headers = fast_json.dumps(dict(response.headers), ensure_ascii=False, indent=2)
+                    ctx.model_raw_response = response.text
                     
-                    debug_print(f"[DEBUG] 非流式响应: {response.status_code}, 响应长度: {len(response.text)}")
+                    trace("[DEBUG] 非流式响应: %s, 响应长度: %s", response.status_code, len(response.text), status=response.status_code, url=api_url)
                     
                     if response.status_code == 200:
                         # 转换响应格式
                         converted_response = self.format_converter.openai_to_claude(response.text, is_stream=False, original_model=model)
+                        if cache_key is not None:
+                            await self.response_cache.put(cache_key, converted_response, response.text)
                         yield converted_response
                     else:
-                        yield json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
+                        yield fast_json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
+            finally:
+                # 请求结束后归还，连接参数变化时旧连接池等进行中的请求结束再关闭
+                client.release_http_client()
                     
         except Exception as e:
             logger.error(f"Failed to call platform API: {e}")
             # 如果是流式请求且有转换器，需要发送错误格式
-            if stream and self.streaming_converter:
+            if stream and ctx.streaming_converter:
                 error_event = {
                     "type": "error",
                     "error": {
@@ -307,9 +526,249 @@ class MultiPlatformService:
                         "message": f"API call failed: {str(e)}"
                     }
                 }
-                yield f"event: error\ndata: {json.dumps(error_event, ensure_ascii=False)}\n\n"
+                yield f"event: error\ndata: {fast_json.dumps(error_event, ensure_ascii=False)}\n\n"
             else:
-                yield json.dumps({"error": f"API call failed: {str(e)}"})
+                yield fast_json.dumps({"error": f"API call failed: {str(e)}"})
+    
+    def _build_upstream_call(
+        self,
+        client,
+        routing_result: RoutingResult,
+        openai_messages: List[Dict[str, Any]],
+        kwargs: Dict[str, Any],
+        tools_processed: bool,
+        stream: bool
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """按目标平台构建请求URL、请求头和payload"""
+        # 过滤和转换不支持的参数
+        filtered_kwargs = self._filter_unsupported_params(kwargs, routing_result.platform_type)
+        
+        # 移除system参数（因为已经转换为system message了）
+        if "system" in filtered_kwargs:
+            filtered_kwargs.pop("system")
+            trace("[DEBUG] 移除system参数（已转换为system message）")
+        
+        # 针对不同平台调整参数限制
+        filtered_kwargs = self._adjust_platform_limits(filtered_kwargs, routing_result.platform_type)
+        
+        # 如果已经处理了 tools，移除相关参数避免冲突
+        if tools_processed:
+            filtered_kwargs.pop("tools", None)
+            filtered_kwargs.pop("tool_choice", None)
+            trace("[DEBUG] 移除了 tools 和 tool_choice 参数，避免与 system prompt 冲突")
+        
+        trace("[DEBUG] 发送到%s的参数: %s", routing_result.platform_type.value, filtered_kwargs.keys())
+        
+        if STABLE_PREFIX_PROMPT:
+            if routing_result.platform_type not in CACHE_CONTROL_PLATFORMS:
+                openai_messages = self._flatten_content_parts(openai_messages)
+            if stream and routing_result.platform_type in STREAM_USAGE_PLATFORMS and "stream_options" not in filtered_kwargs:
+                # 流式响应最后返回usage，用于记录缓存命中的token数
+                filtered_kwargs["stream_options"] = {"include_usage": True}
+        
+        api_url = self._get_api_url(client, routing_result.platform_type)
+        headers = self._get_api_headers(client, routing_result.platform_type)
+        
+        payload = {
+            "model": routing_result.model_id,
+            "messages": openai_messages,
+            "stream": stream,
+            **filtered_kwargs
+        }
+        
+        trace("[DEBUG] 调用API: %s", api_url)
+        if is_tracing():
+            # 只显示关键信息，避免输出过长
+            debug_payload = {
+                "model": payload.get("model"),
+                "stream": payload.get("stream"),
+                "messages_count": len(payload.get("messages", [])),
+                "first_message_role": payload.get("messages", [{}])[0].get("role") if payload.get("messages") else None,
+                "last_message_role": payload.get("messages", [{}])[-1].get("role") if payload.get("messages") else None,
+                "other_params": [k for k in payload.keys() if k not in ["messages", "model", "stream"]]
+            }
+            trace("[DEBUG] 请求payload概要: %s", fast_json.dumps(debug_payload, ensure_ascii=False, indent=2))
+        
+        return api_url, headers, payload
+    
+    @staticmethod
+    def _get_converter_type(platform_type: PlatformType) -> str:
+        """根据平台类型选择流式转换格式"""
+        platform_type_str = platform_type.value
+        if platform_type_str == "dashscope":
+            return "qwen"
+        elif platform_type_str == "openrouter":
+            return "openrouter"
+        elif platform_type_str == "ollama":
+            return "ollama"
+        elif platform_type_str == "lmstudio":
+            return "lmstudio"
+        # 硅基流动、OpenAI兼容等使用OpenAI格式
+        return "openai"
+    
+    async def _open_stream_attempt(self, attempt: HedgeAttempt) -> HedgeAttempt:
+        """发起一路流式请求并读取到第一行数据（首个token）为止"""
+        started = time.time()
+        http_client = attempt.client.acquire_http_client()
+        attempt.acquired = True
+        try:
+            request = http_client.build_request("POST", attempt.api_url, headers=attempt.headers, content=fast_json.dumps_bytes(attempt.payload))
+            attempt.response = await http_client.send(request, stream=True)
+            
+            if attempt.response.status_code != 200:
+                error_msg = await attempt.response.aread()
+                attempt.error = fast_json.dumps({"error": f"API error: {attempt.response.status_code} - {error_msg.decode()}"})
+                return attempt
+            
+            attempt.lines = attempt.response.aiter_lines()
+            async for line in attempt.lines:
+                if line.strip():
+                    attempt.first_line = line
+                    break
+            
+            elapsed_ms = (time.time() - started) * 1000
+            self.routing_manager.hedging_stats.record_first_token(attempt.routing_result.model_spec, elapsed_ms)
+        except asyncio.CancelledError:
+            await attempt.close()
+            raise
+        except Exception as e:
+            attempt.error = fast_json.dumps({"error": f"API call failed: {str(e)}"})
+        return attempt
+    
+    async def _hedged_stream(
+        self,
+        ctx: RequestContext,
+        model: str,
+        routing_result: RoutingResult,
+        openai_messages: List[Dict[str, Any]],
+        kwargs: Dict[str, Any],
+        tools_processed: bool,
+        estimated_input_tokens: int,
+        hedging: HedgingConfig
+    ) -> AsyncGenerator[Union[str, bytes], None]:
+        """对冲流式请求：主模型在延迟内未返回首个token（或已失败）时，向下一个模型发出相同请求，保留先返回的一路并取消另一路"""
+        stats = self.routing_manager.hedging_stats
+        
+        attempts: List[HedgeAttempt] = []
+        for candidate in [routing_result] + routing_result.alternatives[:1]:
+            client = self.platform_manager.get_platform(candidate.platform_type)
+            if not client:
+                continue
+            api_url, headers, payload = self._build_upstream_call(
+                client, candidate, openai_messages, kwargs, tools_processed, stream=True
+            )
+            converter = StreamingConverter(original_model=model)
+            converter.total_input_tokens = estimated_input_tokens
+            attempts.append(HedgeAttempt(
+                routing_result=candidate,
+                client=client,
+                api_url=api_url,
+                headers=headers,
+                payload=payload,
+                streaming_converter=converter
+            ))
+        
+        tasks: Dict[asyncio.Task, HedgeAttempt] = {}
+        pending = set()
+        launched = 0
+        winner: Optional[HedgeAttempt] = None
+        
+        def launch_next():
+            nonlocal launched
+            attempt = attempts[launched]
+            task = asyncio.create_task(self._open_stream_attempt(attempt))
+            tasks[task] = attempt
+            pending.add(task)
+            launched += 1
+        
+        try:
+            launch_next()
+            timeout = stats.get_delay(hedging, attempts[0].routing_result.model_spec)
+            while pending and winner is None:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=timeout if launched < len(attempts) else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                pending.difference_update(done)
+                failed = False
+                for task in done:
+                    attempt = task.result()
+                    if attempt.error is None and winner is None:
+                        winner = attempt
+                    else:
+                        failed = True
+                
+                # 主模型超过对冲延迟仍未出首个token，或已经失败，向下一个模型发出对冲请求
+                if winner is None and launched < len(attempts) and (not done or failed):
+                    logger.info(f"🪁 [Hedging] {attempts[0].routing_result.model_spec} 首个token超过 {int(timeout * 1000)}ms 或请求失败，对冲到 {attempts[launched].routing_result.model_spec}")
+                    launch_next()
+        finally:
+            # 取消并关闭落败的请求
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            for attempt in tasks.values():
+                if attempt is not winner:
+                    await attempt.close()
+        
+        hedged = launched > 1
+        if winner is None:
+            # 所有请求都失败，返回主模型的错误
+            stats.record_result(None, hedged)
+            primary = attempts[0]
+            ctx.processed_prompt = fast_json.dumps(primary.payload, ensure_ascii=False, indent=2)
+            ctx.processed_headers = fast_json.dumps(primary.headers, ensure_ascii=False, indent=2)
+            if primary.response is not None:
+                ctx.model_raw_headers = fast_json.dumps(dict(primary.response.headers), ensure_ascii=False, indent=2)
+            ctx.model_raw_response = primary.error
+            yield primary.error
+            return
+        
+        # 落败的请求已发出完整prompt，按估算的输入token加上已返回的输出token计入浪费
+        wasted_tokens = estimated_input_tokens * (launched - 1)
+        for attempt in tasks.values():
+            if attempt is not winner:
+                wasted_tokens += await attempt.output_tokens(self._get_converter_type(attempt.routing_result.platform_type))
+        stats.record_result(winner.routing_result.model_spec, hedged, wasted_tokens)
+        if hedged:
+            logger.info(f"🏁 [Hedging] 对冲请求由 {winner.routing_result.model_spec} 胜出")
+        trace("🏁 [Trace] 流式请求开始转发", model=winner.routing_result.model_spec, hedged=hedged)
+        
+        # 以胜出的请求为准更新上下文，记录实际使用的平台和模型
+        ctx.routing_result = winner.routing_result
+        ctx.streaming_converter = winner.streaming_converter
+        ctx.processed_prompt = fast_json.dumps(winner.payload, ensure_ascii=False, indent=2)
+        ctx.processed_headers = fast_json.dumps(winner.headers, ensure_ascii=False, indent=2)
+        ctx.model_raw_headers = fast_json.dumps(dict(winner.response.headers), ensure_ascii=False, indent=2)
+        
+        converter_type = self._get_converter_type(winner.routing_result.platform_type)
+        raw_response_capture = CaptureBuffer(separator="\n")
+        try:
+            if winner.first_line is not None:
+                raw_response_capture.append(winner.first_line)
+                converted_chunk = await winner.streaming_converter.convert_stream(winner.first_line, converter_type)
+                if converted_chunk:
+                    yield converted_chunk
+                
+                async for line in winner.lines:
+                    if line.strip():
+                        raw_response_capture.append(line)
+                        converted_chunk = await winner.streaming_converter.convert_stream(line, converter_type)
+                        if converted_chunk:
+                            yield converted_chunk
+        finally:
+            await winner.close()
+            # 保存流式响应数据
+            ctx.set_raw_response(raw_response_capture)
+    
+    def get_routing_stats(self) -> Dict[str, Any]:
+        """获取路由统计信息（包括对冲请求统计、工具说明缓存和响应缓存）"""
+        stats = self.routing_manager.get_stats()
+        stats["tools_prompt_cache"] = self.tools_prompt_cache.get_stats()
+        stats["response_cache"] = self.response_cache.get_stats()
+        return stats
     
     async def get_available_models(self, db: Session) -> List[Dict[str, Any]]:
         """获取所有可用模型"""
@@ -321,7 +780,7 @@ class MultiPlatformService:
         
         # 优先从数据库获取模型列表
         logger.info("💾 [MultiPlatformService] 优先从数据库获取模型列表...")
-        db_models = db.query(ModelConfig).filter(ModelConfig.enabled == True).all()
+        db_models = await run_db(db.query(ModelConfig).filter(ModelConfig.enabled == True).all)
         
         if db_models:
             logger.info(f"📋 [MultiPlatformService] 从数据库获取到 {len(db_models)} 个模型")
@@ -351,7 +810,7 @@ class MultiPlatformService:
             
             if all_models:
                 # 保存到数据库
-                await self._save_models_to_db(db, all_models)
+                await run_db(self._save_models_to_db, db, all_models)
                 
                 # 重新从数据库读取
                 return await self.get_available_models(db)
@@ -371,6 +830,19 @@ class MultiPlatformService:
             for platform_type, status in results.items()
         }
     
+    async def get_platform_report(self, db: Session, platform_type: str = None, use_cache: bool = True) -> List[Dict[str, Any]]:
+        """获取各平台连接详情（是否可用、耗时、模型数量、错误信息）"""
+        if not self.initialized:
+            await self.initialize(db)
+        
+        try:
+            platform_types = [PlatformType(platform_type)] if platform_type else None
+        except ValueError:
+            logger.error(f"❌ [MultiPlatformService] 无效的平台类型: {platform_type}")
+            return []
+        results = await self.platform_manager.probe_platforms(platform_types=platform_types, use_cache=use_cache)
+        return [result.to_dict() for result in results.values()]
+    
     async def refresh_models(self, db: Session, platform_type: str = None):
         """刷新模型列表并保存到数据库"""
         logger.info("🔄 [MultiPlatformService] 开始刷新模型列表...")
@@ -387,9 +859,10 @@ class MultiPlatformService:
                 client = self.platform_manager.get_platform(platform_enum)
                 if client:
                     logger.info(f"📞 [MultiPlatformService] 获取 {platform_type} 平台模型...")
-                    models = await client.get_models()
+                    results = await self.platform_manager.probe_platforms(platform_types=[platform_enum])
+                    models = results[platform_enum].models
                     logger.info(f"💾 [MultiPlatformService] 保存 {len(models)} 个模型到数据库...")
-                    await self._save_models_to_db(db, models)
+                    await run_db(self._save_models_to_db, db, models)
                 else:
                     logger.warning(f"⚠️ [MultiPlatformService] 未找到 {platform_type} 平台客户端")
             except ValueError:
@@ -397,12 +870,12 @@ class MultiPlatformService:
         else:
             # 刷新所有平台的模型
             logger.info("🌐 [MultiPlatformService] 刷新所有平台的模型...")
-            all_models = await self.platform_manager.get_all_models()
+            all_models = await self.platform_manager.get_all_models(use_cache=False)
             logger.info(f"💾 [MultiPlatformService] 保存 {len(all_models)} 个模型到数据库...")
-            await self._save_models_to_db(db, all_models)
+            await run_db(self._save_models_to_db, db, all_models)
     
-    async def _save_models_to_db(self, db: Session, models: List):
-        """保存模型到数据库"""
+    def _save_models_to_db(self, db: Session, models: List):
+        """保存模型到数据库（同步执行，由调用方放到数据库线程池）"""
         logger.info(f"💾 [MultiPlatformService] 开始保存 {len(models)} 个模型到数据库...")
         
         saved_count = 0
@@ -503,13 +976,13 @@ class MultiPlatformService:
             if platform_name == "openrouter" and key == "tool_choice":
                 if "tools" not in kwargs or not kwargs["tools"]:
                     removed_params.append(key)
-                    debug_print(f"[DEBUG] OpenRouter: 由于没有tools参数，移除tool_choice")
+                    trace("[DEBUG] OpenRouter: 由于没有tools参数，移除tool_choice")
                     continue
             
             filtered[key] = value
         
         if removed_params:
-            debug_print(f"[DEBUG] 过滤掉{platform_name}不支持的参数: {removed_params}")
+            trace("[DEBUG] 过滤掉%s不支持的参数: %s", platform_name, removed_params)
         
         return filtered
     
@@ -525,10 +998,10 @@ class MultiPlatformService:
                 original_value = adjusted["max_tokens"]
                 if original_value > 8192:
                     adjusted["max_tokens"] = 8192
-                    debug_print(f"[DEBUG] DashScope: max_tokens从{original_value}调整为8192")
+                    trace("[DEBUG] DashScope: max_tokens从%s调整为8192", original_value)
                 elif original_value < 1:
                     adjusted["max_tokens"] = 1
-                    debug_print(f"[DEBUG] DashScope: max_tokens从{original_value}调整为1")
+                    trace("[DEBUG] DashScope: max_tokens从%s调整为1", original_value)
         
         # 其他平台可以在这里添加限制逻辑
         # elif platform_name == "openrouter":
@@ -584,91 +1057,13 @@ class MultiPlatformService:
         
         return headers
     
-    def _convert_tools_to_system_prompt(self, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """将tools参数转换为system prompt，支持完整的Tool Use流程"""
-        if not tools:
+    def _convert_tools_to_system_prompt(self, messages: List[Dict[str, Any]], tools_description: str) -> List[Dict[str, Any]]:
+        """将渲染好的tools说明附加到system prompt，支持完整的Tool Use流程"""
+        if not tools_description:
             return messages
         
-        # 构建详细的tools描述，指导模型使用 <use_tool> 格式
-        tools_description = "\n\n=== Available Tools ===\n"
-        tools_description += "You have access to the following tools. You MUST follow the exact XML format specified below.\n\n"
-        
-        for tool in tools:
-            name = tool.get("name", "Unknown")
-            description = tool.get("description", "No description")
-            schema = tool.get("input_schema", {})
-            
-            tools_description += f"**{name}**\n"
-            tools_description += f"Description: {description}\n"
-            
-            # 添加参数信息
-            if "properties" in schema:
-                tools_description += "Parameters:\n"
-                for param_name, param_info in schema["properties"].items():
-                    param_type = param_info.get("type", "unknown")
-                    param_desc = param_info.get("description", "No description")
-                    required = param_name in schema.get("required", [])
-                    req_mark = " (required)" if required else " (optional)"
-                    tools_description += f"  - {param_name} ({param_type}){req_mark}: {param_desc}\n"
-            
-            tools_description += "\n"
-        
-        # 添加工具使用格式说明 - 更严格的约束
-        tools_description += """**CRITICAL TOOL USAGE REQUIREMENTS:**
-
-YOU MUST use tools in the EXACT format specified below. NO EXCEPTIONS.
-
-**MANDATORY FORMAT:**
-<use_tool>
-<tool_name>exact_tool_name</tool_name>
-<parameters>
-{
-  "parameter1": "value1",
-  "parameter2": "value2"
-}
-</parameters>
-</use_tool>
-
-**STRICT RULES:**
-1. NEVER use descriptive text like "UseTool: ToolName" or "Param: {...}"
-2. ALWAYS use the <use_tool> XML tags exactly as shown
-3. Tool names MUST match exactly what's listed above
-4. Parameters MUST be valid JSON format
-5. NO additional text between the XML tags
-6. NO explanations inside the tool call
-
-**CORRECT Example:**
-<use_tool>
-<tool_name>Bash</tool_name>
-<parameters>
-{
-  "command": "ls -la",
-  "description": "List files"
-}
-</parameters>
-</use_tool>
-
-**WRONG Examples (DO NOT USE):**
-❌ Tool: Bash
-❌ Param: {"command": "ls"}
-❌ Tool call: Bash with parameters...
-❌ Using tool Bash...
-
-If you use ANY format other than the exact <use_tool> XML format, the tool call will FAIL.
-
-**IMPORTANT REMINDERS:**
-- Do NOT explain tool calls in natural language
-- Do NOT use Chinese descriptive text like "Tool"
-- Do NOT use any format other than <use_tool> XML tags
-- The system can ONLY process the exact XML format shown above
-- Multiple tools can be used by repeating the <use_tool> block
-- You can only use one tool at a time
-
-**COMPLIANCE CHECK:**
-Before responding, verify that ALL tool calls use the exact format:
-<use_tool><tool_name>NAME</tool_name><parameters>{JSON}</parameters></use_tool>
-
-"""
+        if STABLE_PREFIX_PROMPT:
+            return self._prepend_tools_to_system_prompt(messages, tools_description)
         
         # 查找system消息并附加tools描述
         modified_messages = []
@@ -680,7 +1075,7 @@ Before responding, verify that ALL tool calls use the exact format:
                 content = message.get("content", "")
                 message["content"] = content + tools_description
                 system_found = True
-                debug_print(f"[DEBUG] 将tools描述附加到现有system消息")
+                trace("[DEBUG] 将tools描述附加到现有system消息")
             modified_messages.append(message)
         
         # 如果没有system消息，创建一个新的
@@ -690,66 +1085,65 @@ Before responding, verify that ALL tool calls use the exact format:
                 "content": tools_description
             }
             modified_messages.insert(0, system_message)
-            debug_print(f"[DEBUG] 创建新的system消息包含tools描述")
+            trace("[DEBUG] 创建新的system消息包含tools描述")
         
         return modified_messages
     
+    def _prepend_tools_to_system_prompt(self, messages: List[Dict[str, Any]], tools_description: str) -> List[Dict[str, Any]]:
+        """稳定前缀模式：tools说明作为system的第一段，后面是原样保留的system各段"""
+        tools_part = {"type": "text", "text": tools_description.lstrip("\n")}
+        if messages and messages[0].get("role") == "system":
+            content = messages[0].get("content", "")
+            if isinstance(content, str):
+                content = [{"type": "text", "text": content}] if content else []
+            messages[0]["content"] = [tools_part] + content
+            trace("[DEBUG] 将tools描述放在现有system消息最前面")
+        else:
+            messages.insert(0, {"role": "system", "content": [tools_part]})
+            trace("[DEBUG] 创建新的system消息包含tools描述")
+        return messages
+    
+    @staticmethod
+    def _system_blocks_to_parts(system_blocks: List[Any]) -> List[Dict[str, Any]]:
+        """将Claude格式的system数组转换为内容数组，保留 cache_control 标记
+        各段之间的换行放在前一段末尾，合并后与普通模式的system文本完全一致"""
+        blocks = [item for item in system_blocks if isinstance(item, dict) and item.get("type") == "text"]
+        parts = []
+        for i, item in enumerate(blocks):
+            text = item.get("text", "")
+            if i < len(blocks) - 1:
+                text += "\n"
+            part = {"type": "text", "text": text}
+            if item.get("cache_control"):
+                part["cache_control"] = item["cache_control"]
+            parts.append(part)
+        return parts
+    
+    @staticmethod
+    def _flatten_content_parts(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """不支持 cache_control 的平台：内容数组合并为纯文本（不修改原消息列表，对冲请求共用）"""
+        flattened = []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, list):
+                message = {**message, "content": "".join(
+                    part.get("text", "") for part in content if isinstance(part, dict)
+                )}
+            flattened.append(message)
+        return flattened
+    
     def _estimate_input_tokens(self, messages: List[Dict[str, Any]]) -> int:
         """估算输入消息的token数量"""
         total_tokens = 0
         for message in messages:
             content = message.get("content", "")
             if isinstance(content, str):
-                total_tokens += self._estimate_text_tokens(content)
+                total_tokens += estimate_text_tokens(content)
             elif isinstance(content, list):
                 for item in content:
                     if isinstance(item, dict) and item.get("type") == "text":
-                        total_tokens += self._estimate_text_tokens(item.get("text", ""))
+                        total_tokens += estimate_text_tokens(item.get("text", ""))
         return total_tokens
-    
-    def _estimate_text_tokens(self, text: str) -> int:
-        """估算文本的token数量（简单估算）"""
-        if not text:
-            return 0
-        
-        import re
-        # 简单的token估算：中文字符约1个token，英文单词约1个token
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', text))
-        # 去掉中文字符后计算英文单词
-        text_without_chinese = re.sub(r'[\u4e00-\u9fff]', '', text)
-        english_words = len(text_without_chinese.split())
-        
-        return chinese_chars + english_words
-    
-    def get_last_routing_result(self):
-        """获取最后一次路由结果"""
-        return getattr(self, 'last_routing_result', None)
-    
-    def get_processed_prompt(self):
-        """获取HOOK处理后的提示词"""
-        return getattr(self, 'processed_prompt', None)
-    
-    def get_processed_headers(self):
-        """获取HOOK处理后发送给大模型的请求头"""
-        return getattr(self, 'processed_headers', None)
-    
-    def get_model_raw_headers(self):
-        """获取大模型返回的原始响应头"""
-        return getattr(self, 'model_raw_headers', None)
-    
-    def get_model_raw_response(self):
-        """获取大模型返回的原始响应体(HOOK处理前)"""
-        return getattr(self, 'model_raw_response', None)
-    
-    def get_token_usage(self):
-        """获取Token使用量"""
-        if hasattr(self, 'streaming_converter') and self.streaming_converter:
-            return {
-                "input_tokens": self.streaming_converter.total_input_tokens,
-                "output_tokens": self.streaming_converter.total_output_tokens,
-                "total_tokens": self.streaming_converter.total_input_tokens + self.streaming_converter.total_output_tokens
-            }
-        return {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
 
 # 全局服务实例
 multi_platform_service = MultiPlatformService()
\ No newline at end of file
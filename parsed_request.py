@@ -0,0 +1,84 @@
+"""
+请求解析模块
+每个代理请求只读取和解析一次请求体，解析结果在日志、KEY验证、路由、格式转换和记录中共享；
+同时保留原始字节，透传模式直接转发，不再重新编码
+"""
+
+from typing import Any, Dict, List, Optional
+
+from fastapi import Request
+
+import fast_json
+
+class ParsedRequest:
+    """解析后的代理请求，请求体的文本和JSON都在首次访问时生成并缓存"""
+
+    __slots__ = ("raw", "content_type", "api_key", "_text", "_data", "_parsed", "parse_error")
+
+    def __init__(self, raw: bytes = b"", content_type: str = "", api_key: str = ""):
+        self.raw = raw                    # 原始请求体字节，透传时直接使用
+        self.content_type = content_type
+        self.api_key = api_key            # Authorization 或 api-key 头中的用户KEY
+        self._text: Optional[str] = None
+        self._data: Optional[Dict[str, Any]] = None
+        self._parsed = False
+        self.parse_error: Optional[str] = None
+
+    @classmethod
+    async def from_request(cls, request: Request) -> "ParsedRequest":
+        """读取请求体和用户KEY"""
+        auth_header = request.headers.get("authorization", "")
+        api_key = ""
+        if auth_header.startswith("Bearer "):
+            api_key = auth_header[7:]  # 移除 "Bearer " 前缀
+        else:
+            api_key = request.headers.get("api-key", "")
+        return cls(await request.body(), request.headers.get("content-type", ""), api_key)
+
+    @property
+    def size(self) -> int:
+        """请求体字节数"""
+        return len(self.raw)
+
+    @property
+    def text(self) -> str:
+        """请求体文本（用于记录）"""
+        if self._text is None:
+            self._text = self.raw.decode("utf-8", errors="replace") if self.raw else ""
+        return self._text
+
+    @property
+    def data(self) -> Optional[Dict[str, Any]]:
+        """请求体JSON，解析失败或不是JSON对象时为None"""
+        if not self._parsed:
+            self._parsed = True
+            if self.raw:
+                try:
+                    data = fast_json.loads(self.raw)
+                    if isinstance(data, dict):
+                        self._data = data
+                    else:
+                        self.parse_error = "请求体不是JSON对象"
+                except (fast_json.JSONDecodeError, UnicodeDecodeError) as e:
+                    self.parse_error = str(e)
+        return self._data
+
+    @property
+    def is_json(self) -> bool:
+        return self.content_type.startswith("application/json")
+
+    @property
+    def model(self) -> str:
+        return (self.data or {}).get("model", "")
+
+    @property
+    def messages(self) -> List[Dict[str, Any]]:
+        return (self.data or {}).get("messages", [])
+
+    @property
+    def stream(self) -> bool:
+        return bool((self.data or {}).get("stream", False))
+
+    def extra_params(self) -> Dict[str, Any]:
+        """messages、model、stream 以外的请求参数"""
+        return {k: v for k, v in (self.data or {}).items() if k not in ("messages", "model", "stream")}
@@ -4,13 +4,16 @@
 """
 
 import httpx
-import json
+import time
 import asyncio
-from typing import Dict, List, Any, Optional, AsyncGenerator
-from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, AsyncGenerator, Iterable
+from dataclasses import dataclass, field
 from enum import Enum
 import logging
 
+import fast_json
+from tracing import trace
+
 # 配置日志
 import os
 DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
@@ -18,10 +21,29 @@ DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
 logging.basicConfig(level=logging.DEBUG if DEBUG_MODE else logging.INFO)
 logger = logging.getLogger(__name__)
 
-def debug_print(*args, **kwargs):
-    """统一的DEBUG输出函数，只在DEBUG_MODE启用时输出"""
-    if DEBUG_MODE:
-        print(*args, **kwargs)
+# 上游连接池配置（每个平台一个长连接客户端）
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '100'))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_KEEPALIVE_CONNECTIONS', '20'))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv('UPSTREAM_KEEPALIVE_EXPIRY', '30'))
+UPSTREAM_HTTP2 = os.getenv('UPSTREAM_HTTP2', 'false').lower() == 'true'
+
+# 并发获取各平台模型列表/测试连接的超时配置
+PLATFORM_CALL_TIMEOUT = float(os.getenv('PLATFORM_CALL_TIMEOUT', '10'))        # 单个平台超时（秒）
+PLATFORM_FANOUT_DEADLINE = float(os.getenv('PLATFORM_FANOUT_DEADLINE', '15'))  # 所有平台的总截止时间（秒）
+PLATFORM_RESULT_CACHE_TTL = float(os.getenv('PLATFORM_RESULT_CACHE_TTL', '30'))  # 结果缓存时间（秒）
+
+# 连接参数变化后，旧连接池等待进行中的请求结束再关闭，最长等待时间（秒）
+PLATFORM_RETIRE_GRACE = float(os.getenv('PLATFORM_RETIRE_GRACE', '1800'))
+
+# HTTP/2 需要可选依赖 h2（pip install httpx[http2]）
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class PlatformError(Exception):
+    """平台调用失败（未配置、上游返回错误状态码等）"""
 
 class PlatformType(Enum):
     """平台类型枚举"""
@@ -40,6 +62,16 @@ class PlatformConfig:
     base_url: str = ""
     enabled: bool = True
     timeout: int = 30
+    # 连接池参数
+    max_connections: int = UPSTREAM_MAX_CONNECTIONS
+    max_keepalive_connections: int = UPSTREAM_MAX_KEEPALIVE_CONNECTIONS
+    keepalive_expiry: float = UPSTREAM_KEEPALIVE_EXPIRY
+    http2: bool = UPSTREAM_HTTP2
+
+    def pool_options(self) -> tuple:
+        """影响连接池的配置项，相同则可以复用已有连接池"""
+        return (self.timeout, self.max_connections, self.max_keepalive_connections,
+                self.keepalive_expiry, self.http2)
 
 @dataclass
 class ModelInfo:
@@ -50,15 +82,86 @@ class ModelInfo:
     enabled: bool = True
     description: str = ""
 
+@dataclass
+class PlatformProbeResult:
+    """单个平台的模型列表获取结果（同时作为连接测试结果）"""
+    platform_type: PlatformType
+    ok: bool
+    latency_ms: int
+    models: List[ModelInfo] = field(default_factory=list)
+    error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "platform": self.platform_type.value,
+            "ok": self.ok,
+            "latency_ms": self.latency_ms,
+            "model_count": len(self.models),
+            "error": self.error
+        }
+
 class PlatformClient:
     """平台客户端基类"""
     
     def __init__(self, config: PlatformConfig):
         self.config = config
+        self.client: Optional[httpx.AsyncClient] = None  # 平台共享的长连接客户端
+        self.active_requests = 0  # 正在使用连接池的转发请求数
+        self._idle: Optional[asyncio.Event] = None
+    
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """获取平台共享的长连接客户端（未创建或已关闭时自动创建）"""
+        if self.client is None or self.client.is_closed:
+            self.client = self._create_http_client()
+        return self.client
+    
+    def acquire_http_client(self) -> httpx.AsyncClient:
+        """转发请求开始时获取连接池并登记，请求结束（包括流式响应读完或取消）后必须调用 release_http_client"""
+        self.active_requests += 1
+        return self.http_client
+    
+    def release_http_client(self):
+        """转发请求结束，归还 acquire_http_client 的登记"""
+        self.active_requests -= 1
+        if self.active_requests <= 0 and self._idle is not None:
+            self._idle.set()
+    
+    async def wait_idle(self, timeout: float) -> bool:
+        """等待进行中的转发请求全部结束，超时返回False"""
+        if self.active_requests <= 0:
+            return True
+        self._idle = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._idle = None
+    
+    def _create_http_client(self) -> httpx.AsyncClient:
+        """按平台配置创建带连接池的客户端"""
+        http2 = self.config.http2
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning(f"⚠️ [{self.config.platform_type.value}] 未安装h2，HTTP/2已禁用")
+            http2 = False
+        
+        limits = httpx.Limits(
+            max_connections=self.config.max_connections,
+            max_keepalive_connections=self.config.max_keepalive_connections,
+            keepalive_expiry=self.config.keepalive_expiry
+        )
+        return httpx.AsyncClient(timeout=self.config.timeout, limits=limits, http2=http2)
+    
+    async def aclose(self):
+        """关闭连接池"""
+        if self.client is not None and not self.client.is_closed:
+            await self.client.aclose()
         self.client = None
     
     async def get_models(self) -> List[ModelInfo]:
-        """获取可用模型列表"""
+        """获取可用模型列表；未配置或请求失败时抛出异常，由调用方记录具体错误"""
         raise NotImplementedError
     
     async def chat_completion(
@@ -92,83 +195,82 @@ class DashScopeClient(PlatformClient):
         logger.info("🔍 [DashScope] 开始获取模型列表...")
         
         if not self.config.api_key:
-            logger.warning("⚠️ [DashScope] API Key未配置，跳过获取模型")
-            return []
+            logger.warning("⚠️ [DashScope] API Key未配置，无法获取模型")
+            raise PlatformError("API Key未配置")
         
         try:
             logger.info(f"🌐 [DashScope] 请求URL: {self.base_url}/compatible-mode/v1/models")
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                response = await client.get(
-                    f"{self.base_url}/compatible-mode/v1/models",
-                    headers={
-                        "Authorization": f"Bearer {self.config.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                )
+            client = self.http_client
+            response = await client.get(
+                f"{self.base_url}/compatible-mode/v1/models",
+                headers={
+                    "Authorization": f"Bearer {self.config.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
                 
-                logger.info(f"📡 [DashScope] API响应状态: {response.status_code}")
+            logger.info(f"📡 [DashScope] API响应状态: {response.status_code}")
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
+            if response.status_code == 200:
+                data = response.json()
+                models = []
                     
-                    logger.info(f"📋 [DashScope] 响应数据: {json.dumps(data, indent=2, ensure_ascii=False)}")
+                trace("📋 [DashScope] 响应数据: %s", data)
                     
-                    # 解析模型列表
-                    if "output" in data and "models" in data["output"]:
-                        for model in data["output"]["models"]:
-                            model_name = model.get("model_name", "")
-                            model_info = ModelInfo(
-                                id=model_name,
-                                name=model_name,
-                                platform=PlatformType.DASHSCOPE,
-                                description=f"容量: {model.get('base_capacity', 1)}"
-                            )
-                            models.append(model_info)
-    
-                    elif "data" in data:
-                        # 兼容旧格式
-                        for model in data["data"]:
-                            model_info = ModelInfo(
-                                id=model.get("id", ""),
-                                name=model.get("name", model.get("id", "")),
-                                platform=PlatformType.DASHSCOPE,
-                                description=model.get("description", "")
-                            )
-                            models.append(model_info)
+                # 解析模型列表
+                if "output" in data and "models" in data["output"]:
+                    for model in data["output"]["models"]:
+                        model_name = model.get("model_name", "")
+                        model_info = ModelInfo(
+                            id=model_name,
+                            name=model_name,
+                            platform=PlatformType.DASHSCOPE,
+                            description=f"容量: {model.get('base_capacity', 1)}"
+                        )
+                        models.append(model_info)
     
-                    else:
-                        # 如果API返回格式不匹配，添加一些默认的通义千问模型
-                        logger.info("⚠️ [DashScope] API响应格式不匹配，使用默认模型列表")
-                        default_models = [
-                            {"id": "qwen-plus", "name": "qwen-plus", "description": "通义千问增强版"},
-                            {"id": "qwen-turbo", "name": "qwen-turbo", "description": "通义千问快速版"},
-                            {"id": "qwen-max", "name": "qwen-max", "description": "通义千问最强版"},
-                            {"id": "qwen-coder", "name": "qwen-coder", "description": "专门用于代码生成和优化"},
-                            {"id": "qwen3-coder-plus", "name": "qwen3-coder-plus", "description": "通义千问3代码增强版"},
-                            {"id": "qwen2.5-coder-instruct", "name": "qwen2.5-coder-instruct", "description": "通义千问2.5代码指令版"},
-                            {"id": "qwen2-72b-instruct", "name": "qwen2-72b-instruct", "description": "通义千问2 72B指令版"},
-                        ]
+                elif "data" in data:
+                    # 兼容旧格式
+                    for model in data["data"]:
+                        model_info = ModelInfo(
+                            id=model.get("id", ""),
+                            name=model.get("name", model.get("id", "")),
+                            platform=PlatformType.DASHSCOPE,
+                            description=model.get("description", "")
+                        )
+                        models.append(model_info)
+    
+                else:
+                    # 如果API返回格式不匹配，添加一些默认的通义千问模型
+                    logger.info("⚠️ [DashScope] API响应格式不匹配，使用默认模型列表")
+                    default_models = [
+                        {"id": "qwen-plus", "name": "qwen-plus", "description": "通义千问增强版"},
+                        {"id": "qwen-turbo", "name": "qwen-turbo", "description": "通义千问快速版"},
+                        {"id": "qwen-max", "name": "qwen-max", "description": "通义千问最强版"},
+                        {"id": "qwen-coder", "name": "qwen-coder", "description": "专门用于代码生成和优化"},
+                        {"id": "qwen3-coder-plus", "name": "qwen3-coder-plus", "description": "通义千问3代码增强版"},
+                        {"id": "qwen2.5-coder-instruct", "name": "qwen2.5-coder-instruct", "description": "通义千问2.5代码指令版"},
+                        {"id": "qwen2-72b-instruct", "name": "qwen2-72b-instruct", "description": "通义千问2 72B指令版"},
+                    ]
                         
-                        for model in default_models:
-                            model_info = ModelInfo(
-                                id=model["id"],
-                                name=model["name"],
-                                platform=PlatformType.DASHSCOPE,
-                                description=model["description"]
-                            )
-                            models.append(model_info)
+                    for model in default_models:
+                        model_info = ModelInfo(
+                            id=model["id"],
+                            name=model["name"],
+                            platform=PlatformType.DASHSCOPE,
+                            description=model["description"]
+                        )
+                        models.append(model_info)
             
                     
-                    logger.info(f"✅ [DashScope] 成功获取 {len(models)} 个模型")
-                    return models
-                else:
-                    logger.error(f"❌ [DashScope] API错误: {response.status_code} - {response.text}")
-                    return []
+                logger.info(f"✅ [DashScope] 成功获取 {len(models)} 个模型")
+                return models
+            else:
+                raise PlatformError(f"HTTP {response.status_code}: {response.text[:200]}")
                     
         except Exception as e:
             logger.error(f"❌ [DashScope] 获取模型失败: {e}")
-            return []
+            raise
     
     async def chat_completion(
         self, 
@@ -179,7 +281,7 @@ class DashScopeClient(PlatformClient):
     ) -> AsyncGenerator[str, None]:
         """通义千问聊天补全"""
         if not self.config.api_key:
-            yield json.dumps({"error": "API key not configured"})
+            yield fast_json.dumps({"error": "API key not configured"})
             return
         
         url = f"{self.base_url}/compatible-mode/v1/chat/completions"
@@ -196,34 +298,34 @@ class DashScopeClient(PlatformClient):
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                if stream:
-                    async with client.stream(
-                        "POST", url, headers=headers, json=payload
-                    ) as response:
-                        if response.status_code == 200:
-                            async for line in response.aiter_lines():
-                                if line.strip():
-                                    if line.startswith("data: "):
-                                        data = line[6:]
-                                        if data.strip() == "[DONE]":
-                                            break
-                                        yield data
-                                    else:
-                                        yield line
-                        else:
-                            error_msg = await response.aread()
-                            yield json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
-                else:
-                    response = await client.post(url, headers=headers, json=payload)
+            client = self.http_client
+            if stream:
+                async with client.stream(
+                    "POST", url, headers=headers, json=payload
+                ) as response:
                     if response.status_code == 200:
-                        yield response.text
+                        async for line in response.aiter_lines():
+                            if line.strip():
+                                if line.startswith("data: "):
+                                    data = line[6:]
+                                    if data.strip() == "[DONE]":
+                                        break
+                                    yield data
+                                else:
+                                    yield line
                     else:
-                        yield json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
+                        error_msg = await response.aread()
+                        yield fast_json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
+            else:
+                response = await client.post(url, headers=headers, json=payload)
+                if response.status_code == 200:
+                    yield response.text
+                else:
+                    yield fast_json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
                         
         except Exception as e:
             logger.error(f"DashScope chat completion error: {e}")
-            yield json.dumps({"error": f"Request failed: {str(e)}"})
+            yield fast_json.dumps({"error": f"Request failed: {str(e)}"})
 
 class OpenRouterClient(PlatformClient):
     """OpenRouter客户端"""
@@ -235,39 +337,38 @@ class OpenRouterClient(PlatformClient):
     async def get_models(self) -> List[ModelInfo]:
         """获取OpenRouter模型列表"""
         if not self.config.api_key:
-            return []
+            raise PlatformError("API Key未配置")
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                response = await client.get(
-                    f"{self.base_url}/models",
-                    headers={
-                        "Authorization": f"Bearer {self.config.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                )
+            client = self.http_client
+            response = await client.get(
+                f"{self.base_url}/models",
+                headers={
+                    "Authorization": f"Bearer {self.config.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
+            if response.status_code == 200:
+                data = response.json()
+                models = []
                     
-                    if "data" in data:
-                        for model in data["data"]:
-                            models.append(ModelInfo(
-                                id=model.get("id", ""),
-                                name=model.get("name", model.get("id", "")),
-                                platform=PlatformType.OPENROUTER,
-                                description=model.get("description", "")
-                            ))
+                if "data" in data:
+                    for model in data["data"]:
+                        models.append(ModelInfo(
+                            id=model.get("id", ""),
+                            name=model.get("name", model.get("id", "")),
+                            platform=PlatformType.OPENROUTER,
+                            description=model.get("description", "")
+                        ))
                     
-                    return models
-                else:
-                    logger.error(f"OpenRouter API error: {response.status_code} - {response.text}")
-                    return []
+                return models
+            else:
+                raise PlatformError(f"HTTP {response.status_code}: {response.text[:200]}")
                     
         except Exception as e:
             logger.error(f"Failed to get OpenRouter models: {e}")
-            return []
+            raise
     
     async def chat_completion(
         self, 
@@ -278,7 +379,7 @@ class OpenRouterClient(PlatformClient):
     ) -> AsyncGenerator[str, None]:
         """OpenRouter聊天补全"""
         if not self.config.api_key:
-            yield json.dumps({"error": "API key not configured"})
+            yield fast_json.dumps({"error": "API key not configured"})
             return
         
         url = f"{self.base_url}/chat/completions"
@@ -295,29 +396,29 @@ class OpenRouterClient(PlatformClient):
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                if stream:
-                    async with client.stream(
-                        "POST", url, headers=headers, json=payload
-                    ) as response:
-                        if response.status_code == 200:
-                            async for line in response.aiter_lines():
-                                if line.strip():
-                                    # 直接 yield 原始行，让转换器处理格式
-                                    yield line
-                        else:
-                            error_msg = await response.aread()
-                            yield json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
-                else:
-                    response = await client.post(url, headers=headers, json=payload)
+            client = self.http_client
+            if stream:
+                async with client.stream(
+                    "POST", url, headers=headers, json=payload
+                ) as response:
                     if response.status_code == 200:
-                        yield response.text
+                        async for line in response.aiter_lines():
+                            if line.strip():
+                                # 直接 yield 原始行，让转换器处理格式
+                                yield line
                     else:
-                        yield json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
+                        error_msg = await response.aread()
+                        yield fast_json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
+            else:
+                response = await client.post(url, headers=headers, json=payload)
+                if response.status_code == 200:
+                    yield response.text
+                else:
+                    yield fast_json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
                         
         except Exception as e:
             logger.error(f"OpenRouter chat completion error: {e}")
-            yield json.dumps({"error": f"Request failed: {str(e)}"})
+            yield fast_json.dumps({"error": f"Request failed: {str(e)}"})
 
 class OllamaClient(PlatformClient):
     """Ollama客户端"""
@@ -332,37 +433,36 @@ class OllamaClient(PlatformClient):
         logger.info(f"🌐 [Ollama] 请求URL: {self.base_url}/api/tags")
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                response = await client.get(f"{self.base_url}/api/tags")
+            client = self.http_client
+            response = await client.get(f"{self.base_url}/api/tags")
                 
-                logger.info(f"📡 [Ollama] API响应状态: {response.status_code}")
+            logger.info(f"📡 [Ollama] API响应状态: {response.status_code}")
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
+            if response.status_code == 200:
+                data = response.json()
+                models = []
                     
-                    logger.info(f"📋 [Ollama] 响应数据: {json.dumps(data, indent=2, ensure_ascii=False)}")
+                trace("📋 [Ollama] 响应数据: %s", data)
                     
-                    if "models" in data:
-                        for model in data["models"]:
-                            model_info = ModelInfo(
-                                id=model.get("name", ""),
-                                name=model.get("name", ""),
-                                platform=PlatformType.OLLAMA,
-                                description=f"Size: {model.get('size', 'Unknown')}"
-                            )
-                            models.append(model_info)
+                if "models" in data:
+                    for model in data["models"]:
+                        model_info = ModelInfo(
+                            id=model.get("name", ""),
+                            name=model.get("name", ""),
+                            platform=PlatformType.OLLAMA,
+                            description=f"Size: {model.get('size', 'Unknown')}"
+                        )
+                        models.append(model_info)
             
                     
-                    logger.info(f"✅ [Ollama] 成功获取 {len(models)} 个模型")
-                    return models
-                else:
-                    logger.error(f"❌ [Ollama] API错误: {response.status_code} - {response.text}")
-                    return []
+                logger.info(f"✅ [Ollama] 成功获取 {len(models)} 个模型")
+                return models
+            else:
+                raise PlatformError(f"HTTP {response.status_code}: {response.text[:200]}")
                     
         except Exception as e:
             logger.error(f"❌ [Ollama] 获取模型失败: {e}")
-            return []
+            raise
     
     async def chat_completion(
         self, 
@@ -381,61 +481,61 @@ class OllamaClient(PlatformClient):
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                if stream:
-                    async with client.stream(
-                        "POST", url, json=payload
-                    ) as response:
-                        if response.status_code == 200:
-                            async for line in response.aiter_lines():
-                                if line.strip():
-                                    try:
-                                        data = json.loads(line)
-                                        # 转换Ollama格式到OpenAI格式
-                                        openai_chunk = self._convert_ollama_to_openai(data)
-                                        yield json.dumps(openai_chunk)
-                                        
-                                        if data.get("done", False):
-                                            break
-                                    except json.JSONDecodeError:
-                                        continue
-                        else:
-                            error_msg = await response.aread()
-                            yield json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
-                else:
-                    # 非流式模式需要手动收集所有响应
-                    full_response = ""
-                    async with client.stream("POST", url, json=payload) as response:
+            client = self.http_client
+            if stream:
+                async with client.stream(
+                    "POST", url, json=payload
+                ) as response:
+                    if response.status_code == 200:
                         async for line in response.aiter_lines():
                             if line.strip():
                                 try:
-                                    data = json.loads(line)
-                                    if "message" in data and "content" in data["message"]:
-                                        full_response += data["message"]["content"]
+                                    data = fast_json.loads(line)
+                                    # 转换Ollama格式到OpenAI格式
+                                    openai_chunk = self._convert_ollama_to_openai(data)
+                                    yield fast_json.dumps(openai_chunk)
+                                        
                                     if data.get("done", False):
                                         break
-                                except json.JSONDecodeError:
+                                except fast_json.JSONDecodeError:
                                     continue
+                    else:
+                        error_msg = await response.aread()
+                        yield fast_json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
+            else:
+                # 非流式模式需要手动收集所有响应
+                full_response = ""
+                async with client.stream("POST", url, json=payload) as response:
+                    async for line in response.aiter_lines():
+                        if line.strip():
+                            try:
+                                data = fast_json.loads(line)
+                                if "message" in data and "content" in data["message"]:
+                                    full_response += data["message"]["content"]
+                                if data.get("done", False):
+                                    break
+                            except fast_json.JSONDecodeError:
+                                continue
                     
-                    openai_response = {
-                        "id": "chatcmpl-ollama",
-                        "object": "chat.completion",
-                        "created": int(asyncio.get_event_loop().time()),
-                        "model": model,
-                        "choices": [{
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": full_response
-                            },
-                            "finish_reason": "stop"
-                        }]
-                    }
-                    yield json.dumps(openai_response)
+                openai_response = {
+                    "id": "chatcmpl-ollama",
+                    "object": "chat.completion",
+                    "created": int(asyncio.get_event_loop().time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": full_response
+                        },
+                        "finish_reason": "stop"
+                    }]
+                }
+                yield fast_json.dumps(openai_response)
                         
         except Exception as e:
             logger.error(f"Ollama chat completion error: {e}")
-            yield json.dumps({"error": f"Request failed: {str(e)}"})
+            yield fast_json.dumps({"error": f"Request failed: {str(e)}"})
     
     def _convert_ollama_to_openai(self, ollama_data: Dict[str, Any]) -> Dict[str, Any]:
         """将Ollama响应格式转换为OpenAI格式"""
@@ -469,73 +569,72 @@ class SiliconFlowClient(PlatformClient):
         logger.info("🔍 [SiliconFlow] 开始获取模型列表...")
         
         if not self.config.api_key:
-            logger.warning("⚠️ [SiliconFlow] API Key未配置，跳过获取模型")
-            return []
+            logger.warning("⚠️ [SiliconFlow] API Key未配置，无法获取模型")
+            raise PlatformError("API Key未配置")
         
         try:
             logger.info(f"🌐 [SiliconFlow] 请求URL: {self.base_url}/v1/models")
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                response = await client.get(
-                    f"{self.base_url}/v1/models",
-                    headers={
-                        "Authorization": f"Bearer {self.config.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                )
+            client = self.http_client
+            response = await client.get(
+                f"{self.base_url}/v1/models",
+                headers={
+                    "Authorization": f"Bearer {self.config.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
                 
-                logger.info(f"📡 [SiliconFlow] API响应状态: {response.status_code}")
+            logger.info(f"📡 [SiliconFlow] API响应状态: {response.status_code}")
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
+            if response.status_code == 200:
+                data = response.json()
+                models = []
                     
-                    logger.info(f"📋 [SiliconFlow] 响应数据: {json.dumps(data, indent=2, ensure_ascii=False)}")
+                trace("📋 [SiliconFlow] 响应数据: %s", data)
                     
-                    # 解析模型列表
-                    if "data" in data:
-                        for model in data["data"]:
-                            model_id = model.get("id", "")
-                            model_name = model.get("name", model_id)
+                # 解析模型列表
+                if "data" in data:
+                    for model in data["data"]:
+                        model_id = model.get("id", "")
+                        model_name = model.get("name", model_id)
                             
-                            model_info = ModelInfo(
-                                id=model_id,
-                                name=model_name,
-                                platform=PlatformType.SILICONFLOW,
-                                description=model.get("description", f"硅基流动模型: {model_id}")
-                            )
-                            models.append(model_info)
-                    else:
-                        # 如果API返回格式不匹配，添加一些默认的硅基流动模型
-                        logger.info("⚠️ [SiliconFlow] API响应格式不匹配，使用默认模型列表")
-                        default_models = [
-                            {"id": "Qwen/QwQ-32B", "name": "QwQ-32B", "description": "千问推理模型32B版本"},
-                            {"id": "Qwen/Qwen2.5-72B-Instruct", "name": "Qwen2.5-72B-Instruct", "description": "千问2.5 72B指令版"},
-                            {"id": "Qwen/Qwen2.5-32B-Instruct", "name": "Qwen2.5-32B-Instruct", "description": "千问2.5 32B指令版"},
-                            {"id": "Qwen/Qwen2.5-14B-Instruct", "name": "Qwen2.5-14B-Instruct", "description": "千问2.5 14B指令版"},
-                            {"id": "Qwen/Qwen2.5-7B-Instruct", "name": "Qwen2.5-7B-Instruct", "description": "千问2.5 7B指令版"},
-                            {"id": "meta-llama/Llama-3.1-70B-Instruct", "name": "Llama-3.1-70B-Instruct", "description": "Llama 3.1 70B指令版"},
-                            {"id": "meta-llama/Llama-3.1-8B-Instruct", "name": "Llama-3.1-8B-Instruct", "description": "Llama 3.1 8B指令版"},
-                            {"id": "deepseek-ai/DeepSeek-V2.5", "name": "DeepSeek-V2.5", "description": "深度求索V2.5模型"},
-                        ]
+                        model_info = ModelInfo(
+                            id=model_id,
+                            name=model_name,
+                            platform=PlatformType.SILICONFLOW,
+                            description=model.get("description", f"硅基流动模型: {model_id}")
+                        )
+                        models.append(model_info)
+                else:
+                    # 如果API返回格式不匹配，添加一些默认的硅基流动模型
+                    logger.info("⚠️ [SiliconFlow] API响应格式不匹配，使用默认模型列表")
+                    default_models = [
+                        {"id": "Qwen/QwQ-32B", "name": "QwQ-32B", "description": "千问推理模型32B版本"},
+                        {"id": "Qwen/Qwen2.5-72B-Instruct", "name": "Qwen2.5-72B-Instruct", "description": "千问2.5 72B指令版"},
+                        {"id": "Qwen/Qwen2.5-32B-Instruct", "name": "Qwen2.5-32B-Instruct", "description": "千问2.5 32B指令版"},
+                        {"id": "Qwen/Qwen2.5-14B-Instruct", "name": "Qwen2.5-14B-Instruct", "description": "千问2.5 14B指令版"},
+                        {"id": "Qwen/Qwen2.5-7B-Instruct", "name": "Qwen2.5-7B-Instruct", "description": "千问2.5 7B指令版"},
+                        {"id": "meta-llama/Llama-3.1-70B-Instruct", "name": "Llama-3.1-70B-Instruct", "description": "Llama 3.1 70B指令版"},
+                        {"id": "meta-llama/Llama-3.1-8B-Instruct", "name": "Llama-3.1-8B-Instruct", "description": "Llama 3.1 8B指令版"},
+                        {"id": "deepseek-ai/DeepSeek-V2.5", "name": "DeepSeek-V2.5", "description": "深度求索V2.5模型"},
+                    ]
                         
-                        for model in default_models:
-                            model_info = ModelInfo(
-                                id=model["id"],
-                                name=model["name"],
-                                platform=PlatformType.SILICONFLOW,
-                                description=model["description"]
-                            )
-                            models.append(model_info)
+                    for model in default_models:
+                        model_info = ModelInfo(
+                            id=model["id"],
+                            name=model["name"],
+                            platform=PlatformType.SILICONFLOW,
+                            description=model["description"]
+                        )
+                        models.append(model_info)
                     
-                    logger.info(f"✅ [SiliconFlow] 成功获取 {len(models)} 个模型")
-                    return models
-                else:
-                    logger.error(f"❌ [SiliconFlow] API错误: {response.status_code} - {response.text}")
-                    return []
+                logger.info(f"✅ [SiliconFlow] 成功获取 {len(models)} 个模型")
+                return models
+            else:
+                raise PlatformError(f"HTTP {response.status_code}: {response.text[:200]}")
                     
         except Exception as e:
             logger.error(f"❌ [SiliconFlow] 获取模型失败: {e}")
-            return []
+            raise
     
     async def chat_completion(
         self, 
@@ -546,7 +645,7 @@ class SiliconFlowClient(PlatformClient):
     ) -> AsyncGenerator[str, None]:
         """硅基流动聊天补全"""
         if not self.config.api_key:
-            yield json.dumps({"error": "API key not configured"})
+            yield fast_json.dumps({"error": "API key not configured"})
             return
         
         url = f"{self.base_url}/v1/chat/completions"
@@ -563,34 +662,34 @@ class SiliconFlowClient(PlatformClient):
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                if stream:
-                    async with client.stream(
-                        "POST", url, headers=headers, json=payload
-                    ) as response:
-                        if response.status_code == 200:
-                            async for line in response.aiter_lines():
-                                if line.strip():
-                                    if line.startswith("data: "):
-                                        data = line[6:]
-                                        if data.strip() == "[DONE]":
-                                            break
-                                        yield data
-                                    else:
-                                        yield line
-                        else:
-                            error_msg = await response.aread()
-                            yield json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
-                else:
-                    response = await client.post(url, headers=headers, json=payload)
+            client = self.http_client
+            if stream:
+                async with client.stream(
+                    "POST", url, headers=headers, json=payload
+                ) as response:
                     if response.status_code == 200:
-                        yield response.text
+                        async for line in response.aiter_lines():
+                            if line.strip():
+                                if line.startswith("data: "):
+                                    data = line[6:]
+                                    if data.strip() == "[DONE]":
+                                        break
+                                    yield data
+                                else:
+                                    yield line
                     else:
-                        yield json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
+                        error_msg = await response.aread()
+                        yield fast_json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
+            else:
+                response = await client.post(url, headers=headers, json=payload)
+                if response.status_code == 200:
+                    yield response.text
+                else:
+                    yield fast_json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
                         
         except Exception as e:
             logger.error(f"SiliconFlow chat completion error: {e}")
-            yield json.dumps({"error": f"Request failed: {str(e)}"})
+            yield fast_json.dumps({"error": f"Request failed: {str(e)}"})
 
 class OpenAICompatibleClient(PlatformClient):
     """OpenAI兼容客户端"""
@@ -607,12 +706,12 @@ class OpenAICompatibleClient(PlatformClient):
         logger.info("🔍 [OpenAI Compatible] 开始获取模型列表...")
         
         if not self.base_url:
-            logger.warning("⚠️ [OpenAI Compatible] Base URL未配置，跳过获取模型")
-            return []
+            logger.warning("⚠️ [OpenAI Compatible] Base URL未配置，无法获取模型")
+            raise PlatformError("Base URL未配置")
         
         if not self.config.api_key:
-            logger.warning("⚠️ [OpenAI Compatible] API Key未配置，跳过获取模型")
-            return []
+            logger.warning("⚠️ [OpenAI Compatible] API Key未配置，无法获取模型")
+            raise PlatformError("API Key未配置")
         
         try:
             # 确保URL以/结尾
@@ -620,62 +719,61 @@ class OpenAICompatibleClient(PlatformClient):
             url = f"{base_url}/v1/models"
             
             logger.info(f"🌐 [OpenAI Compatible] 请求URL: {url}")
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                response = await client.get(
-                    url,
-                    headers={
-                        "Authorization": f"Bearer {self.config.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                )
+            client = self.http_client
+            response = await client.get(
+                url,
+                headers={
+                    "Authorization": f"Bearer {self.config.api_key}",
+                    "Content-Type": "application/json"
+                }
+            )
                 
-                logger.info(f"📡 [OpenAI Compatible] API响应状态: {response.status_code}")
+            logger.info(f"📡 [OpenAI Compatible] API响应状态: {response.status_code}")
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
+            if response.status_code == 200:
+                data = response.json()
+                models = []
                     
-                    logger.info(f"📋 [OpenAI Compatible] 响应数据: {json.dumps(data, indent=2, ensure_ascii=False)}")
+                trace("📋 [OpenAI Compatible] 响应数据: %s", data)
                     
-                    # 解析模型列表
-                    if "data" in data:
-                        for model in data["data"]:
-                            model_id = model.get("id", "")
-                            model_name = model.get("name", model_id)
+                # 解析模型列表
+                if "data" in data:
+                    for model in data["data"]:
+                        model_id = model.get("id", "")
+                        model_name = model.get("name", model_id)
                             
-                            model_info = ModelInfo(
-                                id=model_id,
-                                name=model_name,
-                                platform=PlatformType.OPENAI_COMPATIBLE,
-                                description=model.get("description", f"OpenAI兼容模型: {model_id}")
-                            )
-                            models.append(model_info)
+                        model_info = ModelInfo(
+                            id=model_id,
+                            name=model_name,
+                            platform=PlatformType.OPENAI_COMPATIBLE,
+                            description=model.get("description", f"OpenAI兼容模型: {model_id}")
+                        )
+                        models.append(model_info)
+                else:
+                    # 如果API返回格式不匹配，尝试直接使用响应数据
+                    logger.info("⚠️ [OpenAI Compatible] API响应格式不匹配，尝试直接解析")
+                    if isinstance(data, list):
+                        for model in data:
+                            if isinstance(model, dict):
+                                model_id = model.get("id", str(model))
+                                model_info = ModelInfo(
+                                    id=model_id,
+                                    name=model.get("name", model_id),
+                                    platform=PlatformType.OPENAI_COMPATIBLE,
+                                    description=model.get("description", f"OpenAI兼容模型: {model_id}")
+                                )
+                                models.append(model_info)
                     else:
-                        # 如果API返回格式不匹配，尝试直接使用响应数据
-                        logger.info("⚠️ [OpenAI Compatible] API响应格式不匹配，尝试直接解析")
-                        if isinstance(data, list):
-                            for model in data:
-                                if isinstance(model, dict):
-                                    model_id = model.get("id", str(model))
-                                    model_info = ModelInfo(
-                                        id=model_id,
-                                        name=model.get("name", model_id),
-                                        platform=PlatformType.OPENAI_COMPATIBLE,
-                                        description=model.get("description", f"OpenAI兼容模型: {model_id}")
-                                    )
-                                    models.append(model_info)
-                        else:
-                            logger.warning("⚠️ [OpenAI Compatible] 无法解析模型数据，请检查API响应格式")
+                        logger.warning("⚠️ [OpenAI Compatible] 无法解析模型数据，请检查API响应格式")
                     
-                    logger.info(f"✅ [OpenAI Compatible] 成功获取 {len(models)} 个模型")
-                    return models
-                else:
-                    logger.error(f"❌ [OpenAI Compatible] API错误: {response.status_code} - {response.text}")
-                    return []
+                logger.info(f"✅ [OpenAI Compatible] 成功获取 {len(models)} 个模型")
+                return models
+            else:
+                raise PlatformError(f"HTTP {response.status_code}: {response.text[:200]}")
                     
         except Exception as e:
             logger.error(f"❌ [OpenAI Compatible] 获取模型失败: {e}")
-            return []
+            raise
     
     async def chat_completion(
         self, 
@@ -686,11 +784,11 @@ class OpenAICompatibleClient(PlatformClient):
     ) -> AsyncGenerator[str, None]:
         """OpenAI兼容聊天补全"""
         if not self.base_url:
-            yield json.dumps({"error": "Base URL not configured"})
+            yield fast_json.dumps({"error": "Base URL not configured"})
             return
         
         if not self.config.api_key:
-            yield json.dumps({"error": "API key not configured"})
+            yield fast_json.dumps({"error": "API key not configured"})
             return
         
         # 确保URL以/结尾
@@ -710,34 +808,34 @@ class OpenAICompatibleClient(PlatformClient):
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                if stream:
-                    async with client.stream(
-                        "POST", url, headers=headers, json=payload
-                    ) as response:
-                        if response.status_code == 200:
-                            async for line in response.aiter_lines():
-                                if line.strip():
-                                    if line.startswith("data: "):
-                                        data = line[6:]
-                                        if data.strip() == "[DONE]":
-                                            break
-                                        yield data
-                                    else:
-                                        yield line
-                        else:
-                            error_msg = await response.aread()
-                            yield json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
-                else:
-                    response = await client.post(url, headers=headers, json=payload)
+            client = self.http_client
+            if stream:
+                async with client.stream(
+                    "POST", url, headers=headers, json=payload
+                ) as response:
                     if response.status_code == 200:
-                        yield response.text
+                        async for line in response.aiter_lines():
+                            if line.strip():
+                                if line.startswith("data: "):
+                                    data = line[6:]
+                                    if data.strip() == "[DONE]":
+                                        break
+                                    yield data
+                                else:
+                                    yield line
                     else:
-                        yield json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
+                        error_msg = await response.aread()
+                        yield fast_json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
+            else:
+                response = await client.post(url, headers=headers, json=payload)
+                if response.status_code == 200:
+                    yield response.text
+                else:
+                    yield fast_json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
                         
         except Exception as e:
             logger.error(f"OpenAI Compatible chat completion error: {e}")
-            yield json.dumps({"error": f"Request failed: {str(e)}"})
+            yield fast_json.dumps({"error": f"Request failed: {str(e)}"})
 
 class LMStudioClient(PlatformClient):
     """LMStudio客户端"""
@@ -749,30 +847,29 @@ class LMStudioClient(PlatformClient):
     async def get_models(self) -> List[ModelInfo]:
         """获取LMStudio模型列表"""
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                response = await client.get(f"{self.base_url}/v1/models")
+            client = self.http_client
+            response = await client.get(f"{self.base_url}/v1/models")
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    models = []
+            if response.status_code == 200:
+                data = response.json()
+                models = []
                     
-                    if "data" in data:
-                        for model in data["data"]:
-                            models.append(ModelInfo(
-                                id=model.get("id", ""),
-                                name=model.get("id", ""),
-                                platform=PlatformType.LMSTUDIO,
-                                description="LMStudio local model"
-                            ))
+                if "data" in data:
+                    for model in data["data"]:
+                        models.append(ModelInfo(
+                            id=model.get("id", ""),
+                            name=model.get("id", ""),
+                            platform=PlatformType.LMSTUDIO,
+                            description="LMStudio local model"
+                        ))
                     
-                    return models
-                else:
-                    logger.error(f"LMStudio API error: {response.status_code} - {response.text}")
-                    return []
+                return models
+            else:
+                raise PlatformError(f"HTTP {response.status_code}: {response.text[:200]}")
                     
         except Exception as e:
             logger.error(f"Failed to get LMStudio models: {e}")
-            return []
+            raise
     
     async def chat_completion(
         self, 
@@ -795,40 +892,94 @@ class LMStudioClient(PlatformClient):
         }
         
         try:
-            async with httpx.AsyncClient(timeout=self.config.timeout) as client:
-                if stream:
-                    async with client.stream(
-                        "POST", url, headers=headers, json=payload
-                    ) as response:
-                        if response.status_code == 200:
-                            async for line in response.aiter_lines():
-                                if line.strip():
-                                    if line.startswith("data: "):
-                                        data = line[6:]
-                                        if data.strip() == "[DONE]":
-                                            break
-                                        yield data
-                                    else:
-                                        yield line
-                        else:
-                            error_msg = await response.aread()
-                            yield json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
-                else:
-                    response = await client.post(url, headers=headers, json=payload)
+            client = self.http_client
+            if stream:
+                async with client.stream(
+                    "POST", url, headers=headers, json=payload
+                ) as response:
                     if response.status_code == 200:
-                        yield response.text
+                        async for line in response.aiter_lines():
+                            if line.strip():
+                                if line.startswith("data: "):
+                                    data = line[6:]
+                                    if data.strip() == "[DONE]":
+                                        break
+                                    yield data
+                                else:
+                                    yield line
                     else:
-                        yield json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
+                        error_msg = await response.aread()
+                        yield fast_json.dumps({"error": f"API error: {response.status_code} - {error_msg.decode()}"})
+            else:
+                response = await client.post(url, headers=headers, json=payload)
+                if response.status_code == 200:
+                    yield response.text
+                else:
+                    yield fast_json.dumps({"error": f"API error: {response.status_code} - {response.text}"})
                         
         except Exception as e:
             logger.error(f"LMStudio chat completion error: {e}")
-            yield json.dumps({"error": f"Request failed: {str(e)}"})
+            yield fast_json.dumps({"error": f"Request failed: {str(e)}"})
 
 class PlatformManager:
     """平台管理器"""
     
     def __init__(self):
         self.platforms: Dict[PlatformType, PlatformClient] = {}
+        self._retired_clients: List[PlatformClient] = []  # 配置变更后待关闭的旧客户端
+        self._retire_tasks: set = set()  # 等待旧客户端请求结束的任务
+        # 最近一次全平台探测结果缓存: (时间, 结果)
+        self._probe_cache: Optional[tuple] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._probe_generation = 0  # 配置变化时递增，避免旧结果写入缓存
+    
+    async def start(self):
+        """创建所有平台的连接池（在应用lifespan启动阶段调用）"""
+        for platform_type, client in self.platforms.items():
+            client.http_client  # 访问属性即创建连接池
+            logger.info(f"🔌 [PlatformManager] {platform_type.value} 连接池已就绪")
+    
+    async def shutdown(self):
+        """关闭所有平台的连接池（在应用lifespan关闭阶段调用）"""
+        for task in list(self._retire_tasks):
+            task.cancel()
+        for client in list(self.platforms.values()) + self._retired_clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"❌ [PlatformManager] 关闭 {client.config.platform_type.value} 连接池失败: {e}")
+        self._retired_clients = []
+        logger.info("🔌 [PlatformManager] 所有连接池已关闭")
+    
+    def _retire_client(self, old: PlatformClient, new: PlatformClient):
+        """替换平台客户端时处理旧连接池：配置相同则直接移交，否则延迟关闭"""
+        if old.client is None or old.client.is_closed:
+            return
+        
+        if old.config.pool_options() == new.config.pool_options():
+            new.client = old.client
+            old.client = None
+            return
+        
+        # 连接参数变化，旧连接池上可能还有进行中的请求（长时间的流式响应），等它们结束后再关闭
+        self._retired_clients.append(old)
+        try:
+            task = asyncio.get_running_loop().create_task(self._close_retired(old))
+        except RuntimeError:
+            return
+        self._retire_tasks.add(task)
+        task.add_done_callback(self._retire_tasks.discard)
+    
+    async def _close_retired(self, client: PlatformClient, grace: float = PLATFORM_RETIRE_GRACE):
+        """等待已退役客户端上的请求结束后关闭，最长等待 grace 秒"""
+        # 模型列表、分类等短请求不登记，至少等过一个请求超时时间
+        started = time.monotonic()
+        await asyncio.sleep(min(client.config.timeout + 5, grace))
+        if not await client.wait_idle(max(0.0, grace - (time.monotonic() - started))):
+            logger.warning(f"⚠️ [PlatformManager] {client.config.platform_type.value} 旧连接池等待 {grace:.0f} 秒后仍有 {client.active_requests} 个请求，强制关闭")
+        if client in self._retired_clients:
+            self._retired_clients.remove(client)
+        await client.aclose()
     
     def add_platform(self, config: PlatformConfig):
         """添加平台"""
@@ -847,33 +998,122 @@ class PlatformManager:
         else:
             raise ValueError(f"Unsupported platform type: {config.platform_type}")
         
+        old_client = self.platforms.get(config.platform_type)
+        if old_client is not None:
+            self._retire_client(old_client, client)
+        
         self.platforms[config.platform_type] = client
+        self.invalidate_probe_cache()
     
     def get_platform(self, platform_type: PlatformType) -> Optional[PlatformClient]:
         """获取平台客户端"""
         return self.platforms.get(platform_type)
     
-    async def get_all_models(self) -> List[ModelInfo]:
-        """获取所有平台的模型列表"""
+    def invalidate_probe_cache(self):
+        """平台配置变化后清除探测结果缓存"""
+        self._probe_cache = None
+        self._probe_task = None
+        self._probe_generation += 1
+    
+    async def _probe_platform(self, platform_type: PlatformType, client: PlatformClient, timeout: float) -> PlatformProbeResult:
+        """获取单个平台的模型列表，记录耗时和错误"""
+        start = time.time()
+        try:
+            logger.info(f"📞 [PlatformManager] 调用 {platform_type.value} 平台...")
+            models = await asyncio.wait_for(client.get_models(), timeout=timeout)
+            latency_ms = int((time.time() - start) * 1000)
+            logger.info(f"📦 [PlatformManager] {platform_type.value} 返回 {len(models)} 个模型，耗时 {latency_ms}ms")
+            return PlatformProbeResult(
+                platform_type=platform_type,
+                ok=len(models) > 0,
+                latency_ms=latency_ms,
+                models=models,
+                error=None if models else "未返回任何模型"
+            )
+        except asyncio.TimeoutError:
+            error = f"超时（{timeout}秒）"
+        except PlatformError as e:
+            error = str(e)
+        except Exception as e:
+            # 网络错误（DNS解析失败、连接超时等）的消息可能为空，带上异常类型
+            error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        logger.error(f"❌ [PlatformManager] {platform_type.value} 平台获取模型失败: {error}")
+        return PlatformProbeResult(
+            platform_type=platform_type,
+            ok=False,
+            latency_ms=int((time.time() - start) * 1000),
+            error=error
+        )
+    
+    async def probe_platforms(
+        self,
+        platform_types: Optional[Iterable[PlatformType]] = None,
+        use_cache: bool = True,
+        timeout: float = PLATFORM_CALL_TIMEOUT,
+        deadline: float = PLATFORM_FANOUT_DEADLINE
+    ) -> Dict[PlatformType, PlatformProbeResult]:
+        """并发获取各平台模型列表：单个平台有超时，整体有截止时间，超时的平台返回错误而不影响其他平台"""
+        if platform_types is not None:
+            targets = {pt: self.platforms[pt] for pt in platform_types if pt in self.platforms}
+            return await self._fan_out(targets, timeout, deadline)
+        
+        if use_cache and self._probe_cache and time.time() - self._probe_cache[0] < PLATFORM_RESULT_CACHE_TTL:
+            return self._probe_cache[1]
+        
+        # 合并同时发起的全平台探测
+        if self._probe_task is None or self._probe_task.done():
+            generation = self._probe_generation
+            self._probe_task = asyncio.create_task(self._fan_out(dict(self.platforms), timeout, deadline))
+            self._probe_task.add_done_callback(lambda task: self._store_probe_result(task, generation))
+        return await asyncio.shield(self._probe_task)
+    
+    def _store_probe_result(self, task: asyncio.Task, generation: int):
+        if generation == self._probe_generation and not task.cancelled() and task.exception() is None:
+            self._probe_cache = (time.time(), task.result())
+    
+    async def _fan_out(self, targets: Dict[PlatformType, PlatformClient], timeout: float, deadline: float) -> Dict[PlatformType, PlatformProbeResult]:
+        start = time.time()
+        tasks = {
+            asyncio.create_task(self._probe_platform(platform_type, client, timeout)): platform_type
+            for platform_type, client in targets.items()
+        }
+        if not tasks:
+            return {}
+        
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        results = {tasks[task]: task.result() for task in done}
+        
+        # 超过总截止时间的平台返回超时结果
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for task in pending:
+            platform_type = tasks[task]
+            logger.error(f"❌ [PlatformManager] {platform_type.value} 平台超过总截止时间 {deadline}秒")
+            results[platform_type] = PlatformProbeResult(
+                platform_type=platform_type,
+                ok=False,
+                latency_ms=int((time.time() - start) * 1000),
+                error=f"超过总截止时间（{deadline}秒）"
+            )
+        
+        # 保持平台配置顺序
+        return {platform_type: results[platform_type] for platform_type in targets}
+    
+    async def get_all_models(self, use_cache: bool = True) -> List[ModelInfo]:
+        """获取所有平台的模型列表（各平台并发获取）"""
         logger.info("🚀 [PlatformManager] 开始获取所有平台模型列表...")
         
+        results = await self.probe_platforms(use_cache=use_cache)
         all_models = []
-        for platform_type, platform in self.platforms.items():
-            try:
-                logger.info(f"📞 [PlatformManager] 调用 {platform_type.value} 平台...")
-                models = await platform.get_models()
-                logger.info(f"📦 [PlatformManager] {platform_type.value} 返回 {len(models)} 个模型")
-                all_models.extend(models)
-            except Exception as e:
-                logger.error(f"❌ [PlatformManager] {platform_type.value} 平台获取模型失败: {e}")
+        for result in results.values():
+            all_models.extend(result.models)
         
         logger.info(f"🎯 [PlatformManager] 总共获取到 {len(all_models)} 个模型")
         return all_models
     
-    async def test_all_connections(self) -> Dict[PlatformType, bool]:
-        """测试所有平台连接"""
-        results = {}
-        for platform_type, client in self.platforms.items():
-            results[platform_type] = await client.test_connection()
-        
-        return results
\ No newline at end of file
+    async def test_all_connections(self, use_cache: bool = True) -> Dict[PlatformType, bool]:
+        """测试所有平台连接（各平台并发测试）"""
+        results = await self.probe_platforms(use_cache=use_cache)
+        return {platform_type: result.ok for platform_type, result in results.items()}
@@ -0,0 +1,125 @@
+"""
+记录查询模块
+记录列表（以及记录搜索）共用的服务端筛选和游标分页：
+- 按 (timestamp, id) 倒序的游标分页，翻页时不再 OFFSET 扫描前面的记录
+- 支持按方法、平台、模型、状态码、用户KEY、路由场景、耗时范围和时间窗口筛选
+- 列表只查询摘要字段，不加载请求体、响应体等大字段
+"""
+
+import base64
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+from database import APIRecord
+
+RECORDS_MAX_LIMIT = 500
+
+# 列表返回的摘要字段
+SUMMARY_COLUMNS = (
+    APIRecord.id, APIRecord.method, APIRecord.path, APIRecord.timestamp,
+    APIRecord.response_status, APIRecord.duration_ms, APIRecord.user_key_id,
+    APIRecord.target_platform, APIRecord.target_model, APIRecord.routing_scene,
+    APIRecord.input_tokens, APIRecord.output_tokens, APIRecord.total_tokens,
+    APIRecord.cache_hit
+)
+
+def _parse_time(value: str) -> datetime:
+    """解析ISO格式时间，带时区时先转换为UTC再去掉时区信息（数据库中为UTC时间），不带时区时视为UTC"""
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def encode_cursor(timestamp: datetime, record_id: int) -> str:
+    """游标为最后一条记录的 (timestamp, id)"""
+    raw = f"{timestamp.isoformat()}|{record_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    timestamp, record_id = base64.urlsafe_b64decode(padded).decode("utf-8").split("|", 1)
+    return datetime.fromisoformat(timestamp), int(record_id)
+
+@dataclass
+class RecordFilters:
+    """记录筛选条件，未设置的条件不筛选"""
+    method: Optional[str] = None
+    platform: Optional[str] = None
+    model: Optional[str] = None
+    status: Optional[str] = None          # 状态码（如 200），或 2xx/4xx/5xx、success（<400）、error（>=400）
+    user_key_id: Optional[int] = None
+    routing_scene: Optional[str] = None
+    min_duration: Optional[int] = None    # 毫秒
+    max_duration: Optional[int] = None    # 毫秒
+    start_time: Optional[str] = None      # ISO格式
+    end_time: Optional[str] = None        # ISO格式
+
+    def apply(self, query):
+        """添加筛选条件，参数格式错误时抛出 ValueError"""
+        if self.method:
+            query = query.filter(APIRecord.method == self.method.upper())
+        if self.platform:
+            query = query.filter(APIRecord.target_platform == self.platform)
+        if self.model:
+            query = query.filter(APIRecord.target_model == self.model)
+        if self.status:
+            query = self._apply_status(query, self.status.lower())
+        if self.user_key_id is not None:
+            query = query.filter(APIRecord.user_key_id == self.user_key_id)
+        if self.routing_scene:
+            query = query.filter(APIRecord.routing_scene == self.routing_scene)
+        if self.min_duration is not None:
+            query = query.filter(APIRecord.duration_ms >= self.min_duration)
+        if self.max_duration is not None:
+            query = query.filter(APIRecord.duration_ms <= self.max_duration)
+        if self.start_time:
+            query = query.filter(APIRecord.timestamp >= _parse_time(self.start_time))
+        if self.end_time:
+            query = query.filter(APIRecord.timestamp <= _parse_time(self.end_time))
+        return query
+
+    @staticmethod
+    def _apply_status(query, status: str):
+        if status == "success":
+            return query.filter(APIRecord.response_status < 400)
+        if status == "error":
+            return query.filter(APIRecord.response_status >= 400)
+        if len(status) == 3 and status.endswith("xx") and status[0].isdigit():
+            low = int(status[0]) * 100
+            return query.filter(APIRecord.response_status >= low, APIRecord.response_status < low + 100)
+        return query.filter(APIRecord.response_status == int(status))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """已设置的筛选条件"""
+        return {f.name: getattr(self, f.name) for f in fields(self) if getattr(self, f.name) is not None}
+
+def apply_cursor(query, cursor: Optional[str]):
+    """按 (timestamp, id) 倒序排列，从游标之后开始"""
+    if cursor:
+        timestamp, record_id = decode_cursor(cursor)
+        query = query.filter(tuple_(APIRecord.timestamp, APIRecord.id) < tuple_(timestamp, record_id))
+    return query.order_by(APIRecord.timestamp.desc(), APIRecord.id.desc())
+
+def record_summary(row) -> Dict[str, Any]:
+    """记录列表中的一条摘要"""
+    return {
+        "id": row.id,
+        "method": row.method,
+        "path": row.path,
+        "timestamp": row.timestamp.isoformat(),
+        "response_status": row.response_status,
+        "duration_ms": row.duration_ms,
+        "user_key_id": row.user_key_id,
+        "target_platform": row.target_platform,
+        "target_model": row.target_model,
+        "routing_scene": row.routing_scene,
+        "cache_hit": bool(row.cache_hit),
+        "token_usage": {
+            "input_tokens": row.input_tokens or 0,
+            "output_tokens": row.output_tokens or 0,
+            "total_tokens": row.total_tokens or 0
+        } if (row.input_tokens or 0) + (row.output_tokens or 0) > 0 else None
+    }
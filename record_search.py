@@ -0,0 +1,293 @@
+"""
+记录全文搜索模块
+用 SQLite FTS5 为每条记录的用户输入和模型输出建立全文索引：
+- 记录写入器在写入记录的同一个事务中更新索引
+- 默认使用 trigram 分词，中文和英文都可以按任意子串搜索（每个搜索词至少3个字符，更短的词退回到 LIKE 匹配）
+- 搜索结果按相关度（bm25）或时间排序，支持与记录列表相同的筛选条件
+- 按相关度排序时只在最新的N条匹配中排序，常见词匹配上百万条记录时查询时间也有上限
+"""
+
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import column, func, literal_column, or_, select, table, text
+
+import fast_json
+from database import APIRecord, engine
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_ENABLED = os.getenv('SEARCH_INDEX_ENABLED', 'true').lower() == 'true'
+SEARCH_TOKENIZER = os.getenv('SEARCH_TOKENIZER', 'trigram')             # trigram 或 unicode61
+SEARCH_MAX_TEXT_KB = int(os.getenv('SEARCH_MAX_TEXT_KB', '64'))          # 每个字段索引的最大长度
+SEARCH_RANK_WINDOW = int(os.getenv('SEARCH_RANK_WINDOW', '1000'))        # 按相关度排序时参与排序的最新匹配数
+
+SEARCH_MAX_LIMIT = 100
+SNIPPET_TOKENS = 48  # 摘要的长度（分词数，trigram 分词时约等于字符数）
+TRIGRAM_MIN_CHARS = 3
+
+# FTS5 表，rowid 为 api_records.id
+record_search_table = table("record_search", column("rowid"), column("prompt"), column("output"))
+
+def _content_text(content: Any) -> str:
+    """消息内容中的文本（字符串或 text 内容块）"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(
+            block.get("text", "") for block in content
+            if isinstance(block, dict) and block.get("type") == "text"
+        )
+    return ""
+
+def extract_prompt_text(body: Optional[str]) -> str:
+    """请求中本轮的用户输入：最后一条 assistant 消息之后的用户消息"""
+    if not body or not body.startswith("{"):
+        return ""
+    try:
+        data = fast_json.loads(body)
+    except (fast_json.JSONDecodeError, UnicodeDecodeError):
+        return ""
+    messages = data.get("messages") if isinstance(data, dict) else None
+    if not isinstance(messages, list):
+        return ""
+    parts: List[str] = []
+    for message in reversed(messages):
+        if not isinstance(message, dict) or message.get("role") == "assistant":
+            break
+        if message.get("role") == "user":
+            parts.append(_content_text(message.get("content")))
+    return "\n".join(reversed([part for part in parts if part]))
+
+def _response_json_text(data: Dict[str, Any]) -> str:
+    # Claude格式
+    if isinstance(data.get("content"), list):
+        return _content_text(data["content"])
+    # OpenAI格式
+    if isinstance(data.get("choices"), list):
+        return "\n".join(
+            _content_text((choice.get("message") or {}).get("content"))
+            for choice in data["choices"] if isinstance(choice, dict)
+        )
+    # Ollama格式
+    if isinstance(data.get("message"), dict):
+        return _content_text(data["message"].get("content"))
+    return data.get("response", "") if isinstance(data.get("response"), str) else ""
+
+def extract_output_text(response_body: Optional[str]) -> str:
+    """响应中模型输出的文本，支持 Claude/OpenAI 的 JSON 响应和 SSE 流"""
+    if not response_body:
+        return ""
+    if response_body.startswith("{"):
+        try:
+            data = fast_json.loads(response_body)
+            return _response_json_text(data) if isinstance(data, dict) else ""
+        except (fast_json.JSONDecodeError, UnicodeDecodeError):
+            pass
+
+    parts: List[str] = []
+    for line in response_body.splitlines():
+        if not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if not payload.startswith("{"):
+            continue
+        try:
+            event = fast_json.loads(payload)
+        except (fast_json.JSONDecodeError, UnicodeDecodeError):
+            continue
+        if not isinstance(event, dict):
+            continue
+        if event.get("type") == "content_block_delta":
+            parts.append((event.get("delta") or {}).get("text") or "")
+        elif isinstance(event.get("choices"), list):
+            for choice in event["choices"]:
+                if isinstance(choice, dict):
+                    parts.append((choice.get("delta") or {}).get("content") or "")
+    return "".join(parts)
+
+def _split_terms(query: str) -> List[str]:
+    return [term for term in query.split() if term]
+
+def _make_snippet(value: Optional[str], terms: List[str], width: int = 60) -> str:
+    """LIKE 匹配时在 Python 中截取匹配位置附近的文本"""
+    if not value:
+        return ""
+    lower = value.lower()
+    for term in terms:
+        pos = lower.find(term.lower())
+        if pos >= 0:
+            start = max(0, pos - width)
+            end = min(len(value), pos + len(term) + width)
+            return (
+                ("…" if start > 0 else "") + value[start:pos] + "<mark>" + value[pos:pos + len(term)] +
+                "</mark>" + value[pos + len(term):end] + ("…" if end < len(value) else "")
+            )
+    return ""
+
+class RecordSearchIndex:
+    """记录全文索引，写入在记录写入器的事务中进行"""
+
+    def __init__(
+        self,
+        enabled: bool = SEARCH_INDEX_ENABLED,
+        tokenizer: str = SEARCH_TOKENIZER,
+        max_chars: int = SEARCH_MAX_TEXT_KB * 1024,
+        rank_window: int = SEARCH_RANK_WINDOW
+    ):
+        self.enabled = enabled
+        self.tokenizer = tokenizer
+        self.max_chars = max_chars
+        self.rank_window = rank_window
+        self.indexed = 0
+
+    def ensure_table(self, bind=engine):
+        """创建 FTS5 表，当前 SQLite 不支持 trigram 时改用 unicode61"""
+        if not self.enabled:
+            return
+        with bind.begin() as conn:
+            exists = conn.exec_driver_sql(
+                "SELECT sql FROM sqlite_master WHERE type='table' AND name='record_search'"
+            ).fetchone()
+            if exists:
+                self.tokenizer = "trigram" if "trigram" in (exists[0] or "") else "unicode61"
+                return
+            for tokenizer in dict.fromkeys((self.tokenizer, "unicode61")):
+                try:
+                    conn.exec_driver_sql(
+                        f"CREATE VIRTUAL TABLE record_search USING fts5(prompt, output, tokenize='{tokenizer}')"
+                    )
+                    self.tokenizer = tokenizer
+                    print(f"✅ 全文索引表已创建 (分词: {tokenizer})")
+                    return
+                except Exception as e:
+                    logger.warning(f"⚠️ [Search] 创建全文索引失败 (分词: {tokenizer}): {e}")
+            self.enabled = False
+
+    def index(self, db, records: List[Dict[str, Any]], record_ids: List[int]):
+        """为一批新记录建立索引（传入未压缩、未替换为增量的原始字段）"""
+        if not self.enabled:
+            return
+        rows = []
+        for fields, record_id in zip(records, record_ids):
+            prompt = extract_prompt_text(fields.get("body"))[:self.max_chars]
+            output = extract_output_text(fields.get("response_body"))[:self.max_chars]
+            if prompt or output:
+                rows.append({"id": record_id, "prompt": prompt, "output": output})
+        if rows:
+            db.execute(text("INSERT INTO record_search(rowid, prompt, output) VALUES (:id, :prompt, :output)"), rows)
+            self.indexed += len(rows)
+
+    def clear(self, db):
+        """清空索引（清空记录时调用）"""
+        if self.enabled:
+            db.execute(text("DELETE FROM record_search"))
+
+    def backfill(self, db, load_fields, batch_size: int = 500) -> int:
+        """为没有索引的已有记录建立索引，load_fields(db, record) 返回还原后的 body 和 response_body"""
+        if not self.enabled:
+            return 0
+        total = 0
+        last_id = 0
+        while True:
+            records = db.query(APIRecord).filter(
+                APIRecord.id > last_id,
+                text("NOT EXISTS (SELECT 1 FROM record_search WHERE record_search.rowid = api_records.id)")
+            ).order_by(APIRecord.id).limit(batch_size).all()
+            if not records:
+                break
+            last_id = records[-1].id
+            before = self.indexed
+            self.index(db, [load_fields(db, record) for record in records], [record.id for record in records])
+            db.commit()
+            total += self.indexed - before
+        logger.info(f"🔍 [Search] 已为 {total} 条已有记录建立全文索引")
+        return total
+
+    def build_query(self, db, columns, query: str) -> Tuple[Any, bool, List[str]]:
+        """返回 (查询, 是否使用全文匹配, 搜索词)；搜索词为空时抛出 ValueError"""
+        terms = _split_terms(query)
+        if not terms:
+            raise ValueError("搜索词不能为空")
+        min_chars = TRIGRAM_MIN_CHARS if self.tokenizer == "trigram" else 1
+        match_terms = [term for term in terms if len(term) >= min_chars]
+        like_terms = [term for term in terms if len(term) < min_chars]
+
+        fts = record_search_table
+        select_columns = list(columns)
+        if match_terms:
+            select_columns += [
+                literal_column("bm25(record_search)").label("rank"),
+                literal_column(f"snippet(record_search, 0, '<mark>', '</mark>', '…', {SNIPPET_TOKENS})").label("prompt_snippet"),
+                literal_column(f"snippet(record_search, 1, '<mark>', '</mark>', '…', {SNIPPET_TOKENS})").label("output_snippet"),
+            ]
+        else:
+            select_columns += [fts.c.prompt, fts.c.output]
+        q = db.query(*select_columns).select_from(fts).join(APIRecord, APIRecord.id == fts.c.rowid)
+
+        if match_terms:
+            # 每个词作为短语匹配（双引号转义），多个词之间为 AND
+            match = " ".join('"' + term.replace('"', '""') + '"' for term in match_terms)
+            q = q.filter(text("record_search MATCH :match")).params(match=match)
+        for term in like_terms:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            q = q.filter(or_(
+                fts.c.prompt.like(pattern, escape="\\"),
+                fts.c.output.like(pattern, escape="\\")
+            ))
+        return q, bool(match_terms), terms
+
+    def search(self, db, columns, query: str, filters, order: str = "rank", limit: int = 20,
+               cursor: Optional[int] = None, offset: int = 0) -> Tuple[List[Any], bool, List[str]]:
+        """返回 (结果行, 是否使用全文匹配, 搜索词)，多查一条用于判断是否有下一页；参数格式错误时抛出 ValueError"""
+        fts = record_search_table
+        q, use_match, terms = self.build_query(db, columns, query)
+        q = filters.apply(q)
+        if order == "time" or not use_match:
+            # 按记录ID（即写入顺序）倒序：FTS5 可以直接按 rowid 倒序遍历匹配，取够数量就停止
+            if cursor:
+                q = q.filter(fts.c.rowid < cursor)
+            q = q.order_by(fts.c.rowid.desc())
+            if order != "time":
+                q = q.offset(offset)
+        else:
+            # bm25 需要为每条匹配计算得分，只在最新的 rank_window 条匹配中排序
+            window = q.with_entities(fts.c.rowid).order_by(fts.c.rowid.desc()).limit(self.rank_window).subquery()
+            q = q.filter(fts.c.rowid >= select(func.min(window.c.rowid)).scalar_subquery())
+            q = q.order_by(literal_column("rank")).offset(offset)
+        return q.limit(limit + 1).all(), use_match, terms
+
+    def scene_prompts(self, db, scene_names, limit: int) -> List[Tuple[str, str]]:
+        """返回最近成功请求的 (路由场景, 用户输入)，供本地场景分类器训练
+        只读取索引中已提取的用户输入，不还原请求体；没有索引的记录直接跳过，全文索引关闭时返回空列表
+        """
+        if not self.enabled or not scene_names:
+            return []
+        fts = record_search_table
+        rows = db.query(APIRecord.routing_scene, fts.c.prompt).join(
+            fts, fts.c.rowid == APIRecord.id
+        ).filter(
+            APIRecord.routing_scene.in_(list(scene_names)),
+            APIRecord.response_status < 400,
+            fts.c.prompt != ""
+        ).order_by(APIRecord.id.desc()).limit(limit).all()
+        return [(row.routing_scene, row.prompt) for row in rows]
+
+    @staticmethod
+    def snippets(row, use_match: bool, terms: List[str]) -> Dict[str, str]:
+        if use_match:
+            return {"prompt_snippet": row.prompt_snippet or "", "output_snippet": row.output_snippet or ""}
+        return {"prompt_snippet": _make_snippet(row.prompt, terms), "output_snippet": _make_snippet(row.output, terms)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "tokenizer": self.tokenizer,
+            "rank_window": self.rank_window,
+            "indexed": self.indexed
+        }
+
+# 全局全文索引实例
+search_index = RecordSearchIndex()
+search_index.ensure_table()
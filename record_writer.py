@@ -0,0 +1,289 @@
+"""
+API记录异步写入模块
+请求路径只负责把记录放入有界队列，由后台任务批量写入数据库
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from blob_store import blob_store
+from conversation_store import conversation_store
+from record_search import search_index
+from database import WriterSessionLocal, APIRecord, KeyUsageLog, UserKey, run_db
+
+logger = logging.getLogger(__name__)
+
+# 写入队列配置
+RECORDER_QUEUE_SIZE = int(os.getenv('RECORDER_QUEUE_SIZE', '10000'))
+RECORDER_BATCH_SIZE = int(os.getenv('RECORDER_BATCH_SIZE', '200'))
+RECORDER_FLUSH_INTERVAL = float(os.getenv('RECORDER_FLUSH_INTERVAL', '0.5'))  # 秒
+# 队列满时的处理策略: drop_newest（丢弃新记录）, drop_oldest（丢弃最旧记录）, block（等待一段时间后丢弃）
+RECORDER_OVERFLOW_POLICY = os.getenv('RECORDER_OVERFLOW_POLICY', 'drop_newest')
+RECORDER_BLOCK_TIMEOUT = float(os.getenv('RECORDER_BLOCK_TIMEOUT', '1.0'))  # 秒
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+@dataclass
+class PendingRecord:
+    """等待写入的记录"""
+    record: Dict[str, Any]                 # APIRecord 字段
+    key_usage: Optional[Dict[str, Any]]    # KeyUsageLog 字段，不需要记录KEY使用时为None
+
+class RecordWriter:
+    """后台批量写入器：攒批后在一个事务里写入 APIRecord 和 KeyUsageLog"""
+
+    def __init__(
+        self,
+        session_factory=WriterSessionLocal,
+        queue_size: int = RECORDER_QUEUE_SIZE,
+        batch_size: int = RECORDER_BATCH_SIZE,
+        flush_interval: float = RECORDER_FLUSH_INTERVAL,
+        overflow_policy: str = RECORDER_OVERFLOW_POLICY,
+        block_timeout: float = RECORDER_BLOCK_TIMEOUT
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            logger.warning(f"⚠️ [RecordWriter] 未知的队列溢出策略 {overflow_policy}，使用 drop_newest")
+            overflow_policy = "drop_newest"
+
+        self.session_factory = session_factory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # 写入成功后的回调（用于推送实时更新），参数为 (记录字段, 记录ID)
+        self.on_written: Optional[Callable[[Dict[str, Any], int], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        # 批量写入和清空记录互斥执行
+        self._write_lock = asyncio.Lock()
+
+        # 统计计数
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_ms = 0
+
+    def start(self):
+        """启动后台写入任务"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info(f"📝 [RecordWriter] 后台写入已启动: 队列={self.queue_size}, 批量={self.batch_size}, 间隔={self.flush_interval}s, 溢出策略={self.overflow_policy}")
+
+    async def stop(self):
+        """写入队列中剩余的记录并停止后台任务"""
+        if self._task is None:
+            return
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info(f"📝 [RecordWriter] 后台写入已停止，共写入 {self.written} 条，丢弃 {self.dropped} 条")
+
+    async def flush(self):
+        """等待当前队列中的记录全部写入"""
+        if self._task is None or self._task.done():
+            self.start()
+        await self.queue.join()
+
+    async def submit(self, record: Dict[str, Any], key_usage: Optional[Dict[str, Any]] = None) -> bool:
+        """提交一条记录，返回是否成功入队"""
+        if self._task is None or self._task.done():
+            self.start()
+
+        item = PendingRecord(record=record, key_usage=key_usage)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow_policy == "drop_oldest":
+                self._drop_oldest()
+                self.queue.put_nowait(item)
+            elif self.overflow_policy == "block":
+                try:
+                    await asyncio.wait_for(self.queue.put(item), timeout=self.block_timeout)
+                except asyncio.TimeoutError:
+                    self._count_dropped(record)
+                    return False
+            else:
+                self._count_dropped(record)
+                return False
+
+        self.enqueued += 1
+        return True
+
+    def _drop_oldest(self):
+        """丢弃队列中最旧的一条记录"""
+        try:
+            oldest = self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        self.queue.task_done()
+        self._count_dropped(oldest.record)
+
+    def _count_dropped(self, record: Dict[str, Any]):
+        self.dropped += 1
+        logger.warning(f"⚠️ [RecordWriter] 写入队列已满，丢弃记录: {record.get('method')} {record.get('path')}（累计丢弃 {self.dropped} 条）")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取写入器统计信息"""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue_size,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "overflow_policy": self.overflow_policy,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_batch_ms": self.last_batch_ms,
+            "blob_store": blob_store.get_stats(),
+            "conversation_store": conversation_store.get_stats(),
+            "search_index": search_index.get_stats()
+        }
+
+    async def _run(self):
+        """后台写入循环：攒够批量或到达刷新间隔后写入"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                async with self._write_lock:
+                    await self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write_batch(self, batch: List[PendingRecord]):
+        """在工作线程中写入一批记录，然后触发回调"""
+        start = time.time()
+        written = await self._write_with_retry(batch)
+        if not written:
+            return
+
+        self.batches += 1
+        self.written += len(written)
+        self.last_batch_ms = int((time.time() - start) * 1000)
+
+        if self.on_written:
+            for item, record_id in written:
+                try:
+                    await self.on_written(item.record, record_id)
+                except Exception as e:
+                    logger.error(f"❌ [RecordWriter] 写入回调失败: {e}")
+
+    async def _write_with_retry(self, batch: List[PendingRecord]) -> List[Tuple[PendingRecord, int]]:
+        """整批写入失败时重试一次（如数据库暂时被锁），仍然失败则逐条写入，只丢弃写不进去的记录"""
+        for attempt in (1, 2):
+            try:
+                record_ids = await run_db(self._write_batch_sync, batch)
+                return list(zip(batch, record_ids))
+            except Exception as e:
+                logger.warning(f"⚠️ [RecordWriter] 批量写入 {len(batch)} 条记录失败（第 {attempt} 次）: {e}")
+
+        if len(batch) == 1:
+            self.failed += 1
+            logger.error(f"❌ [RecordWriter] 记录写入失败，已丢弃: {batch[0].record.get('method')} {batch[0].record.get('path')}")
+            return []
+
+        written: List[Tuple[PendingRecord, int]] = []
+        for item in batch:
+            try:
+                record_ids = await run_db(self._write_batch_sync, [item])
+                written.append((item, record_ids[0]))
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"❌ [RecordWriter] 记录写入失败，已丢弃: {item.record.get('method')} {item.record.get('path')}: {e}")
+        logger.info(f"📝 [RecordWriter] 逐条写入完成: {len(written)}/{len(batch)} 条成功")
+        return written
+
+    async def clear(self):
+        """清空所有记录、大字段内容和全文索引；与批量写入互斥，正在写入的批次不会引用被删除的记录"""
+        async with self._write_lock:
+            await run_db(self._clear_sync)
+        logger.info("🧹 [RecordWriter] 记录已清空")
+
+    def _clear_sync(self):
+        db = self.session_factory()
+        try:
+            db.query(APIRecord).delete()
+            blob_store.clear(db)
+            search_index.clear(db)
+            db.commit()
+            # 内存中的会话轮次指向已删除的记录，SQLite 删除全部记录后还会重新使用记录ID，必须一起清空
+            conversation_store.clear()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_batch_sync(self, batch: List[PendingRecord]) -> List[int]:
+        """同步写入：一个事务内保存请求体增量和大字段内容、插入记录和全文索引、KEY使用日志并累加KEY用量"""
+        db = self.session_factory()
+        try:
+            records, turns = conversation_store.encode(db, [item.record for item in batch])
+            records = blob_store.externalize(db, records)
+            api_records = [APIRecord(**fields) for fields in records]
+            db.add_all(api_records)
+            db.flush()  # 获取生成的记录ID
+            conversation_store.link(turns, api_records)
+            search_index.index(db, [item.record for item in batch], [api_record.id for api_record in api_records])
+
+            used_tokens_by_key: Dict[int, int] = {}
+            for item, api_record in zip(batch, api_records):
+                if not item.key_usage:
+                    continue
+                usage_log = KeyUsageLog(api_record_id=api_record.id, **item.key_usage)
+                db.add(usage_log)
+                if usage_log.total_tokens and usage_log.total_tokens > 0:
+                    key_id = usage_log.user_key_id
+                    used_tokens_by_key[key_id] = used_tokens_by_key.get(key_id, 0) + usage_log.total_tokens
+
+            # 更新KEY的使用统计（原子累加）
+            now = datetime.utcnow()
+            for key_id, tokens in used_tokens_by_key.items():
+                db.query(UserKey).filter(UserKey.id == key_id).update(
+                    {UserKey.used_tokens: UserKey.used_tokens + tokens, UserKey.updated_at: now},
+                    synchronize_session=False
+                )
+
+            db.commit()
+            record_ids = [api_record.id for api_record in api_records]
+            conversation_store.remember(turns)
+            return record_ids
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+# 全局写入器实例
+record_writer = RecordWriter()
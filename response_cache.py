@@ -0,0 +1,193 @@
+"""
+响应缓存模块
+对确定性的非流式请求（temperature 为 0）缓存上游响应，相同的请求直接返回缓存结果：
+- 缓存键为发往上游的规范化请求（平台 + 模型 + 消息 + 参数）的哈希
+- LRU 按字节数限制总大小，每条缓存有过期时间
+- 可以按用户KEY关闭，可选持久化到 SQLite，重启后继续使用
+"""
+
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set
+
+import fast_json
+from database import ResponseCacheEntry, UserKey, WriterSessionLocal, run_db
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_MAX_MB = float(os.getenv('RESPONSE_CACHE_MAX_MB', '64'))          # 缓存总大小上限
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))              # 秒
+RESPONSE_CACHE_PERSIST = os.getenv('RESPONSE_CACHE_PERSIST', 'false').lower() == 'true'
+RESPONSE_CACHE_CHARGE_HITS = os.getenv('RESPONSE_CACHE_CHARGE_HITS', 'false').lower() == 'true'  # 命中是否计入KEY用量
+
+EPOCH = datetime(1970, 1, 1)  # 过期时间在内存中为时间戳，数据库中为UTC时间
+
+@dataclass
+class CachedResponse:
+    """一条缓存的响应"""
+    response_body: str
+    model_raw_response: Optional[str]
+    size_bytes: int
+    expires_at: float
+
+class ResponseCache:
+    """确定性非流式请求的响应缓存（按字节限制大小的LRU + TTL）"""
+
+    def __init__(
+        self,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+        max_bytes: int = int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+        ttl: float = RESPONSE_CACHE_TTL,
+        persist: bool = RESPONSE_CACHE_PERSIST
+    ):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.persist = persist
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.total_bytes = 0
+        self.disabled_keys: Set[int] = set()  # 关闭了响应缓存的用户KEY ID
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(platform: str, payload: Dict[str, Any]) -> str:
+        """规范化请求（键排序，忽略stream）后取哈希"""
+        canonical = {k: v for k, v in payload.items() if k != "stream"}
+        canonical["platform"] = platform
+        return hashlib.sha256(fast_json.canonical_bytes(canonical)).hexdigest()
+
+    def is_cacheable(self, payload: Dict[str, Any], stream: bool, user_key_id: Optional[int] = None) -> bool:
+        """只缓存 temperature 为 0 的非流式请求"""
+        if not self.enabled or stream:
+            return False
+        if user_key_id is not None and user_key_id in self.disabled_keys:
+            return False
+        temperature = payload.get("temperature")
+        return temperature is not None and temperature == 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.time() > entry.expires_at:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    async def put(self, key: str, response_body: str, model_raw_response: Optional[str] = None):
+        """缓存上游的成功响应，开启持久化时同时写入数据库"""
+        entry = self._add(key, response_body, model_raw_response, time.time() + self.ttl)
+        if entry is not None and self.persist:
+            try:
+                await run_db(self._save_entry, key, entry)
+            except Exception as e:
+                logger.error(f"❌ [ResponseCache] 保存响应缓存失败: {e}")
+
+    def _add(self, key: str, response_body: str, model_raw_response: Optional[str], expires_at: float) -> Optional[CachedResponse]:
+        size_bytes = len(response_body.encode("utf-8")) + len((model_raw_response or "").encode("utf-8"))
+        if size_bytes > self.max_bytes:
+            return None
+        if key in self._entries:
+            self._remove(key)
+        entry = CachedResponse(response_body, model_raw_response, size_bytes, expires_at)
+        self._entries[key] = entry
+        self.total_bytes += size_bytes
+        while self.total_bytes > self.max_bytes:
+            evicted_key, _ = next(iter(self._entries.items()))
+            self._remove(evicted_key)
+            self.evictions += 1
+        return entry
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.size_bytes
+
+    @staticmethod
+    def _save_entry(key: str, entry: CachedResponse):
+        db = WriterSessionLocal()
+        try:
+            db.merge(ResponseCacheEntry(
+                cache_key=key,
+                response_body=entry.response_body,
+                model_raw_response=entry.model_raw_response,
+                size_bytes=entry.size_bytes,
+                created_at=datetime.utcnow(),
+                expires_at=EPOCH + timedelta(seconds=entry.expires_at)
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def load(self, db):
+        """启动时加载关闭了缓存的用户KEY，开启持久化时加载未过期的缓存"""
+        self.disabled_keys = {
+            key_id for (key_id,) in db.query(UserKey.id).filter(UserKey.response_cache_enabled == False).all()
+        }
+        if not (self.enabled and self.persist):
+            return
+        now = datetime.utcnow()
+        db.query(ResponseCacheEntry).filter(ResponseCacheEntry.expires_at <= now).delete()
+        db.commit()
+        # 按创建时间加载，较新的缓存在LRU末尾
+        rows = db.query(ResponseCacheEntry).order_by(ResponseCacheEntry.created_at).all()
+        for row in rows:
+            self._add(row.cache_key, row.response_body or "", row.model_raw_response,
+                      (row.expires_at - EPOCH).total_seconds())
+        logger.info(f"💾 [ResponseCache] 已加载 {len(self._entries)} 条响应缓存 ({self.total_bytes} 字节)")
+
+    def set_key_enabled(self, user_key_id: int, enabled: bool):
+        """用户KEY开启或关闭响应缓存"""
+        if enabled:
+            self.disabled_keys.discard(user_key_id)
+        else:
+            self.disabled_keys.add(user_key_id)
+
+    async def clear(self):
+        """清空缓存（包括持久化的缓存）；内存中的缓存只在事件循环中修改，数据库删除在工作线程中执行"""
+        self._entries.clear()
+        self.total_bytes = 0
+        if self.persist:
+            await run_db(self._delete_entries)
+
+    @staticmethod
+    def _delete_entries():
+        db = WriterSessionLocal()
+        try:
+            db.query(ResponseCacheEntry).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "persist": self.persist,
+            "charge_hits": RESPONSE_CACHE_CHARGE_HITS,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
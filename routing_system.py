@@ -3,10 +3,15 @@
 支持小模型路由模式和多平台转发模式
 """
 
-import json
+import os
+import re
+import math
+import time
+import hashlib
 import asyncio
-from typing import Dict, List, Any, Optional, Tuple
-from dataclasses import dataclass
+from collections import deque, OrderedDict, Counter
+from typing import Deque, Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass, field
 from enum import Enum
 import logging
 from sqlalchemy.orm import Session
@@ -15,9 +20,17 @@ from database import RoutingConfig, ModelConfig, PlatformConfig
 from database import RoutingScene as DBRoutingScene
 from platforms import PlatformManager, PlatformType, PlatformClient
 from format_converter import FormatConverter
+import fast_json
+from record_search import search_index
 
 logger = logging.getLogger(__name__)
 
+# 场景判断缓存配置
+SCENE_CACHE_SIZE = int(os.getenv('SCENE_CACHE_SIZE', '1024'))
+SCENE_CACHE_TTL = float(os.getenv('SCENE_CACHE_TTL', '600'))  # 秒
+# 本地场景分类器使用的历史记录条数
+SCENE_CLASSIFIER_HISTORY_LIMIT = int(os.getenv('SCENE_CLASSIFIER_HISTORY_LIMIT', '500'))
+
 class RoutingMode(Enum):
     """路由模式"""
     CLAUDE_CODE = "claude_code"  # 原有的Claude Code API
@@ -32,6 +45,14 @@ class RoutingResult:
     model_id: Optional[str] = None
     error_message: Optional[str] = None
     scene_name: Optional[str] = None
+    # 对冲请求的候选模型（仅全局直连模式启用对冲时填充）
+    alternatives: List["RoutingResult"] = field(default_factory=list)
+    
+    @property
+    def model_spec(self) -> str:
+        """返回 "platform:model_id" 格式的模型规格"""
+        platform = self.platform_type.value if self.platform_type else "unknown"
+        return f"{platform}:{self.model_id}"
 
 @dataclass
 class RoutingScene:
@@ -41,13 +62,278 @@ class RoutingScene:
     models: List[str]  # 格式: ["platform:model_id"]
     enabled: bool = True
 
+@dataclass
+class HedgingConfig:
+    """对冲请求配置（全局直连模式，config_data["hedging"]）"""
+    enabled: bool = False
+    delay_ms: int = 2000        # 主模型未出首个token时，多久后向下一个模型发出对冲请求
+    use_p95: bool = False       # 使用主模型观测到的首token耗时p95作为对冲延迟
+    min_samples: int = 20       # 使用p95前至少需要的样本数
+    
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "HedgingConfig":
+        if not isinstance(data, dict):
+            return cls()
+        return cls(
+            enabled=bool(data.get("enabled", False)),
+            delay_ms=int(data.get("delay_ms", 2000)),
+            use_p95=bool(data.get("use_p95", False)),
+            min_samples=int(data.get("min_samples", 20))
+        )
+
+class HedgingStats:
+    """对冲请求统计：对冲率、各模型胜出次数、浪费的token，以及用于p95延迟的首token耗时样本"""
+    
+    def __init__(self, sample_size: int = 200):
+        self.sample_size = sample_size
+        self.requests = 0
+        self.hedged = 0
+        self.wasted_tokens = 0
+        self.wins: Dict[str, int] = {}
+        self.hedge_wins: Dict[str, int] = {}  # 对冲发出后各模型胜出次数
+        self.first_token_ms: Dict[str, Deque[float]] = {}
+    
+    def record_first_token(self, model_spec: str, elapsed_ms: float):
+        """记录模型的首token耗时"""
+        samples = self.first_token_ms.get(model_spec)
+        if samples is None:
+            samples = deque(maxlen=self.sample_size)
+            self.first_token_ms[model_spec] = samples
+        samples.append(elapsed_ms)
+    
+    def record_result(self, winner_spec: Optional[str], hedged: bool, wasted_tokens: int = 0):
+        """记录一次请求的对冲结果"""
+        self.requests += 1
+        if winner_spec:
+            self.wins[winner_spec] = self.wins.get(winner_spec, 0) + 1
+        if hedged:
+            self.hedged += 1
+            self.wasted_tokens += wasted_tokens
+            if winner_spec:
+                self.hedge_wins[winner_spec] = self.hedge_wins.get(winner_spec, 0) + 1
+    
+    def percentile(self, model_spec: str, pct: float) -> Optional[float]:
+        """计算模型首token耗时的百分位数"""
+        samples = self.first_token_ms.get(model_spec)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+    
+    def get_delay(self, config: HedgingConfig, model_spec: str) -> float:
+        """获取对冲延迟（秒）"""
+        if config.use_p95:
+            samples = self.first_token_ms.get(model_spec)
+            if samples and len(samples) >= config.min_samples:
+                return self.percentile(model_spec, 95) / 1000
+        return config.delay_ms / 1000
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0,
+            "wins": dict(self.wins),
+            "hedge_wins": dict(self.hedge_wins),
+            "wasted_tokens": self.wasted_tokens,
+            "first_token_p95_ms": {
+                spec: round(self.percentile(spec, 95), 1) for spec in self.first_token_ms
+            }
+        }
+
+class SceneCache:
+    """场景判断缓存（LRU + TTL）：规范化prompt的哈希 → 场景序号"""
+    
+    def __init__(self, max_size: int = SCENE_CACHE_SIZE, ttl: float = SCENE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def make_key(user_prompt: str) -> str:
+        """规范化prompt（去除首尾空白、合并连续空白）后取哈希"""
+        normalized = " ".join(user_prompt.split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[int]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        scene_index, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return scene_index
+    
+    def put(self, key: str, scene_index: int):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (scene_index, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        """场景配置重新加载后清空缓存"""
+        self._entries.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+@dataclass
+class LocalClassifierConfig:
+    """本地场景分类器配置（智能路由模式，config_data["local_classifier"]）"""
+    enabled: bool = True
+    threshold: float = 0.35     # 最高相似度达到该值才直接采用本地结果
+    margin: float = 0.05        # 最高与次高相似度至少相差该值
+    use_history: bool = True    # 使用历史请求记录中的场景标签训练
+    
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "LocalClassifierConfig":
+        if not isinstance(data, dict):
+            return cls()
+        return cls(
+            enabled=bool(data.get("enabled", True)),
+            threshold=float(data.get("threshold", 0.35)),
+            margin=float(data.get("margin", 0.05)),
+            use_history=bool(data.get("use_history", True))
+        )
+
+class LocalSceneClassifier:
+    """本地场景分类器：字符n-gram和单词的TF-IDF向量，与各场景（描述+历史请求）的中心向量比较余弦相似度"""
+    
+    MAX_CHARS = 2000  # 只取prompt开头的一段计算特征，保证耗时稳定
+    WORD_PATTERN = re.compile(r"[a-z0-9_]+")
+    
+    def __init__(self, config: Optional[LocalClassifierConfig] = None):
+        self.config = config or LocalClassifierConfig()
+        self.idf: Dict[str, float] = {}
+        self.centroids: List[Dict[str, float]] = []
+        self.example_count = 0
+        self.local_hits = 0
+        self.fallbacks = 0
+    
+    @classmethod
+    def _features(cls, text: str) -> Counter:
+        """提取特征：2-3字符n-gram（适配中文）和英文单词"""
+        text = " ".join(text[:cls.MAX_CHARS].lower().split())
+        features = Counter()
+        for n in (2, 3):
+            for i in range(len(text) - n + 1):
+                features[text[i:i + n]] += 1
+        for word in cls.WORD_PATTERN.findall(text):
+            features["w:" + word] += 1
+        return features
+    
+    def _vectorize(self, features: Counter) -> Dict[str, float]:
+        """计算L2归一化的TF-IDF向量，忽略训练集中未出现的特征"""
+        vector = {}
+        for feature, count in features.items():
+            idf = self.idf.get(feature)
+            if idf is not None:
+                vector[feature] = (1 + math.log(count)) * idf
+        norm = math.sqrt(sum(value * value for value in vector.values()))
+        if norm:
+            for feature in vector:
+                vector[feature] /= norm
+        return vector
+    
+    def fit(self, scenes: List["RoutingScene"], examples: Optional[Dict[str, List[str]]] = None):
+        """用场景名称、描述和历史请求训练"""
+        examples = examples or {}
+        docs: List[Tuple[int, Counter]] = []
+        for index, scene in enumerate(scenes):
+            docs.append((index, self._features(f"{scene.name} {scene.description}")))
+            for text in examples.get(scene.name, []):
+                docs.append((index, self._features(text)))
+        self.example_count = len(docs) - len(scenes)
+        
+        document_frequency = Counter()
+        for _, features in docs:
+            document_frequency.update(features.keys())
+        total = len(docs)
+        self.idf = {
+            feature: math.log((1 + total) / (1 + df)) + 1
+            for feature, df in document_frequency.items()
+        }
+        
+        # 每个场景的中心向量
+        sums: List[Dict[str, float]] = [{} for _ in scenes]
+        for index, features in docs:
+            centroid = sums[index]
+            for feature, value in self._vectorize(features).items():
+                centroid[feature] = centroid.get(feature, 0.0) + value
+        for centroid in sums:
+            norm = math.sqrt(sum(value * value for value in centroid.values()))
+            if norm:
+                for feature in centroid:
+                    centroid[feature] /= norm
+        self.centroids = sums
+    
+    def classify(self, user_prompt: str) -> Tuple[int, float]:
+        """返回 (场景编号, 相似度)，置信度不足时场景编号为0"""
+        if not self.config.enabled or not self.centroids or not user_prompt:
+            return 0, 0.0
+        vector = self._vectorize(self._features(user_prompt))
+        scores = [
+            sum(value * centroid.get(feature, 0.0) for feature, value in vector.items())
+            for centroid in self.centroids
+        ]
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        best = scores[ranked[0]]
+        second = scores[ranked[1]] if len(ranked) > 1 else 0.0
+        if best >= self.config.threshold and best - second >= self.config.margin:
+            return ranked[0] + 1, best
+        return 0, best
+    
+    def get_stats(self) -> Dict[str, Any]:
+        decisions = self.local_hits + self.fallbacks
+        return {
+            "enabled": self.config.enabled,
+            "threshold": self.config.threshold,
+            "margin": self.config.margin,
+            "training_examples": self.example_count,
+            "local_hits": self.local_hits,
+            "model_fallbacks": self.fallbacks,
+            "local_rate": round(self.local_hits / decisions, 4) if decisions else 0
+        }
+
 class SmartRouter:
     """智能路由器（小模型路由模式）"""
     
-    def __init__(self, platform_manager: PlatformManager, routing_models: List[str]):
+    def __init__(
+        self,
+        platform_manager: PlatformManager,
+        routing_models: List[str],
+        scene_cache: Optional[SceneCache] = None,
+        classifier_config: Optional[LocalClassifierConfig] = None
+    ):
         self.platform_manager = platform_manager
         self.routing_models = routing_models  # 用于判断场景的小模型优先级列表（支持降级）
         self.scenes: List[RoutingScene] = []
+        self.scene_cache = scene_cache if scene_cache is not None else SceneCache()
+        self.local_classifier = LocalSceneClassifier(classifier_config)
     
     def load_scenes(self, db: Session, routing_config_id: int):
         """从数据库加载场景配置"""
@@ -59,15 +345,30 @@ class SmartRouter:
         self.scenes = []
         for scene in scenes:
             try:
-                models = json.loads(scene.models)
+                models = fast_json.loads(scene.models)
                 self.scenes.append(RoutingScene(
                     name=scene.scene_name,
                     description=scene.scene_description,
                     models=models,
                     enabled=scene.enabled
                 ))
-            except json.JSONDecodeError:
+            except fast_json.JSONDecodeError:
                 logger.error(f"Failed to parse models for scene {scene.scene_name}")
+        
+        # 训练本地场景分类器
+        if self.local_classifier.config.enabled and self.scenes:
+            examples = self._load_history_examples(db) if self.local_classifier.config.use_history else {}
+            self.local_classifier.fit(self.scenes, examples)
+            logger.info(f"🧠 [SmartRouter] 本地场景分类器已训练: {len(self.scenes)} 个场景, {self.local_classifier.example_count} 条历史请求")
+    
+    def _load_history_examples(self, db: Session) -> Dict[str, List[str]]:
+        """从全文索引中取最近历史请求的 场景名称 → 用户消息 样本（没有索引的记录不参与训练）"""
+        scene_names = {scene.name for scene in self.scenes}
+        examples: Dict[str, List[str]] = {}
+        for scene_name, user_prompt in search_index.scene_prompts(db, scene_names, SCENE_CLASSIFIER_HISTORY_LIMIT):
+            if user_prompt.strip():
+                examples.setdefault(scene_name, []).append(user_prompt[:LocalSceneClassifier.MAX_CHARS])
+        return examples
     
     async def route_request(self, user_prompt: str) -> RoutingResult:
         """根据用户prompt路由请求"""
@@ -102,10 +403,36 @@ class SmartRouter:
         )
     
     async def _detect_scene(self, user_prompt: str) -> Optional[RoutingScene]:
-        """使用小模型检测场景"""
+        """检测场景，相同的prompt（如工具调用循环中重复发送的最后一条消息）直接使用缓存结果"""
         if not self.scenes:
             return None
         
+        cache_key = self.scene_cache.make_key(user_prompt)
+        scene_index = self.scene_cache.get(cache_key)
+        if scene_index is not None and 1 <= scene_index <= len(self.scenes):
+            logger.info(f"⚡ [SmartRouter] 场景缓存命中: {self.scenes[scene_index - 1].name}")
+            return self.scenes[scene_index - 1]
+        
+        # 本地分类器置信度足够时不调用路由模型
+        scene_index, score = self.local_classifier.classify(user_prompt)
+        if scene_index:
+            self.local_classifier.local_hits += 1
+            logger.info(f"🧠 [SmartRouter] 本地分类器判断场景: {self.scenes[scene_index - 1].name} (相似度 {score:.2f})")
+            self.scene_cache.put(cache_key, scene_index)
+            return self.scenes[scene_index - 1]
+        if self.local_classifier.config.enabled:
+            self.local_classifier.fallbacks += 1
+        
+        scene_index = await self._classify_scene(user_prompt)
+        if scene_index:
+            self.scene_cache.put(cache_key, scene_index)
+            return self.scenes[scene_index - 1]
+        
+        # 如果所有路由模型都失败，返回默认场景（第一个），不缓存
+        return self.scenes[0]
+    
+    async def _classify_scene(self, user_prompt: str) -> int:
+        """使用小模型判断场景，返回场景编号（从1开始），失败返回0"""
         # 构造场景判断的prompt
         scene_descriptions = []
         for i, scene in enumerate(self.scenes):
@@ -137,24 +464,23 @@ class SmartRouter:
                 response_text = ""
                 async for chunk in client.chat_completion(model_id, messages, stream=False):
                     try:
-                        response_data = json.loads(chunk)
+                        response_data = fast_json.loads(chunk)
                         if "choices" in response_data:
                             response_text = response_data["choices"][0]["message"]["content"]
                             break
-                    except json.JSONDecodeError:
+                    except fast_json.JSONDecodeError:
                         continue
                 
                 # 解析场景编号
                 scene_index = self._parse_scene_number(response_text)
                 if 1 <= scene_index <= len(self.scenes):
-                    return self.scenes[scene_index - 1]
+                    return scene_index
                 
             except Exception as e:
                 logger.error(f"Failed to use routing model {routing_model}: {e}")
                 continue
         
-        # 如果所有路由模型都失败，返回默认场景（第一个）
-        return self.scenes[0] if self.scenes else None
+        return 0
     
     def _parse_scene_number(self, response: str) -> int:
         """解析场景编号"""
@@ -183,6 +509,7 @@ class GlobalDirectRouter:
     def __init__(self, platform_manager: PlatformManager):
         self.platform_manager = platform_manager
         self.model_priority_list: List[str] = []  # 格式: ["platform:model_id"]
+        self.hedging = HedgingConfig()
     
     def load_config(self, db: Session, routing_config_id: int):
         """从数据库加载配置"""
@@ -192,29 +519,39 @@ class GlobalDirectRouter:
         
         if config and config.config_data:
             try:
-                config_data = json.loads(config.config_data)
+                config_data = fast_json.loads(config.config_data)
                 self.model_priority_list = config_data.get("model_priority_list", [])
-            except json.JSONDecodeError:
+                self.hedging = HedgingConfig.from_dict(config_data.get("hedging"))
+            except (fast_json.JSONDecodeError, TypeError, ValueError):
                 logger.error(f"Failed to parse routing config {routing_config_id}")
                 self.model_priority_list = []
     
     async def route_request(self, user_prompt: str = "") -> RoutingResult:
-        """按优先级顺序路由请求"""
+        """按优先级顺序路由请求，启用对冲时附带下一个可用模型作为候选"""
+        available: List[RoutingResult] = []
+        limit = 2 if self.hedging.enabled else 1
         for model_spec in self.model_priority_list:
             try:
                 platform_type, model_id = self._parse_model_spec(model_spec)
                 client = self.platform_manager.get_platform(platform_type)
                 
                 if client:
-                    return RoutingResult(
+                    available.append(RoutingResult(
                         success=True,
                         platform_type=platform_type,
                         model_id=model_id
-                    )
+                    ))
+                    if len(available) >= limit:
+                        break
             except Exception as e:
                 logger.error(f"Failed to parse model {model_spec}: {e}")
                 continue
         
+        if available:
+            result = available[0]
+            result.alternatives = available[1:]
+            return result
+        
         return RoutingResult(
             success=False,
             error_message="所有配置的模型都不可用"
@@ -238,9 +575,15 @@ class RoutingManager:
         self.current_mode = RoutingMode.CLAUDE_CODE
         self.smart_router: Optional[SmartRouter] = None
         self.global_direct_router: Optional[GlobalDirectRouter] = None
+        # 对冲统计和场景缓存跨配置重载保留（场景缓存在重载时清空）
+        self.hedging_stats = HedgingStats()
+        self.scene_cache = SceneCache()
     
     def load_config(self, db: Session):
         """从数据库加载路由配置"""
+        # 场景配置可能变化，之前的场景判断结果不再有效
+        self.scene_cache.clear()
+        
         # 获取当前激活的路由配置
         active_config = db.query(RoutingConfig).filter(
             RoutingConfig.is_active == True
@@ -255,12 +598,13 @@ class RoutingManager:
             
             # 加载智能路由配置
             try:
-                config_data = json.loads(active_config.config_data)
+                config_data = fast_json.loads(active_config.config_data)
                 routing_models = config_data.get("routing_models", [])
+                classifier_config = LocalClassifierConfig.from_dict(config_data.get("local_classifier"))
                 
-                self.smart_router = SmartRouter(self.platform_manager, routing_models)
+                self.smart_router = SmartRouter(self.platform_manager, routing_models, self.scene_cache, classifier_config)
                 self.smart_router.load_scenes(db, active_config.id)
-            except json.JSONDecodeError:
+            except (fast_json.JSONDecodeError, TypeError, ValueError):
                 logger.error("Failed to parse smart routing config")
                 self.current_mode = RoutingMode.CLAUDE_CODE
         
@@ -296,4 +640,25 @@ class RoutingManager:
     
     def get_current_mode(self) -> RoutingMode:
         """获取当前路由模式"""
-        return self.current_mode
\ No newline at end of file
+        return self.current_mode
+    
+    def get_hedging_config(self) -> HedgingConfig:
+        """获取当前生效的对冲配置，非全局直连模式下始终为关闭"""
+        if self.current_mode == RoutingMode.GLOBAL_DIRECT and self.global_direct_router:
+            return self.global_direct_router.hedging
+        return HedgingConfig()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取路由统计信息"""
+        hedging = self.get_hedging_config()
+        return {
+            "mode": self.current_mode.value,
+            "hedging": {
+                "enabled": hedging.enabled,
+                "delay_ms": hedging.delay_ms,
+                "use_p95": hedging.use_p95,
+                **self.hedging_stats.get_stats()
+            },
+            "scene_cache": self.scene_cache.get_stats(),
+            "local_classifier": self.smart_router.local_classifier.get_stats() if self.smart_router else None
+        }
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+Claude SSE 事件编码模块
+常用事件使用预先生成的字节模板，只对变化的文本做JSON转义，直接输出bytes
+模板部分与 json.dumps(data, ensure_ascii=False) 的格式一致
+"""
+
+from typing import Any, Dict
+
+import fast_json
+
+_EVENT_HEADER = b"id:%d\nevent:%s\n:HTTP_STATUS/200\ndata:"
+_EVENT_END = b"\n\n"
+
+def _escape(text: str) -> bytes:
+    """将字符串编码为带引号的JSON字符串字节"""
+    return fast_json.dumps_bytes(text)
+
+def _header(event_type: str) -> bytes:
+    """事件头模板，只保留事件ID占位符"""
+    return b"id:%d\nevent:" + event_type.encode("ascii") + b"\n:HTTP_STATUS/200\ndata:"
+
+_HEADER_MESSAGE_START = _header("message_start")
+_HEADER_CONTENT_BLOCK_START = _header("content_block_start")
+_HEADER_CONTENT_BLOCK_DELTA = _header("content_block_delta")
+_HEADER_CONTENT_BLOCK_STOP = _header("content_block_stop")
+_HEADER_PING = _header("ping")
+_HEADER_MESSAGE_DELTA = _header("message_delta")
+_HEADER_MESSAGE_STOP = _header("message_stop")
+
+_MESSAGE_START_PREFIX = b'{"type": "message_start", "message": {"model": '
+_MESSAGE_START_MIDDLE = b', "role": "assistant", "id": '
+_MESSAGE_START_SUFFIX = b', "type": "message", "content": [], "usage": {"input_tokens": 0, "output_tokens": 0}}}\n\n'
+_TEXT_BLOCK_START = b'{"type": "content_block_start", "content_block": {"type": "text", "text": ""}, "index": %d}\n\n'
+_TEXT_DELTA_PREFIX = b'{"delta": {"type": "text_delta", "text": '
+_TEXT_DELTA_SUFFIX = b'}, "type": "content_block_delta", "index": %d}\n\n'
+_CONTENT_BLOCK_STOP = b'{"type": "content_block_stop", "index": %d}\n\n'
+_PING = b'{"type": "ping"}\n\n'
+_MESSAGE_DELTA_PREFIX = b'{"delta": {"stop_reason": '
+_MESSAGE_DELTA_SUFFIX = b'}, "type": "message_delta", "usage": {"input_tokens": %d, "output_tokens": %d, "cache_read_input_tokens": %d}}\n\n'
+_MESSAGE_STOP = b'{"type": "message_stop"}\n\n'
+
+class SSEEncoder:
+    """Claude SSE 事件编码器，维护递增的事件ID"""
+
+    __slots__ = ("event_id",)
+
+    def __init__(self):
+        self.event_id = 0
+
+    def reset(self):
+        """重置事件ID"""
+        self.event_id = 0
+
+    def _next_id(self) -> int:
+        self.event_id += 1
+        return self.event_id
+
+    def event(self, event_type: str, data: Dict[str, Any]) -> bytes:
+        """通用事件编码（用于工具调用等不常见事件）"""
+        return (_EVENT_HEADER % (self._next_id(), event_type.encode("ascii"))
+                + fast_json.dumps_bytes(data) + _EVENT_END)
+
+    def message_start(self, message_id: str, model: str) -> bytes:
+        return (_HEADER_MESSAGE_START % self._next_id() + _MESSAGE_START_PREFIX + _escape(model)
+                + _MESSAGE_START_MIDDLE + _escape(message_id) + _MESSAGE_START_SUFFIX)
+
+    def text_block_start(self, index: int = 0) -> bytes:
+        return _HEADER_CONTENT_BLOCK_START % self._next_id() + _TEXT_BLOCK_START % index
+
+    def text_delta(self, text: str, index: int = 0) -> bytes:
+        return (_HEADER_CONTENT_BLOCK_DELTA % self._next_id() + _TEXT_DELTA_PREFIX + _escape(text)
+                + _TEXT_DELTA_SUFFIX % index)
+
+    def content_block_stop(self, index: int = 0) -> bytes:
+        return _HEADER_CONTENT_BLOCK_STOP % self._next_id() + _CONTENT_BLOCK_STOP % index
+
+    def ping(self) -> bytes:
+        return _HEADER_PING % self._next_id() + _PING
+
+    def message_delta(self, stop_reason: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> bytes:
+        return (_HEADER_MESSAGE_DELTA % self._next_id() + _MESSAGE_DELTA_PREFIX + _escape(stop_reason)
+                + _MESSAGE_DELTA_SUFFIX % (input_tokens, output_tokens, cached_tokens))
+
+    def message_stop(self) -> bytes:
+        return _HEADER_MESSAGE_STOP % self._next_id() + _MESSAGE_STOP
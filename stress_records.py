@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+并发请求记录正确性测试
+在临时目录的数据库上，通过模拟的上游平台同时发起大量流式请求（全局直连模式，经 handle_multi_platform_request 转发），
+检查每条保存的记录（请求体、响应体、原始响应、模型和Token用量）都属于它自己的请求，没有串到其他请求上
+
+用法: python stress_records.py [并发数] [每个响应的数据块数]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+# 数据库文件为当前目录下的 api_records.db，切换到临时目录，不影响正在使用的数据库
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+os.chdir(tempfile.mkdtemp(prefix="redwolf_stress_"))
+
+import httpx
+
+import main
+from blob_store import blob_store
+from conversation_store import conversation_store
+from database import SessionLocal, PlatformConfig, RoutingConfig, UserKey, APIRecord
+from platforms import PlatformType
+
+TARGET_MODEL = "stress-model"
+USER_KEY = "lxs_stress_test"
+MARKER_PATTERN = re.compile(r"REQ\d{5}")
+
+# 每个请求都会输出多行转发日志，测试时只显示警告和错误
+logging.getLogger().setLevel(logging.WARNING)
+
+def setup_database():
+    """添加一个 OpenAI 兼容平台、全局直连路由和用户KEY"""
+    db = SessionLocal()
+    try:
+        db.add(PlatformConfig(platform_type="openai_compatible", api_key="stress", base_url="http://upstream", enabled=True, timeout=60))
+        db.add(RoutingConfig(
+            config_name="stress", config_type="global_direct", is_active=True,
+            config_data=json.dumps({"model_priority_list": [f"openai_compatible:{TARGET_MODEL}"]})
+        ))
+        db.add(UserKey(key_name="stress", api_key=USER_KEY))
+        db.commit()
+    finally:
+        db.close()
+    main.config_data.update({"use_multi_platform": True, "current_work_mode": "global_direct"})
+
+def expected_usage(index: int):
+    """每个请求的上游usage不同，用于检查Token用量是否记到了正确的记录上"""
+    return 1000 + index, 10 + index
+
+def make_upstream(chunks: int):
+    async def upstream(request: httpx.Request) -> httpx.Response:
+        marker = json.loads(request.content)["messages"][-1]["content"]
+        index = int(marker[3:])
+        prompt_tokens, completion_tokens = expected_usage(index)
+
+        async def stream():
+            for i in range(chunks):
+                # 随机延迟，让各个流的数据块交错到达
+                await asyncio.sleep(random.random() * 0.01)
+                event = {"id": f"chatcmpl-{marker}", "choices": [{"delta": {"content": f"{marker}-part{i} "}, "finish_reason": None}]}
+                yield f"data: {json.dumps(event)}\n\n".encode()
+            done = {"id": f"chatcmpl-{marker}", "choices": [{"delta": {}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}}
+            yield f"data: {json.dumps(done)}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(200, content=stream(), headers={"content-type": "text/event-stream"})
+    return upstream
+
+async def run_requests(concurrency: int, chunks: int) -> float:
+    service = main.multi_platform_service
+    db = SessionLocal()
+    try:
+        await service.start(db)
+    finally:
+        db.close()
+    service.platform_manager.get_platform(PlatformType.OPENAI_COMPATIBLE).client = httpx.AsyncClient(
+        transport=httpx.MockTransport(make_upstream(chunks))
+    )
+    main.record_writer.start()
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://proxy", timeout=120) as client:
+        async def one(index: int):
+            marker = f"REQ{index:05d}"
+            body = {"model": f"client-model-{index}", "stream": True, "messages": [{"role": "user", "content": marker}]}
+            response = await client.post("/v1/messages", json=body, headers={"authorization": f"Bearer {USER_KEY}"})
+            assert response.status_code == 200, f"{marker}: HTTP {response.status_code}"
+            assert f"{marker}-part{chunks - 1}" in response.text, f"{marker}: 客户端收到的响应不完整"
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    await main.record_writer.stop()
+    return elapsed
+
+def check_records(concurrency: int, chunks: int) -> list:
+    """返回所有不正确的记录的说明"""
+    errors = []
+    db = SessionLocal()
+    try:
+        records = db.query(APIRecord).all()
+        if len(records) != concurrency:
+            errors.append(f"记录数 {len(records)}，应为 {concurrency}")
+        seen = set()
+        for record in records:
+            fields = blob_store.load_fields(db, record)
+            body = json.loads(conversation_store.restore_body(db, record, fields["body"]))
+            marker = body["messages"][-1]["content"]
+            index = int(marker[3:])
+            seen.add(index)
+            prompt_tokens, completion_tokens = expected_usage(index)
+            checks = {
+                "请求体模型": body.get("model") == f"client-model-{index}",
+                "目标模型": record.target_model == TARGET_MODEL,
+                "发送给大模型的请求": marker in (fields["processed_prompt"] or ""),
+                "大模型原始响应": all(f"{marker}-part{i}" in (fields["model_raw_response"] or "") for i in range(chunks)),
+                "返回给客户端的响应": all(f"{marker}-part{i}" in (fields["response_body"] or "") for i in range(chunks)),
+                "输入Token": record.input_tokens == prompt_tokens,
+                "输出Token": record.output_tokens == completion_tokens,
+            }
+            # 记录中出现的请求标记只能是它自己的
+            texts = (fields["processed_prompt"], fields["model_raw_response"], fields["response_body"])
+            checks["没有混入其他请求"] = all(set(MARKER_PATTERN.findall(text or "")) <= {marker} for text in texts)
+            failed = [name for name, ok in checks.items() if not ok]
+            if failed:
+                errors.append(f"记录 {record.id} ({marker}): {', '.join(failed)}")
+        missing = set(range(concurrency)) - seen
+        if missing:
+            errors.append(f"缺少 {len(missing)} 个请求的记录，例如 REQ{min(missing):05d}")
+    finally:
+        db.close()
+    return errors
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    chunks = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f"🚀 并发记录测试: {concurrency} 个并发流式请求，每个响应 {chunks} 个数据块")
+    setup_database()
+    elapsed = asyncio.run(run_requests(concurrency, chunks))
+    errors = check_records(concurrency, chunks)
+    print(f"⏱️ 全部请求完成: {elapsed:.2f} 秒")
+    if errors:
+        for error in errors[:20]:
+            print(f"❌ {error}")
+        print(f"❌ {len(errors)} 个问题")
+        sys.exit(1)
+    print(f"✅ {concurrency} 条记录全部正确")
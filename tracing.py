@@ -0,0 +1,139 @@
+"""
+调试追踪模块
+trace() 的消息按 logging 的 % 风格惰性格式化：没有开启DEBUG_MODE且当前请求没有被采样时直接返回，
+不做任何格式化；被采样的请求把结构化追踪事件（JSON Lines）写入滚动文件
+"""
+
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import secrets
+import time
+from typing import Any, Optional
+
+import fast_json
+
+DEBUG_MODE = os.getenv('DEBUG_MODE', 'false').lower() == 'true'
+
+# 采样配置
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))      # 按比例采样请求，如 0.01 表示1%
+TRACE_USER_KEYS = {                                                  # 总是追踪的用户KEY ID（逗号分隔）
+    int(key_id) for key_id in os.getenv('TRACE_USER_KEYS', '').split(',') if key_id.strip().isdigit()
+}
+TRACE_FILE = os.getenv('TRACE_FILE', './logs/trace.jsonl')
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', '5'))
+
+# 没有开启任何追踪时，trace() 只做一次布尔判断
+SAMPLING_ENABLED = TRACE_SAMPLE_RATE > 0 or bool(TRACE_USER_KEYS)
+TRACING_ENABLED = DEBUG_MODE or SAMPLING_ENABLED
+
+logger = logging.getLogger(__name__)
+
+class RequestTrace:
+    """被采样的请求"""
+
+    __slots__ = ("trace_id", "user_key_id", "start_time")
+
+    def __init__(self, user_key_id: Optional[int] = None):
+        self.trace_id = secrets.token_hex(8)
+        self.user_key_id = user_key_id
+        self.start_time = time.time()
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+_trace_logger: Optional[logging.Logger] = None
+_trace_listener: Optional[logging.handlers.QueueListener] = None
+
+def _get_trace_logger() -> logging.Logger:
+    """首次写入时创建追踪文件，由后台线程写盘，避免阻塞事件循环"""
+    global _trace_logger, _trace_listener
+    if _trace_logger is None:
+        directory = os.path.dirname(TRACE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        event_queue: queue.Queue = queue.Queue(-1)
+        _trace_listener = logging.handlers.QueueListener(event_queue, file_handler)
+        _trace_listener.start()
+        atexit.register(_trace_listener.stop)
+
+        trace_logger = logging.getLogger("redwolf.trace")
+        trace_logger.setLevel(logging.INFO)
+        trace_logger.propagate = False
+        trace_logger.addHandler(logging.handlers.QueueHandler(event_queue))
+        _trace_logger = trace_logger
+        logger.info(f"🔍 [Trace] 请求追踪已启用: 采样率={TRACE_SAMPLE_RATE}, 指定KEY={sorted(TRACE_USER_KEYS)}, 文件={TRACE_FILE}")
+    return _trace_logger
+
+def start_trace(user_key_id: Optional[int] = None, **fields: Any) -> Optional[RequestTrace]:
+    """请求开始时决定是否采样，采样到的请求在当前上下文中记录追踪事件"""
+    if not SAMPLING_ENABLED:
+        return None
+    if user_key_id not in TRACE_USER_KEYS and random.random() >= TRACE_SAMPLE_RATE:
+        _current_trace.set(None)
+        return None
+    request_trace = RequestTrace(user_key_id)
+    _current_trace.set(request_trace)
+    _write_event(request_trace, "trace_start", fields)
+    return request_trace
+
+def end_trace(**fields: Any):
+    """请求结束，记录耗时"""
+    request_trace = _current_trace.get()
+    if request_trace is None:
+        return
+    fields["duration_ms"] = int((time.time() - request_trace.start_time) * 1000)
+    _write_event(request_trace, "trace_end", fields)
+    _current_trace.set(None)
+
+def is_tracing() -> bool:
+    """当前是否需要输出追踪信息（用于保护代价较高的调试代码）"""
+    return TRACING_ENABLED and (DEBUG_MODE or _current_trace.get() is not None)
+
+def trace(message: str, *args: Any, **fields: Any):
+    """
+    输出调试追踪信息，消息按 % 风格惰性格式化
+    DEBUG_MODE 下打印到标准输出；当前请求被采样时写入追踪文件，fields 作为结构化字段
+    """
+    if not TRACING_ENABLED:
+        return
+    request_trace = _current_trace.get()
+    if request_trace is None and not DEBUG_MODE:
+        return
+
+    text = message % args if args else message
+    if DEBUG_MODE:
+        if fields:
+            print(text, fields)
+        else:
+            print(text)
+    if request_trace is not None:
+        _write_event(request_trace, text, fields)
+
+def _write_event(request_trace: RequestTrace, event: str, fields: dict):
+    record = {
+        "ts": round(time.time(), 6),
+        "trace_id": request_trace.trace_id,
+        "user_key_id": request_trace.user_key_id,
+        "event": event
+    }
+    if fields:
+        record.update(fields)
+    try:
+        _get_trace_logger().info(fast_json.dumps({key: _jsonable(value) for key, value in record.items()}))
+    except Exception as e:
+        logger.error(f"❌ [Trace] 写入追踪事件失败: {e}")
+
+def _jsonable(value: Any) -> Any:
+    """追踪字段只保留可以序列化为JSON的基础类型，其余转为字符串"""
+    if value is None or isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    return str(value)